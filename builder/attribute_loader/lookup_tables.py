@@ -0,0 +1,99 @@
+'''
+in-memory copies of the identifiers and attributes tables, for
+resolving a whole association file without a query per gene or
+attribute. the lookups match the way the queries compare values:
+
+ * symbol = ?, exact
+ * external_id = ?, case insensitive, as the column is collate nocase
+ * name = ?, exact
+ * lower(name) = ?, with sqlite's lower(), which only folds ascii
+
+nocase and lower() both only fold ascii letters, so the keys are
+folded the same way rather than with python's lower().
+
+values matching more than one row are kept to one side, so they can
+raise the same 'multiple ids' errors as the queries.
+'''
+
+import numpy as np
+import pandas as pd
+
+ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+
+def ascii_lower(value):
+    return value.translate(ASCII_LOWER)
+
+
+class LookupTable(object):
+    '''
+    ids of a set of keys, with vectorized lookup
+    '''
+
+    def __init__(self, keys, ids, fold=None):
+        self.fold = fold
+
+        # null never equals anything in sql
+        keys = pd.Series(keys, dtype=object).reset_index(drop=True)
+        present = keys.notna().to_numpy()
+        keys, ids = keys[present], np.asarray(ids, dtype=np.int64)[present]
+        if fold:
+            keys = keys.map(fold)
+
+        counts = keys.value_counts()
+        unique = ~keys.duplicated(keep=False)
+
+        # -1 on the end, for positions of -1 from get_indexer
+        self.index = pd.Index(keys[unique])
+        self.ids = np.append(ids[unique.to_numpy()], -1)
+        self.ambiguous = set(counts.index[counts > 1])
+
+    def lookup(self, values):
+        '''
+        (ids, ambiguous) of the values, the id of each or -1 where not
+        found, and a mask of those matching more than one row. the
+        distinct values are looked up, rather than each of them
+        '''
+
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        if self.fold:
+            uniques = [self.fold(value) for value in uniques]
+        else:
+            uniques = list(uniques)
+
+        ids = self.ids[self.index.get_indexer(uniques)]
+        ambiguous = np.array([value in self.ambiguous for value in uniques], dtype=bool)
+        return ids[codes], ambiguous[codes]
+
+
+def load_identifiers(db):
+    '''
+    symbol lookup of the identifiers table
+    '''
+
+    identifiers = pd.read_sql_query("select node_id, symbol from identifiers", db.connection())
+    return LookupTable(identifiers['symbol'], identifiers['node_id'].astype(np.int64))
+
+
+def load_attributes(db, attribute_group_id, field_name, fold=None):
+    '''
+    lookup of the attributes in a group by external_id or name
+    '''
+
+    attributes = pd.read_sql_query("select id, %s from attributes where attribute_group_id = ?" % field_name,
+                                   db.connection(), params=[attribute_group_id])
+    return LookupTable(attributes[field_name], attributes['id'], fold)
+
+
+def warn_new(logger, message, values, warned):
+    '''
+    log a warning for each value not warned about before, in order
+    '''
+    for value in pd.unique(pd.Series(values, dtype=object)):
+        if value not in warned:
+            warned.add(value)
+            logger.warning(message % value)
+
+
+def write_pairs(f, node_ids, attribute_ids):
+    f.writelines('%d\t%d\n' % pair for pair in zip(node_ids.tolist(), attribute_ids.tolist()))
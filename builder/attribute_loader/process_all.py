@@ -22,6 +22,10 @@ ASSOC_FORMAT_SIMPLE = 1
 # each record is attribute-id attribute-name  gene-id gene-name other-gene-identifiers
 ASSOC_FORMAT_MULTI_ID = 2
 
+# resolve associations against identifiers and attributes held in memory,
+# rather than querying the db for each
+PRELOAD = True
+
 class AttributeMetadata(object):
     def __init__(self, assoc_file, desc_file, name, code, desc, 
                  linkout_label, linkout_url, default_selected, 
@@ -158,10 +162,10 @@ def process_attribute_set(coredb, db, generic_db_dir, organism_id, metadata):
     # load associations
     logger.info("attribute-gene associations: %s" % metadata.assoc_file)
     if metadata.assoc_format == 1:
-        assocLoader = process_attribute_associations.AttributeAssociationLoader(db, generic_db_dir)
+        assocLoader = process_attribute_associations.AttributeAssociationLoader(db, generic_db_dir, PRELOAD)
         assocLoader.process(organism_id, attribute_group_id, metadata.assoc_file, metadata.attributes_identified_by)
     elif metadata.assoc_format == 2:
-        assocLoader = process_attribute_associations2.AttributeAssociationLoader2(db, generic_db_dir)
+        assocLoader = process_attribute_associations2.AttributeAssociationLoader2(db, generic_db_dir, PRELOAD)
         assocLoader.process(organism_id, attribute_group_id, metadata.assoc_file)
     else:
         raise Exception("unknown association file format: " + metadata.assoc_format)
@@ -6,16 +6,27 @@ have been loaded
 
 import logging, os
 import unittest, tempfile, shutil
-from . import utils, dbtools, test_support, process_attributes, process_identifiers
+import numpy as np
+from . import utils, dbtools, test_support, process_attributes, process_identifiers, lookup_tables
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+
+# gene/attribute pairs resolved at a time with preload
+BATCH_SIZE = 1000000
  
 class AttributeAssociationLoader(object):
+    '''
+    with preload, the identifiers and the attributes of the group are
+    read from the db into memory once, and the association file is
+    resolved against them a batch of pairs at a time, rather than with
+    a query for each gene and attribute. the output is the same
+    '''
 
-    def __init__(self, db, generic_db_dir):
+    def __init__(self, db, generic_db_dir, preload=False):
         self.db = db
         self.generic_db_dir = generic_db_dir        
+        self.preload = preload
         self.clear_cache()
     
     def clear_cache(self):
@@ -36,6 +47,9 @@ class AttributeAssociationLoader(object):
         if not attributes_identified_by in ['name', 'external_id']:
             raise Exception("unexpected value for attributes_identified_by: '%s'" % attributes_identified_by)
 
+        if self.preload:
+            return self.load_preloaded(attribute_group_id, raw_filename, processed_filename, attributes_identified_by)
+
         self.clear_cache() # for safety accross multiple loads for different organisms/attribute groups        
         total = 0
         num_loaded = 0
@@ -66,6 +80,50 @@ class AttributeAssociationLoader(object):
             
 
 
+        return num_loaded, total
+
+    def load_preloaded(self, attribute_group_id, raw_filename, processed_filename, attributes_identified_by):
+
+        identifiers = lookup_tables.load_identifiers(self.db)
+        attributes = lookup_tables.load_attributes(self.db, attribute_group_id, attributes_identified_by,
+                                                   lookup_tables.ascii_lower)
+        warned_genes, warned_attributes = set(), set()
+
+        total = 0
+        num_loaded = 0
+
+        with open(processed_filename, 'w') as processed_file:
+            for genes, raw_attributes in utils.sparse_attribute_profile_batches(raw_filename, BATCH_SIZE):
+                total += len(genes)
+
+                attribute_values = raw_attributes
+                if attributes_identified_by == 'name':
+                    # lower(name) = attribute.lower()
+                    attribute_values = [attribute.lower() for attribute in raw_attributes]
+
+                node_ids, gene_errors = identifiers.lookup(genes)
+                attribute_ids, attribute_errors = attributes.lookup(attribute_values)
+                found = node_ids >= 0
+
+                # the errors the queries give, whichever comes first
+                attribute_errors &= found
+                errors = np.flatnonzero(gene_errors | attribute_errors)
+                if len(errors):
+                    if gene_errors[errors[0]]:
+                        raise Exception("multiple ids for gene '%s'" % genes[errors[0]])
+                    raise Exception("multiple ids for attribute '%s'" % raw_attributes[errors[0]])
+
+                lookup_tables.warn_new(logger, "Failed to find gene '%s'", np.asarray(genes, dtype=object)[~found],
+                                       warned_genes)
+                missing = found & (attribute_ids < 0)
+                lookup_tables.warn_new(logger, "Failed to find attribute '%s'",
+                                       np.asarray(raw_attributes, dtype=object)[missing],
+                                       warned_attributes)
+
+                loaded = found & (attribute_ids >= 0)
+                num_loaded += int(loaded.sum())
+                lookup_tables.write_pairs(processed_file, node_ids[loaded], attribute_ids[loaded])
+
         return num_loaded, total
     
     def lookup_node_id(self, gene):
@@ -187,4 +245,67 @@ class TestAttributeAssociationLoader(unittest.TestCase):
         self.assertEqual(8, total, "check total")
 
         db.close()
-        
\ No newline at end of file
+
+
+class TestPreload(unittest.TestCase):
+
+    identifiers = 'Org:1\tgene1\tsource1\nOrg:1\tGene1b\tsource2\nOrg:3\tgene2\tsource1\nOrg:4\tgene4\tsource1\n'
+    attributes = 'attr1\tattr1_name\tdesc\nattr2\tAttr2_Name\tdesc\nATTR3\tattr3_name\tdesc\n'
+    associations = ('gene1\tattr1\tATTR2\tattr3\n'
+                    'gene2\tAttr1\tunknown_attribute\n'
+                    'unknown_gene\tattr1\n'
+                    'gene1b\tattr1\n'
+                    'Gene1b\tattr1_NAME\tattr2_name\n'
+                    'gene4\tattr2\tattr3_name\tattr2\n')
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, name, data):
+        filename = os.path.join(self.tempdir, name)
+        with open(filename, 'w') as f:
+            f.write(data)
+        return filename
+
+    def test_preload(self):
+        coredb = dbtools.CoreDB(os.path.join(self.tempdir, 'core.sqlite'))
+        coredb.create_tables()
+        db = dbtools.OrgDB(os.path.join(self.tempdir, 'org.sqlite'))
+        db.create_tables()
+
+        process_identifiers.IdentifierLoader(db).process(self.write('identifiers.txt', self.identifiers))
+        attribute_group_id = process_attributes.AttributeLoader(coredb, db).process(
+            1, 'group_name', 'code', 'group description', 'linkout label', 'http://linkout.template/{1}', 0,
+            'publication name', 'http://publication.url', self.write('attributes.txt', self.attributes))
+        associations_file = self.write('associations.txt', self.associations)
+
+        loaded = {}
+        for attributes_identified_by in ['external_id', 'name']:
+            results = []
+            for preload in [False, True]:
+                generic_db_dir = os.path.join(self.tempdir, 'generic_db_%s' % preload)
+                loader = AttributeAssociationLoader(db, generic_db_dir, preload)
+                processed_filename, num_loaded, total = loader.process(1, attribute_group_id, associations_file,
+                                                                       attributes_identified_by)
+                with open(processed_filename) as f:
+                    results.append((f.read(), num_loaded, total))
+
+            self.assertEqual(results[0], results[1], attributes_identified_by)
+            self.assertEqual(12, results[1][2])
+            loaded[attributes_identified_by] = results[1][1]
+
+        # external ids compared case insensitively, names lower cased
+        self.assertEqual({'external_id': 6, 'name': 3}, loaded)
+
+        # the same error for a symbol of more than one gene
+        db.connection().execute("insert into identifiers values ('5', 'gene2', 'source2')")
+        for preload in [False, True]:
+            loader = AttributeAssociationLoader(db, self.tempdir, preload)
+            with self.assertRaisesRegex(Exception, "multiple ids for gene 'gene2'"):
+                loader.process(1, attribute_group_id, associations_file, 'external_id')
+
+        db.close()
+        coredb.close()
@@ -14,18 +14,29 @@ This script loads attribute data, once gene identifiers
 and attribute identifiers have been loaded
 '''
 
-import sqlite3, logging, os
+import sqlite3, logging, os, itertools
 import unittest, tempfile, shutil
-from . import utils, dbtools, process_attributes, process_identifiers, test_support
+import numpy as np
+from . import utils, dbtools, process_attributes, process_identifiers, test_support, lookup_tables
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+
+# records resolved at a time with preload
+BATCH_SIZE = 100000
  
 class AttributeAssociationLoader2(object):
+    '''
+    with preload, the identifiers and the attributes of the group are
+    read from the db into memory once, and the association file is
+    resolved against them a batch of records at a time, rather than with
+    a query for each gene and attribute. the output is the same
+    '''
 
-    def __init__(self, db, generic_db_dir):
+    def __init__(self, db, generic_db_dir, preload=False):
         self.db = db
         self.generic_db_dir = generic_db_dir        
+        self.preload = preload
         self.clear_cache()
     
     def clear_cache(self):
@@ -41,6 +52,9 @@ class AttributeAssociationLoader2(object):
                    
     def load(self, attribute_group_id, raw_filename, processed_filename):
         
+        if self.preload:
+            return self.load_preloaded(attribute_group_id, raw_filename, processed_filename)
+
         self.clear_cache() # for safety accross multiple loads for different organisms/attribute groups        
         total = 0
         num_loaded = 0
@@ -70,6 +84,63 @@ class AttributeAssociationLoader2(object):
                     line = '%d\t%d\n' % (node_id, attribute_id)
                     processed_file.write(line)
         return num_loaded, total
+
+    def load_preloaded(self, attribute_group_id, raw_filename, processed_filename):
+
+        identifiers = lookup_tables.load_identifiers(self.db)
+        by_external_id = lookup_tables.load_attributes(self.db, attribute_group_id, 'external_id',
+                                                       lookup_tables.ascii_lower)
+        by_name = lookup_tables.load_attributes(self.db, attribute_group_id, 'name')
+        warned_genes = set()
+
+        total = 0
+        num_loaded = 0
+        records = utils.enhanced_attribute_profile_reader(raw_filename)
+
+        with open(processed_filename, 'w') as processed_file:
+            while True:
+                batch = list(itertools.islice(records, BATCH_SIZE))
+                if not batch:
+                    break
+                total += len(batch)
+
+                # the attribute of each record, by external id then name
+                external_ids = [attributes[0] for attributes, genes in batch]
+                names = [attributes[1] for attributes, genes in batch]
+                attribute_ids, external_id_errors = by_external_id.lookup(external_ids)
+                by_name_ids, name_errors = by_name.lookup(names)
+                name_errors &= (attribute_ids < 0) & ~external_id_errors
+                attribute_ids = np.where(attribute_ids >= 0, attribute_ids, by_name_ids)
+
+                # each gene, with the attribute of its record
+                record = np.repeat(np.arange(len(batch)), [len(genes) for attributes, genes in batch])
+                genes = [gene for attributes, genes in batch for gene in genes]
+                node_ids, gene_errors = identifiers.lookup(genes)
+                found = node_ids >= 0
+
+                # the errors the queries give, whichever comes first. the
+                # attribute is looked up for each gene that's found
+                attribute_errors = found & (external_id_errors | name_errors)[record]
+                errors = np.flatnonzero(gene_errors | attribute_errors)
+                if len(errors):
+                    if gene_errors[errors[0]]:
+                        raise Exception("multiple ids for gene '%s'" % genes[errors[0]])
+                    attributes = batch[record[errors[0]]][0]
+                    raise Exception("multiple ids for attribute '%s'" %
+                                    (attributes[0] if external_id_errors[record[errors[0]]] else attributes[1]))
+
+                lookup_tables.warn_new(logger, "Failed to find gene '%s'", np.asarray(genes, dtype=object)[~found],
+                                       warned_genes)
+
+                gene_attribute_ids = attribute_ids[record]
+                for position in np.flatnonzero(found & (gene_attribute_ids < 0)).tolist():
+                    logger.warning("Failed to find attribute '%s'" % repr(batch[record[position]][0]))
+
+                loaded = found & (gene_attribute_ids >= 0)
+                num_loaded += int(loaded.sum())
+                lookup_tables.write_pairs(processed_file, node_ids[loaded], gene_attribute_ids[loaded])
+
+        return num_loaded, total
     
     def lookup_node_id(self, gene):
         
@@ -183,4 +254,62 @@ class TestAttributeAssociationLoader(unittest.TestCase):
         self.assertEqual(5, total, "check total")
 
         db.close()
-        
\ No newline at end of file
+
+
+class TestPreload(unittest.TestCase):
+
+    identifiers = 'Org:1\tgene1\tsource1\nOrg:1\tgene1b\tsource2\nOrg:3\tgene2\tsource1\nOrg:4\tgene4\tsource1\n'
+    attributes = 'attr1\tattr1_name\tdesc\nattr2\tAttr2_Name\tdesc\nATTR3\tattr3_name\tdesc\n'
+    associations = ('attr1\tattr1_name\tgene1\tgene1b\n'
+                    'Attr3\t\tgene2\tunknown-gene\n'
+                    '\tAttr2_Name\t\tgene4\n'
+                    '\tattr2_name\tgene4\n'
+                    'unknown\tattr1_name\tgene2\tgene4\n'
+                    'too_few\tfields\n'
+                    'attr1\t\t\tunknown-gene\n')
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, name, data):
+        filename = os.path.join(self.tempdir, name)
+        with open(filename, 'w') as f:
+            f.write(data)
+        return filename
+
+    def test_preload(self):
+        coredb = dbtools.CoreDB(os.path.join(self.tempdir, 'core.sqlite'))
+        coredb.create_tables()
+        db = dbtools.OrgDB(os.path.join(self.tempdir, 'org.sqlite'))
+        db.create_tables()
+
+        process_identifiers.IdentifierLoader(db).process(self.write('identifiers.txt', self.identifiers))
+        attribute_group_id = process_attributes.AttributeLoader(coredb, db).process(
+            1, 'group_name', 'code', 'group description', 'linkout label', 'http://linkout.template/{1}', 0,
+            'publication name', 'http://publication.url', self.write('attributes.txt', self.attributes))
+        associations_file = self.write('associations.txt', self.associations)
+
+        results = []
+        for preload in [False, True]:
+            generic_db_dir = os.path.join(self.tempdir, 'generic_db_%s' % preload)
+            loader = AttributeAssociationLoader2(db, generic_db_dir, preload)
+            processed_filename, num_loaded, total = loader.process(1, attribute_group_id, associations_file)
+            with open(processed_filename) as f:
+                results.append((f.read(), num_loaded, total))
+
+        self.assertEqual(results[0], results[1])
+        self.assertEqual((6, 6), results[1][1:])
+
+        # the same error for an external id of more than one attribute
+        db.connection().execute("insert into attributes (id, organism_id, attribute_group_id, external_id, name) "
+                                "values (100, 1, ?, 'ATTR1', 'other')", [attribute_group_id])
+        for preload in [False, True]:
+            loader = AttributeAssociationLoader2(db, self.tempdir, preload)
+            with self.assertRaisesRegex(Exception, "multiple ids for attribute 'attr1'"):
+                loader.process(1, attribute_group_id, associations_file)
+
+        db.close()
+        coredb.close()
@@ -5,7 +5,7 @@ shared stuff for:
   
 '''
 
-import codecs
+import codecs, itertools
 SEP = '\t'
 ENCODING="utf8"
 
@@ -31,6 +31,31 @@ def sparse_attribute_profile_reader(filename, sep=SEP, encoding=ENCODING):
             for attribute in parts[1:]:
                 yield (gene, attribute)
 
+def sparse_attribute_profile_batches(filename, batch_size, sep=SEP, encoding=ENCODING):
+    '''
+    the pairs of sparse_attribute_profile_reader() as a (genes, attributes)
+    pair of lists, about batch_size pairs at a time
+    '''
+
+    genes, attributes = [], []
+    with codecs.open(filename, encoding=encoding, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            parts = line.split(sep)
+
+            if len(parts) < 2:
+                raise Exception("gene but no attributes? >>>%s<<<" % line)
+
+            genes.extend(itertools.repeat(parts[0], len(parts) - 1))
+            attributes.extend(itertools.islice(parts, 1, None))
+
+            if len(genes) >= batch_size:
+                yield genes, attributes
+                genes, attributes = [], []
+
+    if genes:
+        yield genes, attributes
+
 def enhanced_attribute_profile_reader(filename, sep=SEP, encoding=ENCODING):
     '''
     given a file in format:
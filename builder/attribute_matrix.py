@@ -0,0 +1,277 @@
+'''
+gene x attribute matrices of the ATTRIBUTES folder of generic_db, which
+has a text file of node id/linearized attribute id lines per attribute
+group, named {attribute group id}.txt.
+
+each group is stored as a compressed sparse row matrix in a .npz file,
+{attribute group id}.npz, along with a combined matrix of all the groups
+of each organism, organism.{organism id}.npz. the arrays are:
+
+ * node_ids, the node id of each row, sorted
+ * attribute_ids, the linearized attribute id of each column, sorted
+ * attribute_group_ids, the group of each column
+ * indptr and indices, the rows of the matrix, each the sorted
+   column positions of the attributes of the node
+ * version and organism_id
+
+load_matrix() gives an AttributeMatrix, which can give the matrix as
+a scipy sparse matrix for set operations, the attributes of a node, or
+the number of attributes shared by pairs of nodes, without re-parsing
+the text files.
+
+  python builder/attribute_matrix.py build result/generic_db result/attribute_matrices
+  python builder/attribute_matrix.py list result/attribute_matrices/organism.1.npz
+'''
+
+import argparse, os, glob
+import unittest, tempfile, shutil
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+VERSION = 1
+
+
+def load_pairs(filename):
+    '''
+    node id, linearized attribute id arrays of an attribute data file
+    '''
+
+    if os.path.getsize(filename) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    pairs = pd.read_csv(filename, sep='\t', header=None, usecols=[0, 1], dtype=np.int64)
+    return pairs[0].to_numpy(), pairs[1].to_numpy()
+
+
+def attribute_files(directory):
+    '''
+    (attribute group id, filename) of each group in an
+    ATTRIBUTES folder, ordered by group id
+    '''
+
+    groups = []
+    for filename in glob.glob(os.path.join(directory, '*.txt')):
+        group_id, ext = os.path.basename(filename).split('.')
+        groups.append((int(group_id), filename))
+
+    return sorted(groups)
+
+
+def load_attribute_groups(filename):
+    '''
+    dict of organism id by attribute group id, from ATTRIBUTE_GROUPS.txt
+    '''
+
+    groups = pd.read_csv(filename, sep='\t', header=None, usecols=[0, 1], dtype=np.int64)
+    return dict(zip(groups[0].tolist(), groups[1].tolist()))
+
+
+class AttributeMatrix(object):
+    '''
+    boolean node x attribute matrix, with the node id of each
+    row and linearized attribute id of each column
+    '''
+
+    def __init__(self, node_ids, attribute_ids, attribute_group_ids, indptr, indices, organism_id=0):
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.attribute_ids = np.asarray(attribute_ids, dtype=np.int64)
+        self.attribute_group_ids = np.asarray(attribute_group_ids, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.organism_id = int(organism_id)
+
+    @classmethod
+    def from_pairs(cls, node_ids, attribute_ids, attribute_group_ids, organism_id=0):
+        '''
+        matrix of the given node id, attribute id pairs. attribute_group_ids
+        is the group of each pair, duplicate pairs are merged
+        '''
+
+        nodes, rows = np.unique(np.asarray(node_ids, dtype=np.int64), return_inverse=True)
+        attributes, first, cols = np.unique(np.asarray(attribute_ids, dtype=np.int64),
+                                            return_index=True, return_inverse=True)
+        groups = np.asarray(attribute_group_ids, dtype=np.int64)[first]
+
+        matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                                   shape=(len(nodes), len(attributes)))
+        matrix.sum_duplicates()
+        return cls(nodes, attributes, groups, matrix.indptr, matrix.indices, organism_id)
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def shape(self):
+        return len(self.node_ids), len(self.attribute_ids)
+
+    def matrix(self):
+        '''
+        the matrix as a scipy csr matrix of booleans
+        '''
+        return sparse.csr_matrix((np.ones(len(self.indices), dtype=bool), self.indices, self.indptr),
+                                 shape=self.shape)
+
+    def pairs(self):
+        '''
+        node id, linearized attribute id arrays of each
+        pair, ordered by node id then attribute id
+        '''
+        rows = np.repeat(np.arange(len(self.node_ids)), np.diff(self.indptr))
+        return self.node_ids[rows], self.attribute_ids[self.indices]
+
+    def rows_of(self, node_ids):
+        '''
+        row of each of the node ids, -1 for those with no attributes
+        '''
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        rows = np.searchsorted(self.node_ids, node_ids)
+        rows[rows == len(self.node_ids)] = 0
+        found = len(self.node_ids) > 0 and self.node_ids[rows] == node_ids
+        return np.where(found, rows, -1)
+
+    def attributes_of(self, node_id):
+        '''
+        sorted linearized attribute ids of the node
+        '''
+        row = self.rows_of([node_id])[0]
+        if row < 0:
+            return np.zeros(0, dtype=np.int64)
+        return self.attribute_ids[self.indices[self.indptr[row]:self.indptr[row + 1]]]
+
+    def shared_counts(self, node_a, node_b):
+        '''
+        number of attributes each pair of node ids has in common
+        '''
+
+        rows_a, rows_b = self.rows_of(node_a), self.rows_of(node_b)
+        counts = np.zeros(len(rows_a), dtype=np.int64)
+        present = (rows_a >= 0) & (rows_b >= 0)
+        if present.any():
+            matrix = self.matrix()
+            shared = matrix[rows_a[present]].multiply(matrix[rows_b[present]])
+            counts[present] = np.asarray(shared.sum(axis=1)).ravel()
+        return counts
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            np.savez_compressed(f, version=VERSION, organism_id=self.organism_id,
+                                node_ids=self.node_ids, attribute_ids=self.attribute_ids,
+                                attribute_group_ids=self.attribute_group_ids,
+                                indptr=self.indptr, indices=self.indices)
+
+
+def load_matrix(filename):
+    with np.load(filename, allow_pickle=False) as data:
+        if int(data['version']) != VERSION:
+            raise Exception('unsupported attribute matrix version %s in %s' % (data['version'], filename))
+
+        return AttributeMatrix(data['node_ids'], data['attribute_ids'], data['attribute_group_ids'],
+                               data['indptr'], data['indices'], data['organism_id'])
+
+
+def build(generic_db_dir, output_dir):
+    '''
+    write the matrix of each attribute group in generic_db,
+    and the combined matrix of each organism
+    '''
+
+    organisms = load_attribute_groups(os.path.join(generic_db_dir, 'ATTRIBUTE_GROUPS.txt'))
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    combined = {}
+    for group_id, filename in attribute_files(os.path.join(generic_db_dir, 'ATTRIBUTES')):
+        if group_id not in organisms:
+            raise Exception('attribute group %s not in ATTRIBUTE_GROUPS.txt' % group_id)
+
+        node_ids, attribute_ids = load_pairs(filename)
+        groups = np.full(len(node_ids), group_id, dtype=np.int64)
+        AttributeMatrix.from_pairs(node_ids, attribute_ids, groups, organisms[group_id]) \
+            .save(os.path.join(output_dir, '%s.npz' % group_id))
+        combined.setdefault(organisms[group_id], []).append((node_ids, attribute_ids, groups))
+
+    for organism_id, pairs in sorted(combined.items()):
+        node_ids, attribute_ids, groups = [np.concatenate(arrays) for arrays in zip(*pairs)]
+        AttributeMatrix.from_pairs(node_ids, attribute_ids, groups, organism_id) \
+            .save(os.path.join(output_dir, 'organism.%s.npz' % organism_id))
+
+
+def list_matrix(filename):
+    matrix = load_matrix(filename)
+    print('organism %s: %s nodes, %s attributes, %s pairs' % (matrix.organism_id, matrix.shape[0],
+                                                            matrix.shape[1], len(matrix)))
+
+
+class TestAttributeMatrix(unittest.TestCase):
+
+    groups = '5\t1\tinterpro\n6\t1\tpfam\n7\t2\tinterpro\n'
+
+    attributes = {5: '10\t1\n11\t1\n10\t2\n',
+                  6: '12\t3\n10\t4\n10\t3\n',
+                  7: ''}
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.generic_db = os.path.join(self.tempdir, 'generic_db')
+        os.makedirs(os.path.join(self.generic_db, 'ATTRIBUTES'))
+        with open(os.path.join(self.generic_db, 'ATTRIBUTE_GROUPS.txt'), 'w') as f:
+            f.write(self.groups)
+        for group_id, data in self.attributes.items():
+            with open(os.path.join(self.generic_db, 'ATTRIBUTES', '%s.txt' % group_id), 'w') as f:
+                f.write(data)
+
+        self.output = os.path.join(self.tempdir, 'attribute_matrices')
+        build(self.generic_db, self.output)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_round_trip(self):
+        for group_id, filename in attribute_files(os.path.join(self.generic_db, 'ATTRIBUTES')):
+            matrix = load_matrix(os.path.join(self.output, '%s.npz' % group_id))
+            node_ids, attribute_ids = load_pairs(filename)
+
+            self.assertEqual(sorted(zip(node_ids.tolist(), attribute_ids.tolist())),
+                             list(zip(*[array.tolist() for array in matrix.pairs()])))
+            self.assertEqual(set([group_id]) if len(node_ids) else set(), set(matrix.attribute_group_ids.tolist()))
+
+        self.assertEqual(0, len(load_matrix(os.path.join(self.output, 'organism.2.npz'))))
+
+    def test_combined(self):
+        matrix = load_matrix(os.path.join(self.output, 'organism.1.npz'))
+        self.assertEqual(1, matrix.organism_id)
+        self.assertEqual((3, 4), matrix.shape)
+        self.assertEqual([10, 11, 12], matrix.node_ids.tolist())
+        self.assertEqual([5, 5, 6, 6], matrix.attribute_group_ids.tolist())
+
+        self.assertEqual([1, 2, 3, 4], matrix.attributes_of(10).tolist())
+        self.assertEqual([], matrix.attributes_of(99).tolist())
+        self.assertEqual([1, 1, 0, 4], matrix.shared_counts([10, 10, 11, 10], [11, 12, 12, 10]).tolist())
+
+        # shared counts of all the pairs at once
+        shared = (matrix.matrix().astype(np.int64) @ matrix.matrix().T.astype(np.int64)).toarray()
+        self.assertEqual([[4, 1, 1], [1, 1, 0], [1, 0, 1]], shared.tolist())
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='store generic_db attribute data as sparse gene x attribute matrices')
+    subparsers = parser.add_subparsers(dest='subparser_name')
+
+    parser_build = subparsers.add_parser('build', help='write the matrix of each attribute group and organism')
+    parser_build.add_argument('generic_db', help='generic_db folder, with ATTRIBUTE_GROUPS.txt and ATTRIBUTES')
+    parser_build.add_argument('output', help='folder to write the .npz files to')
+
+    parser_list = subparsers.add_parser('list', help='summarize a matrix file')
+    parser_list.add_argument('matrix', help='.npz matrix file')
+
+    args = parser.parse_args()
+
+    if args.subparser_name == 'build':
+        build(args.generic_db, args.output)
+    elif args.subparser_name == 'list':
+        list_matrix(args.matrix)
+    else:
+        raise Exception('unexpected command: "%s"' % args.subparser_name)
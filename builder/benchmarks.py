@@ -0,0 +1,495 @@
+"""
+timing comparisons for alternative implementations of
+pipeline steps, run against synthetic data of a given size.
+e.g.
+
+  python builder/benchmarks.py identifiers --genes 100000
+
+each benchmark also checks the alternatives produce the same output.
+"""
+
+import argparse, os, sys, time, tempfile, shutil, filecmp, contextlib, subprocess
+from io import StringIO
+import numpy as np
+import pandas as pd
+from identifiers import identifier_merger, parsers
+import merge_organisms
+import logging
+from attribute_loader import dbtools, process_identifiers, process_attributes
+from attribute_loader import process_attribute_associations, process_attribute_associations2
+from identifiers.constants import IDENTIFIER_ENGINES
+
+
+@contextlib.contextmanager
+def timer(label):
+    start = time.time()
+    yield
+    print('%s: %.2fs' % (label, time.time() - start))
+
+
+def write_synthetic_triplets(filename, num_genes, seed=0):
+    '''
+    id/symbol/source triplets with roughly the shape of
+    a melted ensembl identifier file: a gene name, entrez
+    and ensembl id, and a few synonyms per gene, with
+    some of the names and synonyms shared between genes
+    '''
+
+    rng = np.random.RandomState(seed)
+    names = rng.randint(0, int(num_genes * 0.95), num_genes)
+    entrez = rng.randint(0, int(num_genes * 0.98), num_genes)
+    synonyms = rng.randint(0, num_genes * 2, (num_genes, 3))
+
+    with open(filename, 'w') as f:
+        for i in range(num_genes):
+            node_id = i + 1
+            f.write('%d\tGENE%d\tGene Name\n' % (node_id, names[i]))
+            f.write('%d\tENSG%011d\tEnsembl Gene ID\n' % (node_id, i))
+            f.write('%d\t%d\tEntrez Gene ID\n' % (node_id, entrez[i]))
+            for synonym in synonyms[i]:
+                f.write('%d\tsyn%d\tSynonyms\n' % (node_id, synonym))
+
+
+def identifier_loading(args):
+    tempdir = tempfile.mkdtemp()
+    try:
+        triplets = os.path.join(tempdir, 'symbols.triplets')
+        write_synthetic_triplets(triplets, args.genes)
+
+        for bulk in [False, True]:
+            db_filename = os.path.join(tempdir, 'ids_%s.sqlite' % bulk)
+            with timer('load and index, bulk=%s' % bulk):
+                db = identifier_merger.IdentifierDB(db_filename, bulk=bulk)
+                db.drop_indices()
+                with open(triplets) as f:
+                    db.load_3col(f)
+                db.ensure_index()
+                db.close()
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def name_merging(args):
+    '''
+    merge() against merge_self_join(), with each gene name
+    shared by args.collisions entities
+    '''
+    for num_genes in args.genes:
+        triplets = []
+        for i in range(num_genes):
+            node_id = i + 1
+            triplets.append('%d\tGENE%d\tGene Name\n' % (node_id, i // args.collisions))
+            triplets.append('%d\tENSG%011d\tEnsembl Gene ID\n' % (node_id, i))
+
+        outputs = []
+        for method in ['merge_self_join', 'merge']:
+            db = identifier_merger.IdentifierDB(':memory:', StringIO())
+            db.load_3col(triplets)
+            with timer('%s, %d genes' % (method, num_genes)):
+                getattr(db, method)()
+
+            output = StringIO()
+            db.export_processed(output)
+            outputs.append((output.getvalue(), db.report.getvalue()))
+            db.close()
+
+        assert outputs[0] == outputs[1], "outputs differ"
+    print('outputs identical')
+
+
+def identifiers(args):
+    tempdir = tempfile.mkdtemp()
+    try:
+        triplets = os.path.join(tempdir, 'symbols.triplets')
+        write_synthetic_triplets(triplets, args.genes)
+
+        outputs = []
+        for engine in IDENTIFIER_ENGINES:
+            output = os.path.join(tempdir, 'symbols.%s.txt' % engine)
+            report = os.path.join(tempdir, 'symbols.%s.log' % engine)
+            with timer('%s engine, %d genes' % (engine, args.genes)):
+                identifier_merger.triplets_to_processed([triplets], None, output, report,
+                                                        None, None, ['True'], [], True, engine)
+            outputs.append((output, report))
+
+        for output, report in outputs[1:]:
+            assert filecmp.cmp(outputs[0][0], output, shallow=False), "outputs differ"
+            assert filecmp.cmp(outputs[0][1], report, shallow=False), "reports differ"
+        print('outputs identical')
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def write_synthetic_network(filename, num_edges, num_genes=20000, block_size=1000000, seed=0):
+    '''
+    a direct network of gene symbol pairs, the weights mostly
+    fractions with some whole numbers, written a block at a time
+    '''
+
+    rng = np.random.RandomState(seed)
+    with open(filename, 'w') as f:
+        for start in range(0, num_edges, block_size):
+            size = min(block_size, num_edges - start)
+            genes = rng.randint(0, num_genes, (size, 2))
+            weights = np.round(rng.rand(size) * 4, 3)
+            f.write(''.join(['GENE%d\tGENE%d\t%r\n' % edge for edge in
+                             zip(genes[:, 0].tolist(), genes[:, 1].tolist(), weights.tolist())]))
+
+
+# runs a script, then writes its peak memory use in kb to a file. VmHWM
+# is the peak of the script alone, ru_maxrss would include the memory
+# the benchmark itself was using when it started the script
+MEASURE_SCRIPT = '''
+import os, runpy, sys
+peak_file, sys.argv = sys.argv[1], sys.argv[2:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name='__main__')
+with open('/proc/self/status') as f:
+    peak = [line.split()[1] for line in f if line.startswith('VmHWM')][0]
+with open(peak_file, 'w') as f:
+    f.write(peak)
+'''
+
+
+def run_measured(script, args):
+    '''
+    run a python script, returning its peak resident set size in mb.
+    needs linux's /proc
+    '''
+    with tempfile.NamedTemporaryFile('r') as peak_file:
+        subprocess.check_call([sys.executable, '-c', MEASURE_SCRIPT, peak_file.name, script] + args)
+        return int(peak_file.read()) / 1024.0
+
+
+def fix_weights(args):
+    tempdir = tempfile.mkdtemp()
+    try:
+        network = os.path.join(tempdir, 'network.txt')
+        write_synthetic_network(network, args.edges)
+        print('%d edges, %.0f mb' % (args.edges, os.path.getsize(network) / (1024.0 * 1024.0)))
+
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fix_weights.py')
+        outputs = []
+        for label, options in [('whole file', []), ('chunked', ['--chunksize', str(args.chunksize)])]:
+            output = os.path.join(tempdir, 'network.%s.cleaned' % len(outputs))
+            with timer(label):
+                peak = run_measured(script, [network, output] + options)
+            print('%s: peak memory %.0f mb' % (label, peak))
+            outputs.append(output)
+
+        assert filecmp.cmp(outputs[0], outputs[1], shallow=False), "outputs differ"
+        print('outputs identical')
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def write_synthetic_generic_db(location, num_networks, num_edges, num_attribute_groups, seed=0):
+    '''
+    the INTERACTIONS and ATTRIBUTES folders of a generic_db, networks
+    of about num_edges interactions and attribute groups of about
+    num_edges / 10 gene attribute pairs
+    '''
+
+    rng = np.random.RandomState(seed)
+    for folder in ['INTERACTIONS', 'ATTRIBUTES']:
+        os.makedirs(os.path.join(location, folder))
+
+    for network_id in range(1, num_networks + 1):
+        size = rng.randint(num_edges // 2, num_edges * 3 // 2)
+        nodes = rng.randint(1, 20000, (size, 2))
+        with open(os.path.join(location, 'INTERACTIONS', '1.%d.txt' % network_id), 'w') as f:
+            f.write(''.join(['%d\t%d\t%r\n' % edge for edge in
+                             zip(nodes[:, 0].tolist(), nodes[:, 1].tolist(), rng.rand(size).tolist())]))
+
+    for group_id in range(1, num_attribute_groups + 1):
+        size = rng.randint(num_edges // 20, num_edges * 3 // 20)
+        pairs = rng.randint(1, 20000, (size, 2))
+        with open(os.path.join(location, 'ATTRIBUTES', '%d.txt' % group_id), 'w') as f:
+            f.write(''.join(['%d\t%d\n' % pair for pair in zip(pairs[:, 0].tolist(), pairs[:, 1].tolist())]))
+
+
+def shift_by_pandas(copy):
+    '''
+    the original copy, parsing and writing each file with pandas
+    '''
+    filename, new_filename, increments = copy
+    data = pd.read_csv(filename, sep='\t', header=None)
+    for column, increment in enumerate(increments):
+        data[column] += increment
+    data.to_csv(new_filename, sep='\t', header=False, index=False)
+
+
+def merge_copy(args):
+    tempdir = tempfile.mkdtemp()
+    try:
+        copies = []
+        for organism in range(args.organisms):
+            location = os.path.join(tempdir, 'org%d' % organism)
+            write_synthetic_generic_db(location, args.networks, args.edges, args.networks // 10, seed=organism)
+            for folder in ['INTERACTIONS', 'ATTRIBUTES']:
+                for filename in os.listdir(os.path.join(location, folder)):
+                    copies.append((os.path.join(location, folder, filename), organism, folder, filename))
+
+        total = sum(os.path.getsize(copy[0]) for copy in copies)
+        print('%d organisms, %d files, %.0f mb' % (args.organisms, len(copies), total / (1024.0 * 1024.0)))
+
+        outputs = []
+        for label, copy, processes in [('pandas', shift_by_pandas, 1), ('numpy', None, 1),
+                                       ('numpy, %d processes' % args.processes, None, args.processes)]:
+            merged = os.path.join(tempdir, 'merged%d' % len(outputs))
+            tasks = []
+            for filename, organism, folder, name in copies:
+                os.makedirs(os.path.join(merged, folder), exist_ok=True)
+                tasks.append((filename, os.path.join(merged, folder, '%d.%s' % (organism, name)),
+                              [organism * 100000, organism * 1000]))
+
+            with timer(label):
+                if copy is None:
+                    merge_organisms.shift_files(tasks, processes)
+                else:
+                    for task in tasks:
+                        copy(task)
+            outputs.append([task[1] for task in tasks])
+
+        # pandas rewrites the weights, a little off where its parser
+        # was, the new copy leaves them as they were
+        for old, new in zip(outputs[0], outputs[1]):
+            old, new = pd.read_csv(old, sep='\t', header=None), pd.read_csv(new, sep='\t', header=None)
+            assert old[[0, 1]].equals(new[[0, 1]]), "ids differ"
+            assert len(old.columns) == 2 or np.allclose(old[2], new[2], rtol=1e-15, atol=0), "weights differ"
+        for first, second in zip(outputs[1], outputs[2]):
+            assert filecmp.cmp(first, second, shallow=False), "outputs differ: %s" % second
+        print('outputs match')
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def write_synthetic_profile(filename, symbols_file, num_genes, num_samples, block_size=1000, seed=0):
+    '''
+    an expression profile of genes in co-expressed modules, with noise
+    and a few missing values, and a symbols file naming the genes
+    '''
+
+    rng = np.random.RandomState(seed)
+    modules = rng.randn(max(1, num_genes // 100), num_samples)
+
+    with open(filename, 'w') as f:
+        f.write('\t'.join(['gene'] + ['sample%d' % i for i in range(num_samples)]) + '\n')
+        for start in range(0, num_genes, block_size):
+            size = min(block_size, num_genes - start)
+            values = modules[rng.randint(0, len(modules), size)] + rng.randn(size, num_samples)
+            lines = [('GENE%d\t' % (start + i)) + '\t'.join('%.4f' % value for value in row)
+                     for i, row in enumerate(values.tolist())]
+            f.write('\n'.join(line.replace('\t-0.0000', '\tNA') for line in lines) + '\n')
+
+    with open(symbols_file, 'w') as f:
+        f.writelines('%d\tGENE%d\tGene Name\n' % (i + 1, i) for i in range(num_genes))
+
+
+def run_polled(command, interval=0.1):
+    '''
+    run a command that isn't python, e.g. java, returning its peak
+    resident set size in mb as last seen polling /proc
+    '''
+
+    process = subprocess.Popen(command)
+    peak = 0
+    while process.poll() is None:
+        try:
+            with open('/proc/%d/status' % process.pid) as f:
+                peak = max([peak] + [int(line.split()[1]) for line in f if line.startswith('VmHWM')])
+        except (IOError, ValueError):
+            pass
+        time.sleep(interval)
+
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return peak / 1024.0
+
+
+def read_pairs(filename):
+    network = pd.read_csv(filename, sep='\t', header=None, usecols=[0, 1], dtype=str)
+    return set(zip(network[0], network[1])) | set(zip(network[1], network[0]))
+
+
+def profiles(args):
+    tempdir = tempfile.mkdtemp()
+    try:
+        profile = os.path.join(tempdir, 'profile.txt')
+        symbols = os.path.join(tempdir, 'symbols.txt')
+        write_synthetic_profile(profile, symbols, args.genes, args.samples)
+        print('%d genes, %d samples, %.0f mb' % (args.genes, args.samples, os.path.getsize(profile) / (1024.0 * 1024.0)))
+
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profile_to_network.py')
+        outputs = {}
+        for label, options in [('python', []), ('python float32', ['--float32'])]:
+            output = os.path.join(tempdir, 'profile.%d.p2n' % len(outputs))
+            with timer(label):
+                peak = run_measured(script, [profile, symbols, output, '--threads', str(args.threads),
+                                             '--memory', str(args.memory)] + options)
+            print('%s: peak memory %.0f mb' % (label, peak))
+            outputs[label] = output
+
+        if args.jar:
+            output = os.path.join(tempdir, 'profile.java.p2n')
+            with timer('java'):
+                peak = run_polled(['java', '-Xmx%s' % args.java_heap, '-cp', args.jar,
+                                   'org.genemania.engine.core.evaluation.ProfileToNetworkDriver',
+                                   '-in', profile, '-out', output, '-log', output + '.log', '-syn', symbols,
+                                   '-proftype', 'continuous', '-cor', 'pearson', '-threshold', 'auto',
+                                   '-keepAllTies', '-limitTies'])
+            print('java: peak memory %.0f mb' % peak)
+            outputs['java'] = output
+        else:
+            print('java: skipped, no --jar given')
+
+        # the engines can differ on ties and rounding, so
+        # report how much the networks overlap
+        expected = read_pairs(outputs['python'])
+        for label, output in outputs.items():
+            if label != 'python':
+                actual = read_pairs(output)
+                print('%s: %d interactions, %.4f of them shared with python' %
+                      (label, len(actual) // 2, len(expected & actual) / float(max(len(expected | actual), 1))))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+def write_synthetic_associations(location, num_pairs, num_genes, num_attributes, per_line=10, seed=0):
+    '''
+    identifiers, attribute descriptions, and association files in both
+    the simple gene/attributes and the attribute/genes layouts, each
+    with num_pairs gene attribute pairs, a few of them unknown
+    '''
+
+    rng = np.random.RandomState(seed)
+    with open(os.path.join(location, 'identifiers.txt'), 'w') as f:
+        f.writelines('Org:%d\tGENE%d\tGene Name\n' % (i, i) for i in range(num_genes))
+    with open(os.path.join(location, 'attributes.txt'), 'w') as f:
+        f.writelines('ATTR%d\tattribute %d\tdescription\n' % (i, i) for i in range(num_attributes))
+
+    num_lines = num_pairs // per_line
+    genes = rng.randint(0, int(num_genes * 1.02), (num_lines, per_line))
+    attributes = rng.randint(0, int(num_attributes * 1.02), (num_lines, per_line))
+
+    with open(os.path.join(location, 'simple.txt'), 'w') as f:
+        f.writelines('GENE%d\t%s\n' % (gene, '\t'.join('attr%d' % attribute for attribute in row))
+                     for gene, row in zip(genes[:, 0].tolist(), attributes.tolist()))
+    with open(os.path.join(location, 'multi_id.txt'), 'w') as f:
+        f.writelines('ATTR%d\tattribute %d\t%s\n' % (attribute, attribute, '\t'.join('GENE%d' % gene for gene in row))
+                     for attribute, row in zip(attributes[:, 0].tolist(), genes.tolist()))
+
+
+def attribute_associations(args):
+    tempdir = tempfile.mkdtemp()
+    try:
+        write_synthetic_associations(tempdir, args.pairs, args.genes, args.attributes)
+
+        coredb = dbtools.CoreDB(os.path.join(tempdir, 'core.sqlite'))
+        coredb.create_tables()
+        db = dbtools.OrgDB(os.path.join(tempdir, 'org.sqlite'))
+        db.create_tables()
+        process_identifiers.IdentifierLoader(db).process(os.path.join(tempdir, 'identifiers.txt'))
+        attribute_group_id = process_attributes.AttributeLoader(coredb, db).process(
+            1, 'name', 'code', 'desc', 'label', 'url', 0, 'pub', 'pub url', os.path.join(tempdir, 'attributes.txt'))
+        print('%d pairs, %d genes, %d attributes' % (args.pairs, args.genes, args.attributes))
+
+        # a warning for each unknown gene and attribute otherwise
+        logging.disable(logging.WARNING)
+
+        for label, loader_class, filename, options in [
+                ('simple', process_attribute_associations.AttributeAssociationLoader, 'simple.txt', ['external_id']),
+                ('multi id', process_attribute_associations2.AttributeAssociationLoader2, 'multi_id.txt', [])]:
+            results = []
+            for mode, preload in [('queries', False), ('preloaded', True)]:
+                loader = loader_class(db, os.path.join(tempdir, '%s_%s' % (mode, filename)), preload)
+                with timer('%s, %s' % (label, mode)):
+                    results.append(loader.process(1, attribute_group_id, os.path.join(tempdir, filename), *options))
+
+            assert results[0][1:] == results[1][1:], "counts differ"
+            assert filecmp.cmp(results[0][0], results[1][0], shallow=False), "outputs differ"
+            print('%s: %d of %d loaded, outputs identical' % (label, results[1][1], results[1][2]))
+
+        db.close()
+        coredb.close()
+    finally:
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='benchmark pipeline steps on synthetic data')
+    subparsers = parser.add_subparsers(dest='subparser_name')
+
+    parser_identifiers = subparsers.add_parser('identifiers', help='identifier cleaning engines')
+    parser_identifiers.add_argument('--genes', type=int, default=20000,
+                                    help='number of synthetic genes, default 20000')
+
+    parser_loading = subparsers.add_parser('identifier_loading', help='sqlite identifier loading, with and without bulk mode')
+    parser_loading.add_argument('--genes', type=int, default=20000,
+                                help='number of synthetic genes, default 20000')
+
+    parser_merging = subparsers.add_parser('name_merging', help='union-find against self-join gene name merging')
+    parser_merging.add_argument('--genes', type=int, nargs='+', default=[1000, 2000, 4000, 8000],
+                                help='numbers of synthetic genes to time, default 1000 2000 4000 8000')
+    parser_merging.add_argument('--collisions', type=int, default=50,
+                                help='number of genes sharing each gene name, default 50')
+
+    parser_fix_weights = subparsers.add_parser('fix_weights', help='whole file against chunked network cleaning, time and memory')
+    parser_fix_weights.add_argument('--edges', type=int, default=5000000,
+                                    help='number of synthetic interactions, default 5000000')
+    parser_fix_weights.add_argument('--chunksize', type=int, default=1000000,
+                                    help='rows per chunk, default 1000000')
+
+    parser_merge_copy = subparsers.add_parser('merge_copy', help='pandas against numpy copying of data files when merging organisms')
+    parser_merge_copy.add_argument('--organisms', type=int, default=3,
+                                   help='number of synthetic organisms, default 3')
+    parser_merge_copy.add_argument('--networks', type=int, default=100,
+                                   help='number of networks per organism, default 100')
+    parser_merge_copy.add_argument('--edges', type=int, default=20000,
+                                   help='average interactions per network, default 20000')
+    parser_merge_copy.add_argument('--processes', type=int, default=4,
+                                   help='number of processes for the parallel copy, default 4')
+
+    parser_profiles = subparsers.add_parser('profiles', help='python against java profile to network conversion, time and memory')
+    parser_profiles.add_argument('--genes', type=int, default=10000,
+                                 help='number of synthetic genes, default 10000')
+    parser_profiles.add_argument('--samples', type=int, default=500,
+                                 help='number of synthetic samples, default 500')
+    parser_profiles.add_argument('--threads', type=int, default=1,
+                                 help='threads for the python engine, default 1')
+    parser_profiles.add_argument('--memory', type=int, default=512,
+                                 help='mb of correlation blocks for the python engine, default 512')
+    parser_profiles.add_argument('--jar', type=str,
+                                 help='genemania jar with the ProfileToNetworkDriver, java is skipped without it')
+    parser_profiles.add_argument('--java_heap', type=str, default='1G',
+                                 help='java -Xmx setting, default 1G as in the pipeline')
+
+    parser_associations = subparsers.add_parser('attribute_associations', help='per query against preloaded attribute association loading')
+    parser_associations.add_argument('--pairs', type=int, default=3000000,
+                                     help='number of gene attribute pairs, default 3000000')
+    parser_associations.add_argument('--genes', type=int, default=20000,
+                                     help='number of synthetic genes, default 20000')
+    parser_associations.add_argument('--attributes', type=int, default=10000,
+                                     help='number of synthetic attributes, default 10000')
+
+    args = parser.parse_args()
+
+    if args.subparser_name == 'identifiers':
+        identifiers(args)
+    elif args.subparser_name == 'identifier_loading':
+        identifier_loading(args)
+    elif args.subparser_name == 'name_merging':
+        name_merging(args)
+    elif args.subparser_name == 'fix_weights':
+        fix_weights(args)
+    elif args.subparser_name == 'merge_copy':
+        merge_copy(args)
+    elif args.subparser_name == 'profiles':
+        profiles(args)
+    elif args.subparser_name == 'attribute_associations':
+        attribute_associations(args)
+    else:
+        raise Exception('unexpected command: "%s"' % args.subparser_name)
@@ -0,0 +1,329 @@
+'''
+scrub, dedup, and map a melted attribute file to node and linearized
+attribute ids in one process, in place of scrubber.py, dedup.py and
+map_attributes_to_ids.py run one after the other. each of those reads
+the file the last one wrote, and looks up the gene symbols again.
+
+here the symbols and attributes are factorized, each distinct symbol
+is looked up in the symbol index once and each distinct attribute
+in the linearized attribute ids once, and the steps work on the
+integer codes:
+
+ * rows whose symbol isn't known are dropped (scrubber.py)
+ * rows are expanded to the node ids of their symbol, and duplicate
+   attribute/node pairs dropped (dedup.py)
+ * attributes are upper cased and mapped to their linearized ids,
+   and duplicate node/linearized id pairs dropped (map_attributes_to_ids.py)
+
+only the .mapped file is written, with the same contents the
+separate steps give. the .scrubbed and .clean files can also be
+written with --scrubbed and --clean.
+
+many files can be processed in one go with the batch command, sharing the
+symbol index and linearized attribute ids. the manifest is tab delimited
+with a line per file:
+
+  input<tab>output[<tab>scrubbed<tab>clean]
+
+with empty scrubbed or clean fields where those files aren't wanted.
+'''
+
+import argparse, os, csv
+import unittest, tempfile, shutil
+import numpy as np
+import pandas as pd
+from identifiers import symbol_index
+
+SEP = '\t'
+
+
+def load_melted(filename):
+    '''
+    gene symbol, attribute frame of a melted attribute file, as strings
+    '''
+
+    if os.path.getsize(filename) == 0:
+        return pd.DataFrame({0: pd.Series([], dtype=object), 1: pd.Series([], dtype=object)})
+
+    return pd.read_csv(filename, sep=SEP, header=None, na_filter=False, dtype=str)
+
+
+def load_linearized(filename):
+    '''
+    (external ids, linearized ids) from the linearized attributes
+    file, the external ids upper cased for matching
+    '''
+
+    lin_attr_id = pd.read_csv(filename, sep=SEP, na_filter=False, dtype={'EXTERNAL_ID': str})
+    return (lin_attr_id['EXTERNAL_ID'].str.upper().to_numpy(dtype=object),
+            lin_attr_id['LINEARIZED_ID'].to_numpy(dtype=np.int64))
+
+
+def group_matches(positions, size):
+    '''
+    (starts, counts) of the matches of each of size keys, from
+    the sorted key position of each match
+    '''
+
+    counts = np.bincount(positions, minlength=size)
+    starts = np.cumsum(counts) - counts
+    return starts, counts
+
+
+def expand(codes, starts, counts):
+    '''
+    (items, matches), for each item of codes and each match of
+    its key, the position of the item and of the match. ordered
+    by item then match, like an inner join
+    '''
+
+    lengths = counts[codes]
+    items = np.repeat(np.arange(len(codes), dtype=np.int64), lengths)
+    offsets = np.arange(len(items), dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return items, np.repeat(starts[codes], lengths) + offsets
+
+
+def first_pairs(a, b):
+    '''
+    mask of the first occurrence of each a, b pair
+    '''
+    return ~pd.DataFrame({'a': a, 'b': b}).duplicated().to_numpy()
+
+
+class AttributeCleaner(object):
+    '''
+    symbol index and linearized attribute ids, for cleaning any
+    number of attribute files
+    '''
+
+    def __init__(self, index, external_ids, linearized_ids):
+        self.index = index
+
+        # linearized ids grouped by distinct external id, in file order.
+        # no matches on the end, for positions of -1 from get_indexer
+        codes, self.external_ids = pd.factorize(external_ids)
+        order = np.argsort(codes, kind='stable')
+        self.linearized_ids = np.asarray(linearized_ids, dtype=np.int64)[order]
+        starts, counts = group_matches(codes[order], len(self.external_ids))
+        self.starts, self.counts = np.append(starts, 0), np.append(counts, 0)
+
+    def clean(self, data):
+        '''
+        data is a frame of gene symbol, attribute strings. returns (scrubbed,
+        clean, node_ids, linearized_ids), the rows of data kept by the scrub
+        and the dedup, and the mapped pairs
+        '''
+
+        gene_codes, genes = pd.factorize(data[0])
+        attribute_codes, attributes = pd.factorize(data[1])
+
+        # node id rows of each distinct symbol
+        positions, rows = self.index.lookup(genes)
+        starts, counts = group_matches(positions, len(genes))
+        known = counts[gene_codes] > 0
+
+        items, matches = expand(gene_codes, starts, counts)
+        node_ids = self.index.node_ids(rows[matches])
+        attribute_codes = attribute_codes[items]
+
+        # drop rows giving an attribute to a node that already has it
+        first = first_pairs(attribute_codes, node_ids)
+        clean_items, node_ids, attribute_codes = items[first], node_ids[first], attribute_codes[first]
+
+        # linearized ids of each distinct upper cased attribute
+        upper_codes, upper = pd.factorize(pd.Series(attributes, dtype=object).str.upper())
+        lin_codes = pd.Index(self.external_ids).get_indexer(upper)
+
+        codes = lin_codes[upper_codes[attribute_codes]]
+        mapped, lin_matches = expand(codes, self.starts, self.counts)
+        node_ids, linearized_ids = node_ids[mapped], self.linearized_ids[lin_matches]
+
+        first = first_pairs(node_ids, linearized_ids)
+        return data[known], data.iloc[clean_items], node_ids[first], linearized_ids[first]
+
+    def clean_file(self, input_file, output_file, scrubbed_file=None, clean_file=None):
+        '''
+        write the mapped pairs of the input file, and the scrubbed and
+        clean rows if given. returns the counts of rows at each step
+        '''
+
+        data = load_melted(input_file)
+        scrubbed, clean, node_ids, linearized_ids = self.clean(data)
+
+        if scrubbed_file:
+            scrubbed.to_csv(scrubbed_file, sep=SEP, header=False, index=False)
+        if clean_file:
+            clean.to_csv(clean_file, sep=SEP, header=False, index=False)
+
+        with open(output_file, 'w') as f:
+            f.writelines('%d\t%d\n' % pair for pair in zip(node_ids.tolist(), linearized_ids.tolist()))
+
+        return {'rows': len(data), 'scrubbed': len(scrubbed), 'clean': len(clean), 'mapped': len(node_ids)}
+
+
+def load_cleaner(lin_attr_id_file, mapping_file):
+    index = symbol_index.SymbolIndex(mapping_file)
+    return AttributeCleaner(index, *load_linearized(lin_attr_id_file))
+
+
+def read_manifest(filename):
+    '''
+    list of (input, output, scrubbed, clean) tuples, scrubbed
+    and clean are None where not given
+    '''
+
+    files = []
+    with open(filename, encoding='UTF8', newline='') as f:
+        for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if not row:
+                continue
+            if len(row) not in (2, 4):
+                raise Exception('expected input, output, and optional scrubbed and clean on manifest line: %s' % row)
+            row = row + [''] * (4 - len(row))
+            files.append(tuple(value if value else None for value in row))
+
+    return files
+
+
+def clean_batch(files, lin_attr_id_file, mapping_file):
+    '''
+    clean each (input, output, scrubbed, clean) file. returns
+    a dict of the counts for each input
+    '''
+
+    cleaner = load_cleaner(lin_attr_id_file, mapping_file)
+    return {input_file: cleaner.clean_file(input_file, output_file, scrubbed_file, clean_file)
+            for input_file, output_file, scrubbed_file, clean_file in files}
+
+
+def main(input_file, lin_attr_id_file, mapping_file, output_file, scrubbed_file=None, clean_file=None):
+    cleaner = load_cleaner(lin_attr_id_file, mapping_file)
+    cleaner.clean_file(input_file, output_file, scrubbed_file, clean_file)
+
+
+class TestCleanAttributes(unittest.TestCase):
+
+    # xyz is a symbol of nodes 2 and 3, and ddd of none
+    symbols = ('1\tAAA\tGene Name\n'
+               '1\taaa-1\tSynonym\n'
+               '2\tBBB\tGene Name\n'
+               '2\tXYZ\tSynonym\n'
+               '3\tCCC\tGene Name\n'
+               '3\txyz\tSynonym\n')
+
+    linearized = ('LINEARIZED_ID\tID\tORGANISM_ID\tATTRIBUTE_GROUP_ID\tEXTERNAL_ID\tNAME\tDESCRIPTION\n'
+                  '1\t1\t1\t1\tIPR1\tone\t\n'
+                  '2\t2\t1\t1\tipr2\ttwo\t\n'
+                  '3\t3\t1\t1\tIPR3\tthree\t\n'
+                  '4\t1\t1\t2\tIPR2\ttwo again\t\n')
+
+    files = {'attributes': ('AAA\tIPR1\n'
+                            'aaa-1\tIPR1\n'
+                            'ddd\tIPR1\n'
+                            'xyz\tIPR2\n'
+                            'BBB\tIPR2\n'
+                            'CCC\tipr1\n'
+                            'CCC\tIPR1\n'
+                            'aaa\tIPR9\n'
+                            'bbb\tIPR3\n'
+                            'aaa\tIPR3\n'),
+             'unknown': 'DDD\tIPR1\n'}
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.symbols_file = os.path.join(self.tempdir, 'symbols.txt')
+        self.linearized_file = os.path.join(self.tempdir, 'linearized_attributes.txt')
+        for filename, data in [(self.symbols_file, self.symbols), (self.linearized_file, self.linearized)]:
+            with open(filename, 'w') as f:
+                f.write(data)
+
+        self.inputs = []
+        for name, data in sorted(self.files.items()):
+            self.inputs.append(os.path.join(self.tempdir, name + '.txt.melted'))
+            with open(self.inputs[-1], 'w') as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self, filename):
+        with open(filename) as f:
+            return f.read()
+
+    def test_same_as_steps(self):
+        import scrubber, dedup, map_attributes_to_ids, update_attribute_descriptions
+
+        for input_file in self.inputs[:1]:
+            base = input_file[:-len('.melted')]
+
+            # each step on its own, through the intermediate files
+            scrubber.main(input_file, self.symbols_file, base + '.scrubbed', 0, symbol_index.SYMBOL_COL, None)
+            dedup.main(base + '.scrubbed', self.symbols_file, base + '.clean', 1, 2, 1, None)
+            map_attributes_to_ids.main(base + '.clean', self.linearized_file, self.symbols_file, base + '.mapped')
+
+            main(input_file, self.linearized_file, self.symbols_file, base + '.fused.mapped',
+                 base + '.fused.scrubbed', base + '.fused.clean')
+
+            for suffix in ['.scrubbed', '.clean', '.mapped']:
+                self.assertEqual(self.read(base + suffix), self.read(base + '.fused' + suffix), suffix)
+
+            # descriptions from the melted file, scrubbed as it's read
+            desc_file = os.path.join(self.tempdir, 'attributes.desc')
+            with open(desc_file, 'w') as f:
+                f.write('IPR1\tone\tfirst\nIPR3\tthree\tthird\n')
+            update_attribute_descriptions.main(base + '.scrubbed', desc_file, desc_file + '.cleaned')
+            update_attribute_descriptions.main(input_file, desc_file, desc_file + '.fused.cleaned', self.symbols_file)
+            self.assertEqual(self.read(desc_file + '.cleaned'), self.read(desc_file + '.fused.cleaned'))
+
+    def test_mapped(self):
+        output_file = os.path.join(self.tempdir, 'attributes.txt.mapped')
+        main(self.inputs[0], self.linearized_file, self.symbols_file, output_file)
+
+        # ipr2 of node 2 & 3 in both groups, each attribute once per node
+        self.assertEqual('1\t1\n2\t2\n2\t4\n3\t2\n3\t4\n3\t1\n2\t3\n1\t3\n', self.read(output_file))
+
+    def test_batch(self):
+        manifest = os.path.join(self.tempdir, 'manifest.txt')
+        with open(manifest, 'w') as f:
+            f.write('%s\t%s.mapped\t%s.scrubbed\t\n' % ((self.inputs[0],) * 3))
+            f.write('%s\t%s.mapped\n' % (self.inputs[1], self.inputs[1]))
+
+        files = read_manifest(manifest)
+        self.assertEqual((self.inputs[1], self.inputs[1] + '.mapped', None, None), files[1])
+
+        results = clean_batch(files, self.linearized_file, self.symbols_file)
+        self.assertEqual({'rows': 10, 'scrubbed': 9, 'clean': 8, 'mapped': 8}, results[self.inputs[0]])
+        self.assertEqual({'rows': 1, 'scrubbed': 0, 'clean': 0, 'mapped': 0}, results[self.inputs[1]])
+
+        self.assertTrue(os.path.exists(self.inputs[0] + '.scrubbed'))
+        self.assertFalse(os.path.exists(self.inputs[0] + '.clean'))
+        self.assertEqual('', self.read(self.inputs[1] + '.mapped'))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='scrub, dedup, and map attributes to ids, in one process')
+    subparsers = parser.add_subparsers(dest='subparser_name')
+
+    parser_file = subparsers.add_parser('file', help='clean a single melted attribute file')
+    parser_file.add_argument('filename', help='melted attribute file of gene symbol, attribute pairs')
+    parser_file.add_argument('lin_attr_id', help='linearized attribute id file')
+    parser_file.add_argument('mapping', help='cleaned gene symbols, or symbol index compiled from them')
+    parser_file.add_argument('output', help='output file of node id, linearized attribute id pairs')
+    parser_file.add_argument('--scrubbed', help='also write the rows with known symbols')
+    parser_file.add_argument('--clean', help='also write the rows left after removing duplicates')
+
+    parser_batch = subparsers.add_parser('batch', help='clean the attribute files listed in a manifest')
+    parser_batch.add_argument('manifest', help='tab delimited file of input, output, and optional scrubbed and clean file per line')
+    parser_batch.add_argument('lin_attr_id', help='linearized attribute id file')
+    parser_batch.add_argument('mapping', help='cleaned gene symbols, or symbol index compiled from them')
+
+    args = parser.parse_args()
+
+    if args.subparser_name == 'file':
+        main(args.filename, args.lin_attr_id, args.mapping, args.output, args.scrubbed, args.clean)
+    elif args.subparser_name == 'batch':
+        results = clean_batch(read_manifest(args.manifest), args.lin_attr_id, args.mapping)
+        print('cleaned %d attribute files' % len(results))
+    else:
+        raise Exception('unexpected command: "%s"' % args.subparser_name)
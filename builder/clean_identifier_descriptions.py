@@ -1,23 +1,22 @@
 
 
 import argparse
-import extract_identifiers
 import pandas as pd
+from identifiers import symbol_index
 
 
 def main(identifiers_filename, descriptions_filename_list,
          output_filename, report_filename):
 
-    # loading the cleaned identifiers gives the list for which we need descriptions
-    idents = extract_identifiers.load_identifiers(identifiers_filename)
-    idents.reset_index(inplace=True)
-    idents.drop_duplicates(subset=['GMID'], inplace=True)
+    # the ids in the cleaned identifiers are the ones we need descriptions for
+    index = symbol_index.SymbolIndex(identifiers_filename)
+    idents = pd.DataFrame({'GMID': pd.unique(index.node_ids())})
 
     # load in all the available descriptions
     descs_list = []
     for filename in descriptions_filename_list:
         df = pd.read_csv(filename, sep='\t', names=['GMID', 'Definition'],
-                         na_filter=False, header=None)
+                         na_filter=False, header=None, dtype={'Definition': str})
         descs_list.append(df)
 
     descs = pd.concat(descs_list, ignore_index=True)
@@ -40,7 +39,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='scrub identifier descriptions')
 
     parser.add_argument('identifiers', type=str,
-                        help='clean deduped file containing identifier triplets')
+                        help='clean deduped file containing identifier triplets, or symbol index compiled from it')
 
     parser.add_argument('descriptions', type=str, nargs='*',
                         help='list if descriptions files')
@@ -2,9 +2,12 @@
 
 import argparse
 from identifiers import identifier_merger
+from identifiers.constants import IDENTIFIER_ENGINES, REPORT_FORMATS
 from buildutils import str2bool
 
-def main(filenames, output_filename, report_filename, merge_names, filters):
+def main(filenames, output_filename, report_filename, merge_names, filters, engine='sqlite', bulk_load=False,
+         state_dir=None, profile_filename=None, explain=False, report_format='text',
+         fingerprint_filenames=(), save_db=False):
     print(filenames)
     print(output_filename)
 
@@ -20,7 +23,9 @@ def main(filenames, output_filename, report_filename, merge_names, filters):
     identifier_merger.triplets_to_processed(filenames, reverse_filename,
                                             output_filename, report_filename,
                                             org_prefix, temp_dir, biotypes, filters,
-                                            merge_names)
+                                            merge_names, engine, bulk_load, state_dir,
+                                            profile_filename, explain, report_format,
+                                            fingerprint_filenames, save_db)
 
 if __name__ == '__main__':
 
@@ -41,5 +46,30 @@ if __name__ == '__main__':
     parser.add_argument('--ignore', help='ignore identifiers with given sources, comma delimted list with no space',
                         default=[])
 
+    parser.add_argument('--engine', help='identifier cleaning implementation, default sqlite',
+                        choices=IDENTIFIER_ENGINES, default='sqlite')
+
+    parser.add_argument('--bulk_load', help='load input files in large batches with indexing deferred, sqlite engine only',
+                        type=str2bool, default=False)
+
+    parser.add_argument('--state_dir', type=str,
+                        help='keep input hashes and processed db here, and skip processing if inputs are unchanged')
+
+    parser.add_argument('--fingerprint', type=str, nargs='+', default=[],
+                        help='other files whose contents affect processing, e.g. the config, to include in the --state_dir hashes')
+
+    parser.add_argument('--save_db', help='keep a copy of the processed db in --state_dir, to re-export the output from if it goes missing, sqlite engine only',
+                        type=str2bool, default=False)
+
+    parser.add_argument('--profile', type=str,
+                        help='save time, row counts and memory use of each processing step to this json file')
+
+    parser.add_argument('--explain', help='include sqlite query plans in the profile',
+                        type=str2bool, default=False)
+
+    parser.add_argument('--report_format', help='layout of the report log file, default text',
+                        choices=REPORT_FORMATS, default='text')
+
     args = parser.parse_args()
-    main(args.filenames, args.output, args.log, args.merge_names, args.ignore)
\ No newline at end of file
+    main(args.filenames, args.output, args.log, args.merge_names, args.ignore, args.engine, args.bulk_load,
+         args.state_dir, args.profile, args.explain, args.report_format, args.fingerprint, args.save_db)
\ No newline at end of file
@@ -0,0 +1,25 @@
+"""
+compile the cleaned identifiers file into a memory-mappable
+symbol lookup index, see identifiers/symbol_index.py
+"""
+
+import argparse
+from identifiers import symbol_index
+
+
+def main(symbols_filename, index_filename):
+    symbol_index.compile_index(symbols_filename, index_filename)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='compile symbol lookup index')
+
+    parser.add_argument('symbols', type=str,
+                        help='clean identifiers file containing id/symbol/source triplets')
+
+    parser.add_argument('output', type=str,
+                        help='name of index file to create')
+
+    args = parser.parse_args()
+    main(args.symbols, args.output)
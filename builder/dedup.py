@@ -5,11 +5,36 @@ map to the same underlying gene
 
 import argparse
 import pandas as pd
+from identifiers import symbol_index
 
 SEP = '\t'
 
 # Q: if no matches on symbol, should we raise an exception or just allow to drop?
 
+def join_identifiers(indata, identsfile, col, symbolcol, idcol):
+    '''
+    join on upper cased symbols, when the identifiers are laid
+    out other than the symbol index expects
+    '''
+
+    if symbol_index.is_index(identsfile):
+        raise Exception('symbol column %d and id column %d given, the symbol index %s only has ids in column 1 and symbols in column %d, pass the identifiers file instead' %
+                        (symbolcol + 1, idcol + 1, identsfile, symbol_index.SYMBOL_COL + 1))
+
+    idents = pd.read_csv(identsfile, sep=SEP, header=None, na_filter=False)
+    assert len(idents.columns) == 3
+
+    idents = idents.iloc[:,[idcol, symbolcol]]
+    idents.columns = ['GMID', 'SYMBOL']
+
+    idents['SYMBOL_UPPER'] = idents['SYMBOL'].str.upper()
+    indata['SYMBOL_UPPER'] = indata[col].str.upper()
+
+    merged = pd.merge(indata, idents, on='SYMBOL_UPPER', how='inner')
+    merged.drop(['SYMBOL_UPPER', 'SYMBOL'], axis=1, inplace=True)
+    return merged
+
+
 def main(inputfile, identsfile, outputfile, col, symbolcol, idcol, logfile):
 
     # index col #s from 0 instead of 1
@@ -17,10 +42,6 @@ def main(inputfile, identsfile, outputfile, col, symbolcol, idcol, logfile):
     idcol -= 1
     col -= 1
 
-    idents = pd.read_csv(identsfile, sep=SEP, header=None, na_filter=False)
-    assert len(idents.columns) == 3
-    idents.columns = ['GMID', 'SYMBOL', 'SOURCE']
-
     # create empty output file if no input data. the read_csv fails if no
     # columns given so we can't test if the resulting dataframe is empty
     # so catch the exception and handle
@@ -35,17 +56,14 @@ def main(inputfile, identsfile, outputfile, col, symbolcol, idcol, logfile):
 
     indata_cols = list(indata.columns)
 
-    # upper case the columns we are filtering by, since we
-    # want case insensitive compare
-    idents = idents.iloc[:,[idcol, symbolcol]]
-    idents.columns = ['GMID', 'SYMBOL']
-
-    idents['SYMBOL_UPPER'] = idents['SYMBOL'].str.upper()
-    indata['SYMBOL_UPPER'] = indata[col].str.upper()
-
-    # join
-    merged = pd.merge(indata, idents, on='SYMBOL_UPPER', how='inner')
-    merged.drop(['SYMBOL_UPPER', 'SYMBOL'], axis=1, inplace=True)
+    # join against the identifiers, matching symbols case insensitively
+    if symbolcol == symbol_index.SYMBOL_COL and idcol == 0:
+        index = symbol_index.SymbolIndex(identsfile)
+        positions, rows = index.lookup(indata[col])
+        merged = indata.iloc[positions].reset_index(drop=True)
+        merged['GMID'] = index.node_ids(rows)
+    else:
+        merged = join_identifiers(indata, identsfile, col, symbolcol, idcol)
 
     cols = list(merged.columns)
     cols.remove(col)
@@ -68,7 +86,7 @@ if __name__ == '__main__':
                         help='input attribute file')
 
     parser.add_argument('identsfile', type=str,
-                        help='name of identifiers file')
+                        help='name of identifiers file, or symbol index compiled from it')
 
     parser.add_argument('outputfile', type=str,
                         help='name of clean output file')
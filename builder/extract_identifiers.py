@@ -23,14 +23,22 @@ input:
 
 
 import argparse
+import numpy as np
 import pandas as pd
 from configobj import ConfigObj
+from identifiers import symbol_index
 
 
 def load_identifiers(identifiers_file):
-    identifiers = pd.read_csv(identifiers_file, sep='\t', header=None,
-                             names=['GMID', 'SYMBOL', 'SOURCE'],
-                             dtype='str', na_filter=False, index_col=0)
+    '''
+    identifiers_file is the cleaned identifiers, or the symbol index
+    compiled from them
+    '''
+    return identifiers_frame(symbol_index.SymbolIndex(identifiers_file))
+
+
+def identifiers_frame(index):
+    identifiers = index.to_frame().set_index('GMID')
 
     assert identifiers.index.name == 'GMID'
     return identifiers
@@ -89,7 +97,8 @@ def extract_naming_sources(identifiers_file, naming_sources_file, organism_id):
 
 
 def extract_genes(identifiers_file, naming_sources_file, organism_cfg, genes_file):
-    identifiers = load_identifiers(identifiers_file)
+    index = symbol_index.SymbolIndex(identifiers_file)
+    identifiers = identifiers_frame(index)
 
     cfg = ConfigObj(organism_cfg, encoding='UTF8')
     default_genes = cfg['default_genes']
@@ -105,6 +114,7 @@ def extract_genes(identifiers_file, naming_sources_file, organism_cfg, genes_fil
     genes.reset_index(inplace=True) # push into column
 
     genes.index.name = 'ID'
+    genes['ROW'] = np.arange(len(genes))
     genes['SYMBOL_TYPE'] = ''
     genes['ORGANISM_ID'] = organism_id
     genes['DEFAULT_SELECTED'] = 0
@@ -118,11 +128,10 @@ def extract_genes(identifiers_file, naming_sources_file, organism_cfg, genes_fil
     genes.index += 1
     genes.drop(['SOURCE', 'NAME'], axis=1, inplace=True)
 
-    # assign defaults genes
-    genes['SYMBOL_UPPER'] = genes['SYMBOL'].str.upper()
-    default_genes = [gene.upper() for gene in default_genes]
-    genes.loc[genes['SYMBOL_UPPER'].isin(default_genes), 'DEFAULT_SELECTED'] = 1
-    genes.drop(['SYMBOL_UPPER'], axis=1, inplace=True)
+    # assign defaults genes, by the rows of the identifiers they match
+    positions, default_rows = index.lookup(default_genes)
+    genes.loc[genes['ROW'].isin(default_rows), 'DEFAULT_SELECTED'] = 1
+    genes.drop(['ROW'], axis=1, inplace=True)
 
     # write out files. be explicit about column order so as not to mess things up
     genes.to_csv(genes_file, sep='\t', header=False, index=True,
@@ -103,6 +103,12 @@ def extract_network_metadata(input_file, output_file):
     # this must be set to the nice network group name in old metadata, e.g. 'Co-expression'
     metadata['networkType'] = metadata['group_name']
 
+    # weight stats from network_stats.py, if computed
+    if 'dynamic_range' in metadata.columns:
+        metadata['dynamicRange'] = metadata['dynamic_range']
+    if 'weight_distribution' in metadata.columns:
+        metadata['edgeWeightDistribution'] = metadata['weight_distribution']
+
     # empty values for misc other stuff
     metadata['source'] = metadata['source']
     metadata['reference'] = metadata['source_id']
@@ -8,6 +8,7 @@
 
 import argparse
 import pandas as pd
+from identifiers import symbol_index
 
 
 def clean(input_file, symbols_file, output_file_annos, output_file_anno_names):
@@ -16,26 +17,20 @@ def clean(input_file, symbols_file, output_file_annos, output_file_anno_names):
     annos = pd.read_table(input_file, sep='\t', skiprows=2, header=None, na_filter=False,
                           names=['name', 'branch', 'category', 'd', 'e', 'f', 'gene', 'h', 'i', 'k', 'l'])
 
-    annos['gene_orig'] = annos['gene']
-    annos['gene'] = annos['gene'].str.upper()
-
     # drop rows that don't belong to one of 3 main go branches (universal/root level annotations)
     annos = annos[annos['branch'].isin(['cellular_component', 'molecular_function', 'biological_process'])]
 
-    # load symbol mappings
-    mappings = pd.read_table(symbols_file, sep='\t', header=None, na_filter=False,
-                             names=['id', 'symbol', 'source'])
-
-    mappings['symbol'] = mappings['symbol'].str.upper()
-
-    # merge annotations with mappings, excluding entries that don't match up
-    annos = pd.merge(annos, mappings, left_on = 'gene', right_on = 'symbol', how='inner')
+    # look up node ids for the annotated genes, excluding entries that don't match up
+    mappings = symbol_index.SymbolIndex(symbols_file)
+    positions, rows = mappings.lookup(annos['gene'])
+    annos = annos.iloc[positions].reset_index(drop=True)
+    annos['id'] = mappings.node_ids(rows)
 
     # get rid of duplicates
     annos.drop_duplicates(['category', 'id'], inplace=True)
 
     # write out clean two-column annotations file
-    annos.to_csv(output_file_annos, sep='\t', header=['branch', 'category', 'node_id', 'gene'], index=False, columns=['branch', 'category', 'id', 'gene_orig'])
+    annos.to_csv(output_file_annos, sep='\t', header=['branch', 'category', 'node_id', 'gene'], index=False, columns=['branch', 'category', 'id', 'gene'])
 
     # write annotation category names
     names = annos[['category', 'name']].drop_duplicates().sort_values(by=['category'])
@@ -77,7 +72,7 @@ if __name__ == "__main__":
     # clean
     parser_clean = subparsers.add_parser('clean')
     parser_clean.add_argument('input', help='annotations from query_go_annotations')
-    parser_clean.add_argument('symbols', help='clean symbol mappings file')
+    parser_clean.add_argument('symbols', help='clean symbol mappings file, or symbol index compiled from it')
     parser_clean.add_argument('annotations', help='output clean annotations')
     parser_clean.add_argument('names', help='output annotation category names')
 
@@ -1,21 +1,117 @@
-
 """
 2-column input: add a column of '1's for weight
 
-3-column input: remove any values in 3rd column that are not numeric or have value <= 0
+3-column input: weights are written as read, values in the 3rd column that
+are not numeric or have value <= 0 are not removed here, with or without
+--chunksize
 
 >3 columns: use first 3 only
 
 <2 columns: error
+
+with --chunksize the file is processed that many rows at a time rather
+than loaded whole, for networks too big to fit in memory. the output is
+the same: if a column is read as different types in different chunks,
+the file is written again with the type it would have had read whole.
+whole number weights and later fractions are read as floats, so 1 is
+written as 1.0, and weights mixed with text are read as text, so 0.50
+is written as is.
 """
 
-import argparse
+import argparse, os
+import unittest, tempfile, shutil
+import numpy as np
 import pandas as pd
 
 SEP = '\t'
 
 
-def main(inputfile, outputfile, logfile):
+def check_columns(inputfile, num_columns):
+    if num_columns < 2:
+        raise Exception("input file %s contains too few columns (%s)" % (inputfile, num_columns))
+
+    if num_columns > 3:
+        print("Warning: input file %s contains too many columns (%s), using first 3" % (inputfile, num_columns))
+
+
+def fix_columns(data):
+    if len(data.columns) == 2:
+        data[2] = 1  # set weights to 1, making a third column
+
+    if len(data.columns) > 3:
+        data = data.iloc[:, :3]
+
+    else:
+        # drop rows with missing values
+        data = data.dropna()
+
+    return data
+
+
+def read_chunks(inputfile, chunksize, dtypes=None):
+    return pd.read_csv(inputfile, sep=SEP, header=None, na_filter=False, chunksize=chunksize, dtype=dtypes)
+
+
+def reconcile(dtypes):
+    '''
+    given the set of types each column was read as in different chunks,
+    the type it would have had reading the file whole, for the columns
+    read as different types. numeric types are combined the way pandas
+    does when combining the chunks of a file it reads in low memory mode,
+    and a column read as text in any chunk is read as text throughout
+    '''
+
+    reconciled = {}
+    for column, column_types in dtypes.items():
+        if len(column_types) < 2:
+            continue
+        if all(dtype.kind in 'iuf' for dtype in column_types):
+            reconciled[column] = np.result_type(*column_types)
+        else:
+            reconciled[column] = str
+
+    return reconciled
+
+
+def write_chunks(inputfile, outputfile, chunksize, dtypes):
+    '''
+    write the fixed chunks of the file, reading columns as the given
+    types. returns the types needed to match reading the file whole
+    '''
+
+    seen = {}
+    with read_chunks(inputfile, chunksize, dtypes) as chunks, open(outputfile, 'w', encoding='utf8', newline='') as out:
+        for chunk in chunks:
+            if not seen:
+                check_columns(inputfile, len(chunk.columns))
+            for column, dtype in chunk.dtypes.items():
+                seen.setdefault(column, set()).add(dtype)
+
+            fix_columns(chunk).to_csv(out, sep=SEP, header=False, index=False)
+
+    return reconcile(seen)
+
+
+def main_chunked(inputfile, outputfile, logfile, chunksize):
+
+    try:
+        dtypes = write_chunks(inputfile, outputfile, chunksize, {})
+    except ValueError as e:
+        assert str(e) == 'No columns to parse from file'
+        print('warning, file is empty: ' + inputfile)
+        open(outputfile, 'w').close()
+        return
+
+    # some column changed type part way through, e.g. whole number
+    # weights then fractions, or text. go again reading them all the same way
+    if dtypes:
+        write_chunks(inputfile, outputfile, chunksize, dtypes)
+
+
+def load_fixed(inputfile):
+    '''
+    the whole network with the fixes applied, as a data frame
+    '''
 
     try:
         data = pd.read_csv(inputfile, sep=SEP, header=None, na_filter=False)
@@ -25,20 +121,17 @@ def main(inputfile, outputfile, logfile):
         print('warning, file is empty: ' + inputfile)
         data = pd.DataFrame(columns=range(3))
 
-    if len(data.columns) < 2:
-        raise Exception("input file %s contains too few columns (%s)" % (inputfile, len(data.columns)))
+    check_columns(inputfile, len(data.columns))
+    return fix_columns(data)
 
-    elif len(data.columns) == 2:
-        data[2] = 1  # set weights to 1, making a third column
 
-    if len(data.columns) > 3:
-        print("Warning: input file %s contains too many columns (%s), using first 3" % (inputfile, len(data.columns)))
-        data = data.iloc[:, :3]
+def main(inputfile, outputfile, logfile, chunksize=None):
+
+    if chunksize:
+        main_chunked(inputfile, outputfile, logfile, chunksize)
+        return
 
-    else: 
-        # drop non-numeric values in 3rd column
-        pd.to_numeric(data[2], errors='coerce')
-        data.dropna(inplace=True)
+    data = load_fixed(inputfile)
 
     # write output
     data.to_csv(outputfile, sep=SEP, header=False, index=False)
@@ -46,6 +139,44 @@ def main(inputfile, outputfile, logfile):
     # write summary log TODO
 
 
+class TestFixWeights(unittest.TestCase):
+
+    networks = {'two_columns': 'a\tb\nb\tc\nc\td\n',
+                'int_then_float': 'a\tb\t1\nb\tc\t2\nc\td\t0.50\nd\te\t1e-3\n',
+                'float_then_int': 'a\tb\t0.5\nb\tc\t0.25\nc\td\t3\n',
+                'ids_and_symbols': '1\t2\t1\n3\t4\t1\nabc\t5\t1\n',
+                'numbers_and_text': 'a\tb\t0.50\nc\td\tx\ne\tf\t2\n',
+                'many_columns': 'a\tb\t1\tx\nb\tc\t0.5\ty\nc\td\t2\tz\n',
+                'empty': ''}
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_chunked(self):
+        for name, network in self.networks.items():
+            inputfile = os.path.join(self.tempdir, name + '.txt')
+            with open(inputfile, 'w') as f:
+                f.write(network)
+
+            main(inputfile, inputfile + '.whole', None)
+            with open(inputfile + '.whole') as f:
+                expected = f.read()
+
+            for chunksize in [1, 2, 100]:
+                main(inputfile, inputfile + '.chunked', None, chunksize)
+                with open(inputfile + '.chunked') as f:
+                    self.assertEqual(expected, f.read(), '%s, chunk size %d' % (name, chunksize))
+
+        with open(os.path.join(self.tempdir, 'int_then_float.txt.whole')) as f:
+            self.assertEqual('a\tb\t1.0\nb\tc\t2.0\nc\td\t0.5\nd\te\t0.001\n', f.read())
+
+        with open(os.path.join(self.tempdir, 'numbers_and_text.txt.whole')) as f:
+            self.assertEqual('a\tb\t0.50\nc\td\tx\ne\tf\t2\n', f.read())
+
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='scrub attributes against identifiers')
@@ -59,5 +190,8 @@ if __name__ == '__main__':
     parser.add_argument('--log', type=str,
                         help='name of report log file')
 
+    parser.add_argument('--chunksize', type=int,
+                        help='process this many rows at a time, rather than loading the whole file')
+
     args = parser.parse_args()
-    main(args.inputfile, args.outputfile, args.log)
+    main(args.inputfile, args.outputfile, args.log, args.chunksize)
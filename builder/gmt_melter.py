@@ -0,0 +1,123 @@
+'''
+melt a gmt style attrib-desc-gene-list file:
+
+  attribute-id<tab>attribute-name<tab>gene<tab>gene2<tab>more genes
+
+into gene<tab>attribute-id pairs, and write the description file
+of the attributes alongside:
+
+  attribute-id<tab>name<tab>description
+
+records are read a line at a time with the attribute loader's
+enhanced_attribute_profile_reader, so the file is parsed the same
+way as when it's loaded, and too short records are skipped the same
+way. each record is written as it's read, so memory use depends on
+the longest record rather than the size of the file.
+
+the second field is taken as the attribute name by default, like the
+loader. for collections such as msigdb where it's a description or a
+link, use --desc_field description to use it as the description and
+the attribute id as the name. empty gene fields, e.g. from trailing
+tabs, are dropped.
+'''
+
+import argparse
+import unittest, tempfile, shutil, os
+from attribute_loader.utils import enhanced_attribute_profile_reader, ENCODING
+
+SEP = '\t'
+
+BUFFER_SIZE = 1024 * 1024
+
+DESC_FIELDS = ['name', 'description']
+
+
+def melt_gmt(gmt_file, melted_file, desc_file, desc_field='name', encoding=ENCODING):
+    '''
+    returns the number of records and of gene-attribute pairs written
+    '''
+
+    if desc_field not in DESC_FIELDS:
+        raise Exception("unexpected description field: '%s'" % desc_field)
+
+    records = pairs = 0
+    with open(melted_file, 'w', encoding=encoding, buffering=BUFFER_SIZE) as melted, \
+            open(desc_file, 'w', encoding=encoding, buffering=BUFFER_SIZE) as desc:
+
+        for (attribute_id, second), genes in enhanced_attribute_profile_reader(gmt_file, encoding=encoding):
+            if '' in genes:
+                genes = [gene for gene in genes if gene]
+
+            # one join per record rather than a write per gene
+            if genes:
+                suffix = SEP + attribute_id + '\n'
+                melted.write(suffix.join(genes) + suffix)
+
+            if desc_field == 'name':
+                desc.write(SEP.join([attribute_id, second, '']) + '\n')
+            else:
+                desc.write(SEP.join([attribute_id, attribute_id, second]) + '\n')
+
+            records += 1
+            pairs += len(genes)
+
+    return records, pairs
+
+
+def main(gmt_file, melted_file, desc_file, desc_field='name'):
+    records, pairs = melt_gmt(gmt_file, melted_file, desc_file, desc_field)
+    print('melted %d records into %d gene-attribute pairs' % (records, pairs))
+
+
+class TestGmtMelter(unittest.TestCase):
+
+    gmt = ('SET1\tfirst set\tAAA\tBBB\n'
+           'SET2\thttp://example.org/set2\tCCC\t\r\n'
+           'SET3\ttoo short\n'
+           'SET3\n'
+           'SET4\tfourth\tDDD\tAAA\tCCC\t\n')
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.gmt_file = os.path.join(self.tempdir, 'sets.txt')
+        with open(self.gmt_file, 'w', newline='') as f:
+            f.write(self.gmt)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self, filename):
+        with open(filename) as f:
+            return f.read()
+
+    def test_melt(self):
+        melted_file = self.gmt_file + '.melted'
+        desc_file = os.path.join(self.tempdir, 'sets.desc')
+
+        self.assertEqual((3, 6), melt_gmt(self.gmt_file, melted_file, desc_file))
+
+        self.assertEqual('AAA\tSET1\nBBB\tSET1\nCCC\tSET2\nDDD\tSET4\nAAA\tSET4\nCCC\tSET4\n', self.read(melted_file))
+        self.assertEqual('SET1\tfirst set\t\nSET2\thttp://example.org/set2\t\nSET4\tfourth\t\n',
+                         self.read(desc_file))
+
+    def test_desc_field(self):
+        melted_file = self.gmt_file + '.melted'
+        desc_file = os.path.join(self.tempdir, 'sets.desc')
+
+        melt_gmt(self.gmt_file, melted_file, desc_file, 'description')
+        self.assertEqual('SET1\tSET1\tfirst set\nSET2\tSET2\thttp://example.org/set2\nSET4\tSET4\tfourth\n',
+                         self.read(desc_file))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='melt a gmt style attribute file into gene-attribute pairs and descriptions')
+
+    parser.add_argument('gmt', help='attrib-desc-gene-list file, attribute id, name, then genes on each line')
+    parser.add_argument('melted', help='output file of gene, attribute id pairs')
+    parser.add_argument('desc', help='output file of attribute id, name, description')
+    parser.add_argument('--desc_field', choices=DESC_FIELDS, default='name',
+                        help='what the second field of each record is, default name')
+
+    args = parser.parse_args()
+    main(args.gmt, args.melted, args.desc, args.desc_field)
@@ -0,0 +1,596 @@
+'''
+Columnar alternative to the sqlite backed IdentifierDB.
+
+Holds the symbols, entities and reverse mappings as pandas columns, with
+node ids and case-folded symbols integer coded, and applies the same
+cleanup/merge/dedup rules as IdentifierDB using vectorized group-bys and
+joins instead of sql self-joins and temp tables.
+
+The intent is for the processed output and the report to be byte for byte
+the same as from IdentifierDB, so some care is taken to reproduce sqlite's
+behaviour:
+
+ * symbols are compared with sqlite's NOCASE collation, which only folds
+   ascii letters
+ * node ids are stored in an integer affinity column in sqlite, so '007'
+   and '7' are the same node, and ints sort before any text ids
+ * the symbol lists in the report come out in the order sqlite's query plans
+   visit them, which is reproduced here in terms of the symbol rowid (input
+   order)
+'''
+
+import sqlite3, os, time
+import unittest, contextlib
+from io import StringIO
+import numpy as np
+import pandas as pd
+from . import parsers, identifier_merger, disjoint_set, profiling, reporting
+from .constants import *
+
+
+def nocase(values):
+    '''
+    fold a series of strings the way sqlite's NOCASE collation does
+    '''
+    return values.str.translate(NOCASE_TABLE)
+
+
+def node_values_to_codes(values):
+    '''
+    node ids go into an integer affinity column in sqlite, which converts
+    text like '7' or '3.0e+5' into numbers and leaves anything else as
+    text. rather than re-implement those rules we let sqlite do the
+    conversion and the sort for the unique values.
+
+    returns (codes, node_values) where codes are integers in sqlite sort order
+    for each given value, and node_values[code] is the converted value.
+    '''
+
+    uniques, inverse = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+
+    conn = sqlite3.connect(":memory:")
+    with contextlib.closing(conn):
+        conn.execute("create table node_ids (i integer, node_id integer)")
+        conn.executemany("insert into node_ids (i, node_id) values (?,?)", enumerate(uniques.tolist()))
+        rows = conn.execute("select i, node_id from node_ids order by node_id").fetchall()
+
+    unique_codes = np.empty(len(uniques), dtype=np.int64)
+    node_values = []
+    for i, node_id in rows:
+        if not node_values or node_values[-1] != node_id or type(node_values[-1]) != type(node_id):
+            node_values.append(node_id)
+        unique_codes[i] = len(node_values) - 1
+
+    return unique_codes[inverse.ravel()], node_values
+
+
+class ColumnarIdentifierDB:
+
+    def __init__(self, report=None, report_format='text'):
+        '''
+        report is a file-like object, written in one of REPORT_FORMATS
+        '''
+
+        if not report:
+            self.report = open(os.devnull, 'w')
+        else:
+            self.report = report
+        self.report_format = report_format
+
+        self.raw_symbols = []
+        self.raw_entities = []
+        self.raw_reverse = []
+
+        self.symbols = None
+        self.entities = None
+        self.reverse = None
+        self.node_values = None
+
+    def addId(self, id, biotype, desc):
+        self.invalidate()
+        self.raw_entities.append((id, biotype, desc))
+
+    def addSymbol(self, id, symbol, source):
+        self.invalidate()
+        self.raw_symbols.append((id, symbol, source))
+
+    def addSymbols(self, symbols):
+        '''
+        symbols is a list of (nodeid, symbol, source) tuples
+        '''
+        self.invalidate()
+        self.raw_symbols.extend(symbols)
+
+    def addReverseSymbols(self, symbols):
+        self.invalidate()
+        self.raw_reverse.extend(symbols)
+
+    def invalidate(self):
+        '''
+        adding data after processing has started isn't supported, all
+        the loading happens up front
+        '''
+        if self.symbols is not None:
+            raise Exception("can't add identifiers once processing has started")
+
+    def build(self):
+        '''
+        convert the loaded records into integer coded columns
+        '''
+
+        if self.symbols is not None:
+            return
+
+        symbols = pd.DataFrame(self.raw_symbols, columns=['node_id', 'symbol', 'source'], dtype=object)
+        entities = pd.DataFrame(self.raw_entities, columns=['node_id', 'biotype', 'description'], dtype=object)
+        self.raw_symbols = []
+        self.raw_entities = []
+
+        codes, self.node_values = node_values_to_codes(pd.concat([symbols['node_id'], entities['node_id']]))
+        symbols['node'] = codes[:len(symbols)]
+        entities['node'] = codes[len(symbols):]
+
+        # entities.node_id is an integer primary key
+        for node in entities['node']:
+            if not isinstance(self.node_values[node], int):
+                raise Exception("datatype mismatch for entity id '%s'" % self.node_values[node])
+        if entities['node'].duplicated().any():
+            raise Exception("duplicate entity ids")
+
+        # rowid's follow load order, as they would for the sqlite
+        # integer primary key
+        symbols['rowid'] = np.arange(1, len(symbols) + 1, dtype=np.int64)
+        symbols['fold'] = nocase(symbols['symbol'].astype(str)).where(symbols['symbol'].notna(), None)
+        symbols['key'] = pd.factorize(symbols['fold'])[0]
+
+        self.symbols = symbols[['rowid', 'node', 'symbol', 'fold', 'key', 'source']]
+        self.entities = entities[['node', 'biotype', 'description']]
+
+        self.reverse = pd.DataFrame(self.raw_reverse, columns=['entrez_id', 'name', 'ensembl_id', 'biotype'], dtype=object)
+        self.raw_reverse = []
+
+    def symbols_size(self):
+        if self.symbols is None:
+            return len(self.raw_symbols)
+        return len(self.symbols)
+
+    def entities_size(self):
+        if self.entities is None:
+            return len(self.raw_entities)
+        return len(self.entities)
+
+    def report_section(self, name, count, message, records=(), columns=('symbol',)):
+        '''
+        records is a list of tuples, written a batch at a time
+        '''
+        reporting.write_section(self.report, self.report_format, name, count, message,
+                                reporting.batched(records), columns)
+
+    def node_records(self, symbols):
+        '''
+        (node id, symbol) records for a frame of symbols, in rowid order
+        '''
+        symbols = symbols.sort_values('rowid')
+        node_values = self.node_values
+        return [(node_values[node], symbol) for node, symbol in zip(symbols['node'], symbols['symbol'])]
+
+    def keep_symbols(self, mask):
+        self.symbols = self.symbols[mask]
+
+    def cleanup(self):
+        '''
+        remove symbols that are missing, or that contain whilespace
+        '''
+        self.build()
+        s = self.symbols
+        unwanted = (s['fold'] == 'n/a') | (s['symbol'] == '') | s['symbol'].isna() | \
+            s['symbol'].astype(str).str.contains(' ', regex=False)
+        self.keep_symbols(~unwanted)
+
+    def remove_unwanted_sources(self, filters):
+        '''
+        process blacklist of sources we want ignored
+        '''
+
+        if not filters:
+            return
+
+        self.build()
+        self.keep_symbols(~self.symbols['source'].isin([i for i in filters]))
+
+    def standardize_source_names(self):
+        '''
+        source names come from the header line of the input file. apply
+        any naming convention requirements here
+        '''
+
+        self.build()
+        self.symbols = self.symbols.assign(source=self.symbols['source'].replace(RAW_SYNONYM_ORIG, RAW_SYNONYM))
+
+    def clean_empties(self):
+        '''
+        remove entities for which all symbols have been removed
+        '''
+
+        self.build()
+        self.entities = self.entities[self.entities['node'].isin(self.symbols['node'])]
+
+    def biotype_filter(self, biotype_keepers):
+        '''
+        remove any entities and the corresponding symbols
+        that don't match the given list of biotypes
+        '''
+
+        self.build()
+        entities = self.entities
+        unwanted = entities['biotype'].notna() & ~entities['biotype'].isin(biotype_keepers)
+
+        self.keep_symbols(~self.symbols['node'].isin(entities['node'][unwanted]))
+        self.entities = entities[~unwanted]
+
+        ignores_clause = ["'" + i + "'" for i in biotype_keepers]
+        ignores_clause = '(' + ','.join(ignores_clause) + ')'
+
+        n = int(unwanted.sum())
+        self.report_section('biotype_filter', n, "applying biotype filters %s, total records removed: %d" % (ignores_clause, n))
+
+        # also filter reverse mappings by biotype
+        reverse = self.reverse
+        self.reverse = reverse[reverse['biotype'].isna() | reverse['biotype'].isin(REV_DEFAULT_BIOTYPE_KEEPERS)]
+
+        return n
+
+    def delink(self):
+        '''
+        use reverse mappings to break links in raw mappings, see
+        IdentifierDB.delink(). comparisons here are case sensitive,
+        as in the temp tables built there
+        '''
+
+        self.build()
+        s = self.symbols
+
+        entrez = s[s['source'] == 'Entrez Gene ID']
+        ensembl = s[s['source'] == 'Ensembl Gene ID']
+        named = s['node'][s['source'] == 'Gene Name']
+
+        # entrez records for entities that also have an ensembl id and a name,
+        # ie those that would end up in the ensembl_to_entrez table
+        entrez = entrez[entrez['node'].isin(ensembl['node']) & entrez['node'].isin(named)]
+
+        pairs = pd.merge(entrez[['rowid', 'node', 'symbol']], ensembl[['node', 'symbol']],
+                         on='node', suffixes=('_entrez', '_ensembl'))
+        reverse = self.reverse[['entrez_id', 'ensembl_id']]
+        consistent = pd.merge(pairs, reverse, left_on=['symbol_entrez', 'symbol_ensembl'],
+                              right_on=['entrez_id', 'ensembl_id'])
+
+        # entrez ids attached to more than one entity, that we
+        # also have a consistent mapping for
+        nodes_per_entrez = entrez.groupby('symbol')['node'].nunique()
+        inconsistent = nodes_per_entrez.index[nodes_per_entrez > 1]
+        inconsistent = entrez['symbol'].isin(inconsistent) & entrez['symbol'].isin(consistent['entrez_id'])
+
+        unwanted = entrez['rowid'][inconsistent & ~entrez['rowid'].isin(consistent['rowid'])]
+        delinked = s['rowid'].isin(unwanted)
+
+        n = int(delinked.sum())
+        self.report_section('delinked', n, "removing %d entrez ids inconsistent with the reverse mappings:" % n,
+                            self.node_records(s[delinked]), ('node_id', 'symbol'))
+
+        self.keep_symbols(~delinked)
+
+    def merge(self):
+        '''
+        merge entities sharing a gene name into the entity with the
+        lowest node id, see IdentifierDB.merge()
+        '''
+
+        self.build()
+        s = self.symbols
+        names = s.loc[s['source'] == RAW_GENE_NAME, ['rowid', 'node', 'symbol']].sort_values('rowid')
+        names, targets = disjoint_set.merge_gene_names(names['node'].tolist(), names['symbol'].tolist())
+
+        n = len(names)
+        self.report_section('merged_names', n, "%d gene names belong to multiple genes and will be merged" % n,
+                            [(name,) for name in names])
+
+        if n == 0:
+            return
+
+        targets = pd.Series(targets)
+        node = s['node'].to_numpy()
+        to_fix = np.isin(node, targets.index)
+        node = node.copy()
+        node[to_fix] = targets.reindex(node[to_fix]).to_numpy()
+        self.symbols = s.assign(node=node)
+
+        self.entities = self.entities[~self.entities['node'].isin(targets.index)]
+
+    def dedup(self):
+
+        self.dedup_syn_vs_nonsyn()
+        self.dedup_entity_vs_entity()
+        self.dedup_entity_within_itself()
+
+    def dedup_syn_vs_nonsyn(self):
+        # synonyms that conflict with non synonyms
+
+        self.build()
+        s = self.symbols
+        is_syn = s['source'] == RAW_SYNONYM
+        nonsyn_counts = s['key'][s['source'].notna() & ~is_syn].value_counts()
+
+        # a synonym is listed once for each non-synonym it clashes with
+        clashes = s['key'].map(nonsyn_counts).fillna(0).astype(np.int64)
+        dup_syn = is_syn & (clashes > 0)
+
+        n = int(clashes[dup_syn].sum())
+        dups = s[dup_syn].sort_values('rowid')
+        self.report_section('syn_vs_nonsyn', n, "removing %d synonyms for conflict with non-synonyms:" % n,
+                            [(symbol,) for symbol in dups['symbol'].repeat(clashes[dup_syn])])
+
+        self.keep_symbols(~dup_syn)
+
+    def dedup_entity_vs_entity(self):
+        # conflict between different entities, need to delete these
+        # symbols completely
+
+        self.build()
+        s = self.symbols
+        nodes_per_key = s.groupby('key')['node'].nunique()
+        dups = s['key'].isin(nodes_per_key.index[nodes_per_key > 1])
+
+        # listed in order of first appearance
+        firsts = s[dups].sort_values('rowid').drop_duplicates('key')
+
+        n = len(firsts)
+        self.report_section('entity_vs_entity', n, "removing %d symbols for conflict between different genes" % n,
+                            [(symbol,) for symbol in firsts['symbol']])
+
+        self.keep_symbols(~dups)
+
+    def dedup_entity_within_itself(self):
+        # all that can be left are conflicts within an entity, keep
+        # the first copy of each symbol
+
+        self.build()
+        s = self.symbols.sort_values('rowid')
+        duplicates = s.duplicated(subset=['node', 'key'])
+
+        n = int(duplicates.sum())
+        self.report_section('within_entity', n, "removing %d symbols duplicated within a gene:" % n,
+                            self.node_records(s[duplicates]), ('node_id', 'symbol'))
+
+        self.symbols = s[~duplicates]
+
+    def validate(self):
+
+        self.build()
+        s = self.symbols
+
+        # verify symbols are unique
+        total = int(s['symbol'].notna().sum())
+        unique = s['key'][s['symbol'].notna()].nunique()
+        if total != unique:
+            raise Exception("total %d not equal to unique %d" % (total, unique))
+
+        # make sure each entity has at least one symbol attached
+        total = int((~self.entities['node'].isin(s['node'][s['symbol'].notna()])).sum())
+        if total > 0:
+            raise Exception("%d entities have no symbols at all" % total)
+
+        # verify at most 1 gene name attached to each entity
+        names = s[(s['source'] == RAW_GENE_NAME) & s['symbol'].notna() & s['node'].isin(self.entities['node'])]
+        names_per_entity = names['node'].value_counts()
+        total = int((names_per_entity > 1).sum())
+        if total > 0:
+            raise Exception("%d entities have more than one gene name" % total)
+
+    def export_processed(self, export_file, org_prefix=None):
+
+        record_pattern = '%s\t%s\t%s\n'
+        if org_prefix:
+            record_pattern = org_prefix + ':' + record_pattern
+
+        self.build()
+        s = self.symbols.sort_values(['node', 'source', 'fold'], kind='mergesort')
+        node_values = self.node_values
+
+        export_file.writelines(record_pattern % (node_values[node], symbol, source)
+                               for node, symbol, source in zip(s['node'], s['symbol'], s['source']))
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.symbols = self.entities = self.reverse = None
+        self.raw_symbols = []
+        self.raw_entities = []
+        self.raw_reverse = []
+
+    def drop_indices(self):
+        pass
+
+    def index(self):
+        pass
+
+    def load_raw(self, filename):
+        '''
+        read all identifier data from the output of idmapper,
+        e.g. 'ENSEMBL_ENTREZ_Hs'.
+
+        takes a file object, not a filename
+        '''
+
+        start = time.time()
+        rows = 0
+        parser = parsers.RawIdFrameParser(filename)
+        for entities, symbols in parser.batches(identifier_merger.BULK_INSERT_BATCH_SIZE):
+            self.invalidate()
+            self.raw_entities.extend(zip(*entities))
+            self.raw_symbols.extend(zip(*symbols))
+            rows += len(symbols[0])
+
+        identifier_merger.report_load_rate('symbol', rows, start)
+
+    def load_reverse_mappings(self, filename):
+        '''
+        entrez to ensembl mappings
+        '''
+
+        start = time.time()
+        rows = 0
+        parser = parsers.EntrezToEnsemblParser(filename)
+        for records in parser.chunks(identifier_merger.BULK_INSERT_BATCH_SIZE):
+            self.addReverseSymbols(records)
+            rows += len(records)
+
+        identifier_merger.report_load_rate('reverse mapping', rows, start)
+
+    def load_3col(self, filename):
+        '''
+        id, symbol, source triplets
+        '''
+
+        start = time.time()
+        rows = 0
+        parser = parsers.Col3Parser(filename)
+        for symbols in parser.chunks(identifier_merger.BULK_INSERT_BATCH_SIZE):
+            self.addSymbols(symbols)
+            rows += len(symbols)
+
+        identifier_merger.report_load_rate('symbol', rows, start)
+
+    def process(self, biotype_keepers, filters, merge_names, profile=None):
+        '''
+        apply cleaning, merging, deduplicating logic. pass a
+        profiling.StepProfile to record each step
+        '''
+
+        if profile is None:
+            profile = profiling.NoProfile()
+
+        self.build()
+        print('initial data, # symbols =', self.symbols_size(), '# entities =', self.entities_size())
+
+        with profile.step('cleanup'):
+            self.cleanup()
+        print('removed empty symbols, size =', self.symbols_size(), '# entities =', self.entities_size())
+
+        with profile.step('remove_unwanted_sources'):
+            self.remove_unwanted_sources(filters)
+        print('removed symbols belonging to unwanted sources, size =', self.symbols_size(), '# entities =', self.entities_size())
+
+        with profile.step('standardize_source_names'):
+            self.standardize_source_names()
+
+        with profile.step('biotype_filter'):
+            self.biotype_filter(biotype_keepers)
+        print('applied biotype filter, size =', self.symbols_size(), '# entities =', self.entities_size())
+
+        with profile.step('delink'):
+            self.delink()
+        print('delinked, size =', self.symbols_size(), '# entities =', self.entities_size())
+
+        if merge_names:
+            with profile.step('merge'):
+                self.merge()
+            print('merged, size =', self.symbols_size(), '# entities =', self.entities_size())
+        else:
+            print('gene name merging disabled for this organism')
+
+        with profile.step('dedup_syn_vs_nonsyn'):
+            self.dedup_syn_vs_nonsyn()
+        with profile.step('dedup_entity_vs_entity'):
+            self.dedup_entity_vs_entity()
+        with profile.step('dedup_entity_within_itself'):
+            self.dedup_entity_within_itself()
+        print('deduped, size =', self.symbols_size(), '# entities =', self.entities_size())
+
+        with profile.step('clean_empties'):
+            self.clean_empties()
+        print('removed empties, size =', self.symbols_size(), '# entities =', self.entities_size())
+
+
+class TestColumnarIdentifierDB(unittest.TestCase):
+    '''
+    the columnar engine should give exactly the same output
+    and report as the sqlite engine
+    '''
+
+    def run_engine(self, db, raw, reverse=None, merge_names=True, report_format='text'):
+        report = StringIO()
+        db.report = report
+        db.report_format = report_format
+
+        with contextlib.closing(db), contextlib.redirect_stdout(StringIO()):
+            db.load_raw(identifier_merger.data_to_file(raw))
+            if reverse:
+                db.load_reverse_mappings(identifier_merger.data_to_file(reverse))
+
+            db.process(RAW_DEFAULT_BIOTYPE_KEEPERS, RAW_DEFAULT_SOURCES_TO_REMOVE, merge_names)
+            db.validate()
+
+            output = StringIO()
+            db.export_processed(output, 'Org')
+
+        return output.getvalue(), report.getvalue()
+
+    def assertSameAsSqlite(self, raw, reverse=None, merge_names=True):
+        for report_format in reversed(REPORT_FORMATS):
+            expected = self.run_engine(identifier_merger.IdentifierDB(":memory:"), raw, reverse, merge_names, report_format)
+            actual = self.run_engine(ColumnarIdentifierDB(), raw, reverse, merge_names, report_format)
+            self.assertEqual(expected[0], actual[0])
+            self.assertEqual(expected[1], actual[1])
+        return actual
+
+    def test_testdata(self):
+        output, report = self.assertSameAsSqlite(identifier_merger.testdata)
+        expected = identifier_merger.data_to_file(identifier_merger.testdata_output).getvalue()
+        self.assertEqual(expected, output.replace('Org:', ''))
+
+    def test_delink(self):
+        self.assertSameAsSqlite(identifier_merger.testdata_delink_input,
+                                identifier_merger.testdata_delink_reverse)
+
+    def test_random(self):
+        # lots of clashing names, mixed case, and awkward node ids
+        rng = np.random.RandomState(0)
+        names = ['gene%d' % i for i in range(20)] + ['Gene%d' % i for i in range(5)] + ['N/A', 'two words']
+        node_ids = [str(i) for i in range(1, 60)] + ['007', '3.0', 'x1']
+
+        for trial in range(10):
+            raw = [('GMID', 'Ensembl Gene ID', 'Gene Name', 'Protein Coding', 'Entrez Gene ID', 'Synonyms', 'Definition')]
+            for node_id in rng.choice(node_ids[:-3], 40, replace=False):
+                raw.append((node_id, 'ENSG%d' % rng.randint(30), rng.choice(names),
+                            rng.choice(['protein_coding', 'True', 'rna']), '%d' % rng.randint(30),
+                            ';'.join(rng.choice(names, rng.randint(4))), 'desc'))
+
+            reverse = [('GeneID', 'Symbol', 'Synonyms', 'dbXrefs', 'description', 'type_of_gene')]
+            for i in range(30):
+                reverse.append(('%d' % i, 'gene_%d' % i, '', 'Ensembl:ENSG%d|HGNC:1' % rng.randint(30), '', 'protein-coding'))
+
+            self.assertSameAsSqlite(raw, reverse, merge_names=bool(trial % 2))
+
+    def test_triplets(self):
+        rng = np.random.RandomState(1)
+        names = ['gene%d' % i for i in range(30)] + ['GENE%d' % i for i in range(10)]
+        node_ids = [str(i) for i in range(1, 40)] + ['007', '3.0', 'x1', 'x2']
+        sources = [RAW_GENE_NAME, RAW_SYNONYM_ORIG, 'Entrez Gene ID', 'Ensembl Gene ID', 'Uniprot ID']
+
+        for trial in range(10):
+            triplets = [(rng.choice(node_ids), rng.choice(names), rng.choice(sources)) for i in range(150)]
+            triplets = '\n'.join('\t'.join(triplet) for triplet in triplets) + '\n'
+
+            results = []
+            for db in [identifier_merger.IdentifierDB(":memory:"), ColumnarIdentifierDB()]:
+                db.report = StringIO()
+                with contextlib.closing(db), contextlib.redirect_stdout(StringIO()):
+                    db.load_3col(StringIO(triplets))
+                    db.process(['True'], [], True)
+                    output = StringIO()
+                    db.export_processed(output)
+                    results.append((output.getvalue(), db.report.getvalue()))
+
+            self.assertEqual(results[0], results[1])
+
@@ -38,8 +38,18 @@ REV_DEFAULT_BIOTYPE_KEEPERS = ['protein-coding']
 REV_ENSEMBL = 'Ensembl'
 REV_XREFS = 'dbXrefs'
 
+# symbols are compared with sqlite's NOCASE collation, which
+# only folds A-Z. for use with str.translate()
+NOCASE_TABLE = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
 # 3 col format fields
 COL3_GMID = 'GMID'
 COL3_SYMBOL = 'Symbol'
 COL3_SOURCE = 'Source'
 
+
+# implementations of the identifier cleaning, see identifier_merger.create_db()
+IDENTIFIER_ENGINES = ['sqlite', 'columnar']
+
+# layouts of the identifier cleaning report, see reporting.write_section()
+REPORT_FORMATS = ['text', 'tsv', 'jsonl']
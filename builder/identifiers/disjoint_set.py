@@ -0,0 +1,130 @@
+'''
+union-find for merging gene entities that share a gene name
+'''
+
+import unittest
+from .constants import *
+
+
+class DisjointSet(object):
+    '''
+    disjoint sets over the integers 0..n-1, with union by
+    size and path halving. smallest() gives the lowest
+    member of a set.
+    '''
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self.size = [1] * n
+        self.lowest = list(range(n))
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x, y):
+        x = self.find(x)
+        y = self.find(y)
+        if x == y:
+            return x
+
+        if self.size[x] < self.size[y]:
+            x, y = y, x
+
+        self.parent[y] = x
+        self.size[x] += self.size[y]
+        self.lowest[x] = min(self.lowest[x], self.lowest[y])
+        return x
+
+    def smallest(self, x):
+        return self.lowest[self.find(x)]
+
+
+def merge_gene_names(nodes, symbols):
+    '''
+    nodes and symbols are the node ids and gene names of the gene name
+    records, in rowid order. node ids must be integers that order the
+    same way as the original ids.
+
+    gene names are compared case insensitively as in the sqlite NOCASE
+    collation. entities sharing a gene name, directly or through a chain
+    of shared names, are merged into the entity with the lowest node id.
+
+    returns (names, targets):
+
+     * names: the gene names shared by more than one entity, sorted
+       case insensitively. where a name appears with different case,
+       the spelling is that of the first record paired with a higher node
+       id, which is what the sql implementation reported
+     * targets: dict of node id to the node id it is merged into
+    '''
+
+    groups = {}
+    for i, (node, symbol) in enumerate(zip(nodes, symbols)):
+        key = symbol.translate(NOCASE_TABLE)
+        try:
+            groups[key].append(i)
+        except KeyError:
+            groups[key] = [i]
+
+    involved = set()
+    names = []
+    merging = []
+    for key, rows in groups.items():
+        group_nodes = [nodes[i] for i in rows]
+        highest = max(group_nodes)
+        if min(group_nodes) == highest:
+            continue
+
+        first = next(i for i in rows if nodes[i] != highest)
+        names.append((key, symbols[first]))
+
+        involved.update(group_nodes)
+        merging.append(group_nodes)
+
+    # union-find over the entities involved, indexed in node id
+    # order so the smallest member of a set is its lowest node id
+    ordered = sorted(involved)
+    index = dict((node, i) for i, node in enumerate(ordered))
+    entities = DisjointSet(len(ordered))
+    for group_nodes in merging:
+        first = index[group_nodes[0]]
+        for node in group_nodes[1:]:
+            entities.union(first, index[node])
+
+    targets = {}
+    for node, i in index.items():
+        target = ordered[entities.smallest(i)]
+        if target != node:
+            targets[node] = target
+
+    names.sort()
+    return [name for key, name in names], targets
+
+
+class TestDisjointSet(unittest.TestCase):
+
+    def test_union(self):
+        sets = DisjointSet(6)
+        sets.union(4, 5)
+        sets.union(2, 5)
+        sets.union(0, 1)
+
+        self.assertEqual(sets.find(2), sets.find(4))
+        self.assertNotEqual(sets.find(0), sets.find(2))
+        self.assertEqual(2, sets.smallest(5))
+        self.assertEqual(0, sets.smallest(1))
+        self.assertEqual(3, sets.smallest(3))
+
+    def test_merge_gene_names(self):
+        # 10 and 30 share a name, 20 is linked to them through 30,
+        # 40 has a name to itself
+        nodes = [30, 10, 20, 40, 20, 30]
+        symbols = ['abc', 'ABC', 'xyz', 'lonely', 'def', 'xyz']
+
+        names, targets = merge_gene_names(nodes, symbols)
+        self.assertEqual(['ABC', 'xyz'], names)
+        self.assertEqual({20: 10, 30: 10}, targets)
@@ -21,32 +21,68 @@ Symbol cleanup:
        
 '''
 
-import sqlite3, codecs, os, sys
-import unittest
+import sqlite3, codecs, os, sys, time, hashlib, json
+import unittest, tempfile, shutil
 from io import StringIO
-from . import parsers
+from . import parsers, disjoint_set, profiling, reporting
 import contextlib, difflib
 from .constants import *
 
 INSERT_BATCH_SIZE = 100
+BULK_INSERT_BATCH_SIZE = 50000
+
+# settings for bulk loading. the database is a throwaway
+# working copy, so we don't need a rollback journal or
+# durable writes
+BULK_LOAD_PRAGMAS = """
+pragma journal_mode = off;
+pragma synchronous = off;
+pragma cache_size = -262144;
+pragma locking_mode = exclusive;
+pragma temp_store = memory;
+"""
+
+def report_load_rate(what, rows, start):
+    elapsed = time.time() - start
+    rate = rows / elapsed if elapsed > 0 else 0
+    print('loaded %d %s rows in %.2fs (%d rows/sec)' % (rows, what, elapsed, rate))
 
 class IdentifierDB:
 
-    def __init__(self, dbfile, report=None):
+    def __init__(self, dbfile, report=None, bulk=False, create=True, report_format='text'):
         '''
-        report is a file-like object
+        report is a file-like object, written in one of REPORT_FORMATS,
+        see reporting.write_section()
+
+        if bulk is set, data is loaded in large batches with
+        durability turned off, and indices are only built once
+        after loading is complete, see ensure_index()
+
+        set create to False to open a previously saved db
+        without clearing it
         '''
   
         if not report:
             self.report = open(os.devnull, 'w')
         else:
             self.report = report
+        self.report_format = report_format
         
         self.conn = sqlite3.connect(dbfile)
         self.conn.row_factory = sqlite3.Row
 
+        self.bulk = bulk
+        if bulk:
+            self.conn.executescript(BULK_LOAD_PRAGMAS)
+
+        self.needs_index = False
+        if not create:
+            return
+
         self.create_tables()
-        self.index()    
+        self.needs_index = bulk
+        if not bulk:
+            self.index()    
 
     def create_tables(self):
         self.drop_tables()
@@ -77,6 +113,14 @@ class IdentifierDB:
         """
         self.conn.executescript(sql)
         self.conn.commit()        
+        self.needs_index = False
+
+    def ensure_index(self):
+        '''
+        build indices if bulk loading has deferred them
+        '''
+        if self.needs_index:
+            self.index()
     
     def drop_indices(self):
         sql = """
@@ -87,6 +131,13 @@ class IdentifierDB:
         self.conn.executescript(sql)
         self.conn.commit()
         
+    def addIds(self, ids):
+        '''
+        ids is a list of (nodeid, biotype, desc) tuples
+        '''
+        sql = "insert into entities (node_id, biotype, description) values (?,?,?)"
+        self.conn.executemany(sql, ids)
+
     def addId(self, id, biotype, desc):
         sql = "insert into entities (node_id, biotype, description) values (?,?,?)"
         try:
@@ -98,7 +149,8 @@ class IdentifierDB:
     def addSymbol(self, id, symbol, source ):
         sql = "insert into symbols (node_id, symbol, source) values (?,?,?)"
         self.conn.execute(sql, (id, symbol, source))
-        self.conn.commit()
+        if not self.bulk:
+            self.conn.commit()
 
     def addSymbols(self, symbols):
         '''
@@ -124,13 +176,16 @@ class IdentifierDB:
     def changes(self):
         return self.count("select changes()")
     
-    def selectToFile(self, sql, afile):
-        cursor = self.conn.execute(sql)
-        #print sql
-        row = cursor.fetchone()
-        while row:
-            afile.write('%s\n' % '\t'.join(row))
-            row = cursor.fetchone()
+    def report_section(self, name, count, message, batches=(), columns=('symbol',)):
+        reporting.write_section(self.report, self.report_format, name, count, message, batches, columns)
+
+    def query_batches(self, sql):
+        '''
+        stream the results of a query into a report section
+        '''
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        return reporting.fetch_batches(cursor.execute(sql))
         
     def cleanup(self):
         '''
@@ -211,7 +266,7 @@ class IdentifierDB:
         self.conn.commit()
         
         n = self.changes()
-        self.report.write("applying biotype filters %s, total records removed: %d\n" % (ignores_clause, n))
+        self.report_section('biotype_filter', n, "applying biotype filters %s, total records removed: %d" % (ignores_clause, n))
         
         # also filter reverse mappings by biotype
         ignores_clause = ["'" + i + "'" for i in REV_DEFAULT_BIOTYPE_KEEPERS]
@@ -304,7 +359,9 @@ class IdentifierDB:
         # the inconsistencies in the raw data, and the aren't one of the
         # consistent entrez-ensembl mappings.
         sql = """
-        delete from symbols where source = 'Entrez Gene ID' and
+        drop table if exists delinked;
+        create temp table delinked as
+        select rowid, node_id, symbol from symbols where source = 'Entrez Gene ID' and
         rowid not in 
         (select entrez_rowid from consistent_ensembl_entrez)
         and rowid in 
@@ -312,10 +369,74 @@ class IdentifierDB:
         union select entrez_rowid2 from inconsistent_raw_entities);
         """
         self.conn.executescript(sql)
+
+        n = self.count("select count(*) from delinked;")
+        self.report_section('delinked', n, "removing %d entrez ids inconsistent with the reverse mappings:" % n,
+                            self.query_batches("select node_id, symbol from delinked order by rowid;") if n > 0 else (),
+                            ('node_id', 'symbol'))
+
+        sql = "delete from symbols where rowid in (select rowid from delinked);"
+        self.conn.execute(sql)
+        self.conn.commit()
                 
-    def merge(self):       
+    def merge(self):
         '''
-        several helper/working tables:
+        merge entities sharing a gene name into the entity with
+        the lowest node id. entities are grouped with union-find
+        rather than by self-joining the symbols table, which grows
+        with the square of the number of entities sharing a name.
+
+        entities linked through a chain of shared gene names all end up
+        in the same entity. merge_self_join() would instead move an entity
+        onto an intermediate one that gets merged away itself.
+        '''
+
+        sql = "select distinct node_id from symbols where source = ? order by node_id;"
+        node_ids = [row[0] for row in self.conn.execute(sql, [RAW_GENE_NAME])]
+        codes = dict((node_id, code) for code, node_id in enumerate(node_ids))
+
+        sql = "select node_id, symbol from symbols where source = ? order by rowid;"
+        rows = self.conn.execute(sql, [RAW_GENE_NAME]).fetchall()
+        names, targets = disjoint_set.merge_gene_names([codes[row[0]] for row in rows],
+                                                       [row[1] for row in rows])
+
+        # report what we're doing, before applying the fixes
+        n = len(names)
+        self.report_section('merged_names', n, "%d gene names belong to multiple genes and will be merged" % n,
+                            reporting.batched([(name,) for name in names]))
+
+        sql = """
+        drop table if exists to_fix;
+        create table to_fix (node_id int, new_node_id int);
+        """
+        self.conn.executescript(sql)
+
+        sql = "insert into to_fix (node_id, new_node_id) values (?, ?);"
+        self.conn.executemany(sql, ((node_ids[node], node_ids[target]) for node, target in targets.items()))
+        self.conn.execute("create index ix_tofix on to_fix (node_id);")
+
+        # apply the new entity ids to the symbols table
+        sql = """
+        update symbols set node_id =
+        (select to_fix.new_node_id from to_fix
+        where to_fix.node_id = symbols.node_id)
+        where node_id in (select node_id from to_fix);
+        """
+        self.conn.executescript(sql)
+
+        # the entities that have been merged can be
+        # removed from the entities table
+        sql = """
+        delete from entities where node_id in
+        (select node_id from to_fix);
+        """
+        self.conn.executescript(sql)
+        self.conn.commit()
+
+    def merge_self_join(self):
+        '''
+        the original sql implementation of merge(), kept for
+        comparison in benchmarks.py. several helper/working tables:
         
           * merge: contains gene name and pairs of node_id's, for different nodes (entities)
             having the same gene name, with the first column getting the lower
@@ -388,10 +509,8 @@ class IdentifierDB:
 
         # report what we're doing, before applying the fixes
         n = self.count("select count(distinct symbol) from merge;")
-        self.report.write("%d gene names belong to multiple genes and will be merged\n" % n)
-        if n > 0:
-            sql = "select distinct symbol from merge;"
-            self.selectToFile(sql, self.report)
+        self.report_section('merged_names', n, "%d gene names belong to multiple genes and will be merged" % n,
+                            self.query_batches("select distinct symbol from merge;") if n > 0 else ())
         
         # apply the new entity ids to the symbols table
         sql = """
@@ -437,15 +556,13 @@ class IdentifierDB:
 
         # report
         n = self.count("select count(*) from dup_syn;")
-        self.report.write("removing %d synonyms for conflict with non-synonyms:\n" % n)
 
-        if n>0:                
-            sql = """
-            select symbols.symbol as symbol from dup_syn join symbols
-            on symbols.rowid = dup_syn.rowid;
-            """
-    
-            self.selectToFile(sql, self.report)
+        sql = """
+        select symbols.symbol as symbol from dup_syn join symbols
+        on symbols.rowid = dup_syn.rowid;
+        """
+        self.report_section('syn_vs_nonsyn', n, "removing %d synonyms for conflict with non-synonyms:" % n,
+                            self.query_batches(sql) if n > 0 else ())
         
         # delete 
         sql = "delete from symbols where rowid in (select rowid from dup_syn);"
@@ -468,11 +585,8 @@ class IdentifierDB:
         self.conn.executescript(sql)
         
         n = self.count("select count(distinct symbol) from dup_between_entities;")
-        self.report.write("removing %d symbols for conflict between different genes\n" % n)
-        
-        if n > 0:
-            sql = "select distinct symbol from dup_between_entities;"
-            self.selectToFile(sql, self.report)
+        self.report_section('entity_vs_entity', n, "removing %d symbols for conflict between different genes" % n,
+                            self.query_batches("select distinct symbol from dup_between_entities;") if n > 0 else ())
 
         sql = "delete from symbols where symbol in (select symbol from dup_between_entities);"
         self.conn.execute(sql)
@@ -522,6 +636,11 @@ class IdentifierDB:
         """
         self.conn.execute(sql)
         self.conn.commit()
+
+        n = self.count("select count(*) from dup_within_entities;")
+        self.report_section('within_entity', n, "removing %d symbols duplicated within a gene:" % n,
+                            self.query_batches("select node_id, symbol from dup_within_entities order by rowid;") if n > 0 else (),
+                            ('node_id', 'symbol'))
         
         # now apply the kill list
         sql = "delete from symbols where rowid in (select rowid from dup_within_entities);"
@@ -529,42 +648,45 @@ class IdentifierDB:
         self.conn.commit()
             
     def validate(self):
-        
+        '''
+        check the cleaned symbols, with the counts all taken from one
+        pass over the symbols. the first use of each symbol is numbered
+        1 so the unique symbols can be counted along with the per entity
+        counts, rather than in a separate scan
+        '''
+
+        sql = """
+        with per_node as
+        (select node_id, count(symbol) as symbols,
+        sum(symbol is not null and nth = 1) as unique_symbols,
+        sum(source = ? and symbol is not null) as names
+        from (select node_id, symbol, source,
+              row_number() over (partition by symbol order by rowid) as nth
+              from symbols)
+        group by node_id)
+        select total(symbols), total(unique_symbols),
+        (select count(*) from entities left outer join per_node
+        on entities.node_id = per_node.node_id
+        where ifnull(per_node.symbols, 0) = 0),
+        (select count(*) from entities join per_node
+        on entities.node_id = per_node.node_id
+        where per_node.names > 1)
+        from per_node;
+        """
+        total, unique, no_symbols, many_names = self.conn.execute(sql, [RAW_GENE_NAME]).fetchone()
+
         # verify symbols are unique
-        total = self.count("select count(symbol) from symbols;")
-        unique = self.count("select count(distinct symbol) from symbols;")
         if total != unique:
-            raise Exception("total %d not equal to unique %d" % (total, unique))        
-        
+            raise Exception("total %d not equal to unique %d" % (total, unique))
+
         # make sure each entity has at least one symbol attached
-        sql = """
-        select count(*) from 
-        (select entities.node_id
-        from entities left outer join symbols
-        on entities.node_id = symbols.node_id
-        group by entities.node_id
-        having count(symbols.symbol) = 0);
-        """
-        total = self.count(sql)
-        if total > 0:
-            raise Exception("%d entities have no symbols at all" % total)   
-            
+        if no_symbols > 0:
+            raise Exception("%d entities have no symbols at all" % no_symbols)
+
         # verify at most 1 gene name attached to each entity
-        sql = """
-        select count(*) from 
-        (select entities.node_id
-        from entities join symbols
-        on entities.node_id = symbols.node_id
-        where symbols.source = '%s'
-        group by entities.node_id
-        having count(symbols.symbol) > 1);
-        """
-        sql = sql % RAW_GENE_NAME
-        total = self.count(sql)
-        if total > 0:
-            raise Exception("%d entities have more than one gene name" % total)
+        if many_names > 0:
+            raise Exception("%d entities have more than one gene name" % many_names)
 
-        # symbols wit
     def get_symbol(self, symbol = None):
         '''
         to facilitate unit testing
@@ -608,6 +730,21 @@ class IdentifierDB:
     def close(self):
         self.conn.close()
 
+    def save(self, filename):
+        '''
+        copy the db to the given file, e.g. to keep the
+        state of an in-memory db
+        '''
+        self.conn.commit()
+        if os.path.exists(filename):
+            os.remove(filename)
+
+        target = sqlite3.connect(filename)
+        try:
+            self.conn.backup(target)
+        finally:
+            target.close()
+
     def load_raw(self, filename):
         '''
         read all identifier data from the output of idmapper,
@@ -616,6 +753,11 @@ class IdentifierDB:
         takes a file object, not a filename
         '''
         
+        if self.bulk:
+            return self.bulk_load_raw(filename)
+
+        start = time.time()
+        rows = 0
         parser = parsers.RawIdFileParser(filename)
         symbols = []
         for entity in parser.reader():
@@ -624,21 +766,50 @@ class IdentifierDB:
                 symbols.append((entity.gmid(), symbol, source))
             
             if len(symbols) == INSERT_BATCH_SIZE:
+                rows += len(symbols)
                 self.addSymbols(symbols)
                 symbols = []
                 
         if len(symbols) > 0:
+            rows += len(symbols)
             self.addSymbols(symbols)
             symbols = []
     
         self.commit()
         self.index()
+        report_load_rate('symbol', rows, start)
+
+    def bulk_load_raw(self, filename):
+        parser = parsers.RawIdFrameParser(filename)
+        self.load_raw_batches(parser.batches(BULK_INSERT_BATCH_SIZE))
+
+    def load_raw_batches(self, batches):
+        '''
+        load (entities, symbols) batches of arrays as given
+        by parsers.RawIdFrameParser.batches()
+        '''
+
+        start = time.time()
+        rows = 0
+        for entities, symbols in batches:
+            self.addIds(zip(*entities))
+            self.addSymbols(zip(*symbols))
+            rows += len(symbols[0])
+
+        self.commit()
+        self.needs_index = True
+        report_load_rate('symbol', rows, start)
         
     def load_reverse_mappings(self, filename):
         '''
         entrez to ensembl mappings
         '''
         
+        if self.bulk:
+            return self.bulk_load_reverse_mappings(filename)
+
+        start = time.time()
+        rows = 0
         parser = parsers.EntrezToEnsemblParser(filename)
         symbols = []
         
@@ -648,15 +819,30 @@ class IdentifierDB:
                 symbols.append(record)
 
             if len(symbols) == INSERT_BATCH_SIZE:
+                rows += len(symbols)
                 self.addReverseSymbols(symbols)
                 symbols = []
                 
         if len(symbols) > 0:
+            rows += len(symbols)
             self.addReverseSymbols(symbols)
             symbols = []
     
         self.commit()
         self.index()
+        report_load_rate('reverse mapping', rows, start)
+
+    def bulk_load_reverse_mappings(self, filename):
+        start = time.time()
+        rows = 0
+        parser = parsers.EntrezToEnsemblParser(filename)
+        for records in parser.chunks(BULK_INSERT_BATCH_SIZE):
+            self.addReverseSymbols(records)
+            rows += len(records)
+
+        self.commit()
+        self.needs_index = True
+        report_load_rate('reverse mapping', rows, start)
 
     def load_3col(self, filename):
         '''
@@ -664,6 +850,11 @@ class IdentifierDB:
 
         '''
 
+        if self.bulk:
+            return self.bulk_load_3col(filename)
+
+        start = time.time()
+        rows = 0
         parser = parsers.Col3Parser(filename)
 
         symbols = []
@@ -672,52 +863,116 @@ class IdentifierDB:
             symbols.append(record)
 
             if len(symbols) == INSERT_BATCH_SIZE:
+                rows += len(symbols)
                 self.addSymbols(symbols)
                 symbols = []
 
 
         if len(symbols) > 0:
+            rows += len(symbols)
             self.addSymbols(symbols)
             symbols = []
 
         self.commit()
         self.index()
+        report_load_rate('symbol', rows, start)
+
+    def bulk_load_3col(self, filename):
+        start = time.time()
+        rows = 0
+        parser = parsers.Col3Parser(filename)
+        for symbols in parser.chunks(BULK_INSERT_BATCH_SIZE):
+            self.addSymbols(symbols)
+            rows += len(symbols)
+
+        self.commit()
+        self.needs_index = True
+        report_load_rate('symbol', rows, start)
 
-    def process(self, biotype_keepers, filters, merge_names):
+    def process(self, biotype_keepers, filters, merge_names, profile=None):
         '''
-        apply cleaning, merging, deduplicating logic
+        apply cleaning, merging, deduplicating logic. pass a
+        profiling.StepProfile to record each step
         '''
-    
+
+        if profile is None:
+            profile = profiling.NoProfile()
+
+        self.ensure_index()
         print('initial data, # symbols =', self.symbols_size(), '# entities =', self.entities_size())
 
-        self.cleanup()
+        with profile.step('cleanup'):
+            self.cleanup()
         print('removed empty symbols, size =', self.symbols_size(), '# entities =', self.entities_size())
 
-        self.remove_unwanted_sources(filters)
+        with profile.step('remove_unwanted_sources'):
+            self.remove_unwanted_sources(filters)
         print('removed symbols belonging to unwanted sources, size =', self.symbols_size(), '# entities =', self.entities_size())
-        
-        self.standardize_source_names()
-        
-        self.biotype_filter(biotype_keepers)                
+
+        with profile.step('standardize_source_names'):
+            self.standardize_source_names()
+
+        with profile.step('biotype_filter'):
+            self.biotype_filter(biotype_keepers)
         print('applied biotype filter, size =', self.symbols_size(), '# entities =', self.entities_size())
-        
-        self.delink()
+
+        with profile.step('delink'):
+            self.delink()
         print('delinked, size =', self.symbols_size(), '# entities =', self.entities_size())
 
-        if merge_names:        
-            self.merge()
+        if merge_names:
+            with profile.step('merge'):
+                self.merge()
             print('merged, size =', self.symbols_size(), '# entities =', self.entities_size())
         else:
             print('gene name merging disabled for this organism')
-            
-        self.dedup()
+
+        with profile.step('dedup_syn_vs_nonsyn'):
+            self.dedup_syn_vs_nonsyn()
+        with profile.step('dedup_entity_vs_entity'):
+            self.dedup_entity_vs_entity()
+        with profile.step('dedup_entity_within_itself'):
+            self.dedup_entity_within_itself()
         print('deduped, size =', self.symbols_size(), '# entities =', self.entities_size())
-        
-        self.clean_empties()
+
+        with profile.step('clean_empties'):
+            self.clean_empties()
         print('removed empties, size =', self.symbols_size(), '# entities =', self.entities_size())
     
+def create_db(engine, db_filename, report, bulk=False, report_format='text'):
+    '''
+    engine is one of IDENTIFIER_ENGINES, 'sqlite' for IdentifierDB or
+    'columnar' for the in-memory pandas version, which gives the
+    same results. report_format is one of REPORT_FORMATS
+    '''
+
+    if engine == 'sqlite':
+        return IdentifierDB(db_filename, report, bulk, report_format=report_format)
+    elif engine == 'columnar':
+        from .columnar_merger import ColumnarIdentifierDB
+        return ColumnarIdentifierDB(report, report_format)
+    else:
+        raise Exception("unexpected identifier engine: '%s'" % engine)
+
+def create_profile(db, profile_filename, explain, **info):
+    '''
+    a StepProfile if we're saving one, else a stand-in
+    '''
+    if profile_filename:
+        return profiling.StepProfile(db, profile_filename, explain, **info)
+    return profiling.NoProfile()
+
 def raw_to_processed(raw_filename, reverse_filename, processed_filename, report_filename, 
-                     org_prefix, temp_dir, biotypes, filters, merge_names):
+                     org_prefix, temp_dir, biotypes, filters, merge_names, engine='sqlite', bulk=False,
+                     profile_filename=None, explain=False, report_format='text'):
+    '''
+    if profile_filename is given, the time, row counts and memory use of each
+    step are saved there as json, see profiling.StepProfile. explain adds the
+    query plan of each statement, for the sqlite engine.
+
+    report_format is one of REPORT_FORMATS, for the report written to
+    report_filename
+    '''
 
     if temp_dir:
         if not os.path.isdir(temp_dir):
@@ -731,30 +986,162 @@ def raw_to_processed(raw_filename, reverse_filename, processed_filename, report_
 
     report = codecs.open(report_filename, 'w', 'utf8')
     with report:
-        db = IdentifierDB(db_filename, report)
+        db = create_db(engine, db_filename, report, bulk, report_format)
         db.drop_indices()
-    
+        profile = create_profile(db, profile_filename, explain, engine=engine, organism=org_prefix,
+                                 inputs=[raw_filename, reverse_filename], output=processed_filename)
+
         raw_file = codecs.open(raw_filename, 'r', 'utf8')
-        with raw_file:
+        with raw_file, profile.step('load_raw'):
             db.load_raw(raw_file)
     
         if reverse_filename:
             reverse_file = codecs.open(reverse_filename, 'r', 'utf8')
-            with reverse_file:
+            with reverse_file, profile.step('load_reverse_mappings'):
                 db.load_reverse_mappings(reverse_file)
         
-        db.process(biotypes, filters, merge_names)
+        db.process(biotypes, filters, merge_names, profile)
     
-        db.validate()
+        with profile.step('validate'):
+            db.validate()
         
         processed_file = codecs.open(processed_filename, 'w', 'utf8')
-        with processed_file:
+        with processed_file, profile.step('export_processed'):
             db.export_processed(processed_file, org_prefix)
         
         db.close()
 
+    profile.save()
+
+def file_digest(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def matches_digest(filename, digest):
+    return os.path.exists(filename) and file_digest(filename) == digest
+
+def input_fingerprint(filenames, params):
+    '''
+    content hashes of the given input files, in order, along
+    with the params they were processed with
+    '''
+    fingerprint = {'inputs': [[filename, file_digest(filename)] for filename in filenames],
+                   'params': params}
+
+    # compare as it will be when loaded back from the state file
+    return json.loads(json.dumps(fingerprint))
+
+def load_state(state_filename):
+    try:
+        with open(state_filename) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def save_state(state_filename, fingerprint, processed_filename, report_filename, db_filename):
+    state = {'fingerprint': fingerprint,
+             'output': file_digest(processed_filename),
+             'report': file_digest(report_filename),
+             'db': db_filename}
+
+    with open(state_filename, 'w') as f:
+        json.dump(state, f, indent=1)
+
+def state_filename_for(state_dir, org_prefix):
+    return os.path.join(state_dir, "%s_ids.state.json" % org_prefix)
+
+def unchanged_since_state(state_dir, filenames, processed_filename, report_filename, org_prefix=None):
+    '''
+    True if the given input files, in order, have the same contents as
+    when the state in state_dir was saved, and the output and report
+    are as written then. for checking before running the processing at
+    all, e.g. by a snakefile deciding whether the rule needs to run
+    '''
+
+    state = load_state(state_filename_for(state_dir, org_prefix))
+    if state is None:
+        return False
+
+    inputs = state['fingerprint']['inputs']
+    if [filename for filename, digest in inputs] != list(filenames):
+        return False
+
+    return (all(matches_digest(filename, digest) for filename, digest in inputs) and
+            matches_digest(processed_filename, state['output']) and
+            matches_digest(report_filename, state['report']))
+
+def reuse_processed(state_filename, fingerprint, processed_filename, report_filename, org_prefix):
+    '''
+    compare with the state saved by a previous run. if the inputs are
+    the same and the output and report are untouched, leave them be. if
+    just the output has gone missing or been modified, re-export it from
+    the saved db.
+
+    returns True if nothing more needs to be done
+    '''
+
+    state = load_state(state_filename)
+    if state is None or state['fingerprint'] != fingerprint:
+        return False
+
+    if not matches_digest(report_filename, state['report']):
+        return False
+
+    if matches_digest(processed_filename, state['output']):
+        print('identifier inputs unchanged, keeping existing', processed_filename)
+        return True
+
+    if state['db'] and os.path.exists(state['db']):
+        print('identifier inputs unchanged, exporting', processed_filename, 'from', state['db'])
+        db = IdentifierDB(state['db'], create=False)
+        with contextlib.closing(db):
+            processed_file = codecs.open(processed_filename, 'w', 'utf8')
+            with processed_file:
+                db.export_processed(processed_file, org_prefix)
+
+        return matches_digest(processed_filename, state['output'])
+
+    return False
+
 def triplets_to_processed(triplet_filenames, reverse_filename, processed_filename, report_filename,
-                          org_prefix, temp_dir, biotypes, filters, merge_names):
+                          org_prefix, temp_dir, biotypes, filters, merge_names, engine='sqlite', bulk=False,
+                          state_dir=None, profile_filename=None, explain=False, report_format='text',
+                          fingerprint_filenames=(), save_db=False):
+    '''
+    if state_dir is given, a fingerprint of the input file contents
+    and processing params is saved there. fingerprint_filenames are
+    included in it along with the inputs, e.g. the config the params
+    came from. when re-run with the same fingerprint the existing output
+    and report are left untouched. unchanged_since_state() makes the
+    same check up front, so a snakefile can avoid running the rule, and
+    the rules depending on its output, at all.
+
+    with save_db a copy of the processed db is kept in state_dir too, for
+    the sqlite engine, and if the output has gone but the fingerprint is
+    the same it's re-exported from there rather than processed again.
+
+    profile_filename, explain and report_format are as for raw_to_processed().
+    the profile isn't rewritten when processing is skipped.
+    '''
+
+    if state_dir:
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+
+        state_filename = state_filename_for(state_dir, org_prefix)
+        input_filenames = (list(triplet_filenames) + ([reverse_filename] if reverse_filename else []) +
+                           list(fingerprint_filenames))
+        fingerprint = input_fingerprint(input_filenames, [org_prefix, biotypes, filters, merge_names, engine, report_format])
+
+        if reuse_processed(state_filename, fingerprint, processed_filename, report_filename, org_prefix):
+            return
+
+        # don't leave a stale state around if we fail part way
+        if os.path.exists(state_filename):
+            os.remove(state_filename)
 
     if temp_dir:
         if not os.path.isdir(temp_dir):
@@ -768,29 +1155,48 @@ def triplets_to_processed(triplet_filenames, reverse_filename, processed_filenam
 
     report = codecs.open(report_filename, 'w', 'utf8')
     with report:
-        db = IdentifierDB(db_filename, report)
+        db = create_db(engine, db_filename, report, bulk, report_format)
         db.drop_indices()
+        profile = create_profile(db, profile_filename, explain, engine=engine, organism=org_prefix,
+                                 inputs=list(triplet_filenames) + [reverse_filename], output=processed_filename)
 
         for triplet_filename in triplet_filenames:
             triplet_file = codecs.open(triplet_filename, 'r', 'utf8')
-            with triplet_file:
+            with triplet_file, profile.step('load_3col'):
                 db.load_3col(triplet_file)
 
         if reverse_filename:
             reverse_file = codecs.open(reverse_filename, 'r', 'utf8')
-            with reverse_file:
+            with reverse_file, profile.step('load_reverse_mappings'):
                 db.load_reverse_mappings(reverse_file)
 
-        db.process(biotypes, filters, merge_names)
+        db.process(biotypes, filters, merge_names, profile)
 
-        db.validate()
+        with profile.step('validate'):
+            db.validate()
 
         processed_file = codecs.open(processed_filename, 'w', 'utf8')
-        with processed_file:
+        with processed_file, profile.step('export_processed'):
             db.export_processed(processed_file, org_prefix)
 
+        saved_db_filename = None
+        if state_dir:
+            saved_db_filename = os.path.join(state_dir, "%s_ids.sqlite" % org_prefix)
+            if save_db and engine == 'sqlite':
+                db.save(saved_db_filename)
+            else:
+                # a db saved from earlier inputs is no use
+                if os.path.exists(saved_db_filename):
+                    os.remove(saved_db_filename)
+                saved_db_filename = None
+
         db.close()
 
+    profile.save()
+
+    if state_dir:
+        save_state(state_filename, fingerprint, processed_filename, report_filename, saved_db_filename)
+
 testdata = (
     ('GMID', 'Gene Name', 'Protein Coding',       'Synonyms',         'Definition'),
     (   '1',     'happy',           'True',    'silly;putty',         'happy gene'), 
@@ -930,7 +1336,7 @@ def data_to_file(testdata):
     '''
     testdata = ['\t'.join(line) for line in testdata]
     testdata = '\n'.join(testdata) + '\n'
-    return StringIO.StringIO(testdata)
+    return StringIO(testdata)
     
 class TestSomething(unittest.TestCase):
     
@@ -1007,7 +1413,7 @@ class TestSomething(unittest.TestCase):
             
             db.validate()
             
-            output_file = StringIO.StringIO()
+            output_file = StringIO()
             db.export_processed(output_file)
             expected_output = data_to_file(testdata_output).getvalue()
             output = output_file.getvalue()
@@ -1052,6 +1458,124 @@ class TestSomething(unittest.TestCase):
             self.assertEqual(34, db.symbols_size())
             self.assertEqual(expected_result, result)
             self.assertEqual(11, db.entities_size())
+
+    def test_merge_self_join(self):
+        # union-find and self-join merges agree on the test data
+        results = []
+        for method in ['merge', 'merge_self_join']:
+            db = IdentifierDB(":memory:", StringIO())
+
+            with contextlib.closing(db):
+                db.load_raw(data_to_file(testdata))
+                db.cleanup()
+                db.remove_unwanted_sources(RAW_DEFAULT_SOURCES_TO_REMOVE)
+                db.standardize_source_names()
+                db.biotype_filter(RAW_DEFAULT_BIOTYPE_KEEPERS)
+                db.delink()
+                getattr(db, method)()
+
+                output = StringIO()
+                db.export_processed(output)
+                results.append((output.getvalue(), db.report.getvalue(), db.entities_size()))
+
+        self.assertEqual(results[0], results[1])
+
+    def test_merge_chained(self):
+        # 2 shares a name with 1 and another with 3, so all
+        # three end up as entity 1
+        db = IdentifierDB(":memory:", StringIO())
+
+        with contextlib.closing(db):
+            db.load_3col(data_to_file([('1', 'abc', RAW_GENE_NAME),
+                                       ('2', 'ABC', RAW_GENE_NAME),
+                                       ('2', 'xyz', RAW_GENE_NAME),
+                                       ('3', 'xyz', RAW_GENE_NAME),
+                                       ('3', 'ENSG3', 'Ensembl Gene ID')]))
+            db.merge()
+
+            self.assertEqual("2 gene names belong to multiple genes and will be merged\nabc\nxyz\n",
+                             db.report.getvalue())
+            rows = db.get_symbol('ENSG3')
+            self.assertEqual(1, rows[0]['node_id'])
+
+    def test_bulk_load(self):
+        # bulk loading should make no difference to the results
+        results = []
+        for bulk in [False, True]:
+            db = IdentifierDB(":memory:", StringIO(), bulk)
+
+            with contextlib.closing(db):
+                db.load_raw(data_to_file(testdata_delink_input))
+                db.load_3col(data_to_file(testdata_output[1:]))
+                db.load_reverse_mappings(data_to_file(testdata_delink_reverse))
+                db.process(RAW_DEFAULT_BIOTYPE_KEEPERS, RAW_DEFAULT_SOURCES_TO_REMOVE, True)
+
+                output = StringIO()
+                db.export_processed(output)
+                results.append((output.getvalue(), db.report.getvalue()))
+
+        self.assertEqual(results[0], results[1])
+
+    def test_incremental(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            state_dir = os.path.join(tempdir, 'state')
+            triplets = os.path.join(tempdir, 'symbols.triplets')
+            output = os.path.join(tempdir, 'symbols.txt')
+            log = os.path.join(tempdir, 'symbols.log')
+            cfg = os.path.join(tempdir, 'organism.cfg')
+
+            def run(merge_names=True, save_db=True):
+                with contextlib.redirect_stdout(StringIO()):
+                    triplets_to_processed([triplets], None, output, log, None, None, ['True'], [],
+                                          merge_names, state_dir=state_dir, fingerprint_filenames=[cfg],
+                                          save_db=save_db)
+
+            def unchanged():
+                return unchanged_since_state(state_dir, [triplets, cfg], output, log)
+
+            with open(triplets, 'w') as f:
+                f.write(data_to_file(testdata_delink_output).getvalue())
+            with open(cfg, 'w') as f:
+                f.write('gm_organism_id = 1\n')
+
+            self.assertFalse(unchanged())
+            run()
+            expected = open(output).read()
+            os.utime(output, (0, 0))
+
+            # nothing changed, output untouched
+            os.utime(triplets)
+            self.assertTrue(unchanged())
+            run()
+            self.assertEqual(0, os.path.getmtime(output))
+
+            # missing output is exported from the saved db
+            os.remove(output)
+            self.assertFalse(unchanged())
+            run()
+            self.assertEqual(expected, open(output).read())
+            self.assertTrue(unchanged())
+
+            # a changed config is reprocessed, and the db only kept if asked
+            with open(cfg, 'a') as f:
+                f.write('identifier_merging_enabled = false\n')
+            self.assertFalse(unchanged())
+            run(save_db=False)
+            self.assertTrue(unchanged())
+            self.assertEqual([], [f for f in os.listdir(state_dir) if f.endswith('.sqlite')])
+
+            # changed params or inputs are reprocessed
+            os.utime(output, (0, 0))
+            run(merge_names=False)
+            self.assertNotEqual(0, os.path.getmtime(output))
+
+            with open(triplets, 'a') as f:
+                f.write('13\tgene13\tGene Name\n')
+            run()
+            self.assertIn('gene13', open(output).read())
+        finally:
+            shutil.rmtree(tempdir)
             
 def symbols_as_string(db):
     rows = db.get_symbol()
@@ -2,9 +2,59 @@
 parsers for identifier files
 '''
 
-import unittest
+import unittest, itertools
+from io import StringIO
+import numpy as np
 from .constants import *
 
+def chunked(lines, size):
+    '''
+    group an iterable of lines into lists of at most size lines
+    '''
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+def split_xrefs(xrefs, wanted_source):
+    '''
+    pull out the identifiers for the given source from an
+    entrez xref field like:
+
+        HGNC:5|MIM:138670|Ensembl:ENSG00000121410|HPRD:00726
+    '''
+
+    idents = []
+
+    parts = xrefs.split('|')
+    for part in parts:
+        try:
+            source, ident = part.split(':')
+        except:
+            source, ident = None, None
+
+        if source == wanted_source:
+            idents.append(ident)
+
+    return idents
+
+def split_values(values, delimiter):
+    '''
+    split each of an array of strings on the delimiter. returns
+    (rows, parts) arrays, with the position in values each of the
+    parts came from
+    '''
+    joined = delimiter.join(values)
+    if delimiter not in joined:
+        return np.arange(len(values)), values
+
+    # an extra value per delimiter in each string
+    counts = np.array([value.count(delimiter) for value in values]) + 1
+    parts = np.array(joined.split(delimiter), dtype=object)
+    return np.repeat(np.arange(len(values)), counts), parts
+
 class BaseParser(object):
     def __init__(self, theFile, header=None):
         self.file = theFile
@@ -67,7 +117,78 @@ class RawIdFileParser(BaseParser):
             row = row.rstrip('\r\n')
             d = self.dictify(row)
             yield RawGeneEntity(d)
-        
+
+
+class RawIdFrameParser(BaseParser):
+    '''
+    reads the same files as RawIdFileParser, but a batch of rows at a time,
+    splitting the ';' delimited columns a whole column at a time rather
+    than building a dict and entity object per row.
+
+    rows short of fields are dropped, and fields past the header ignored,
+    so each row is parsed the same way whatever batch it's in.
+    '''
+    def __init__(self, theFile):
+        super(RawIdFrameParser, self).__init__(theFile)
+
+    def batches(self, size):
+        '''
+        yields (entities, symbols) for each size rows, where entities is
+        a tuple of (gmid, biotype, desc) arrays and symbols a tuple of
+        (gmid, symbol, source) arrays. symbols come out in the same order
+        as from RawIdFileParser, row by row.
+        '''
+
+        # same column precedence as dictify() for repeated header names
+        columns = dict((name, i) for i, name in enumerate(self.header))
+        symbol_cols = [(name, i) for name, i in columns.items()
+                       if name not in (RAW_GMID, RAW_DEFINITION, RAW_BIOTYPE)]
+
+        n = len(self.header)
+        for lines in chunked(self.file, size):
+            lines = [line.rstrip('\r\n') for line in lines]
+            tabs = np.array([line.count('\t') for line in lines])
+
+            # drop short rows, and cut long ones down to the header, so
+            # the batch can be split all at once into n fields a row
+            if (tabs != n - 1).any():
+                lines = [line if count == n - 1 else '\t'.join(line.split('\t')[:n])
+                         for line, count in zip(lines, tabs) if count >= n - 1]
+            if not lines:
+                continue
+
+            parts = '\t'.join(lines).split('\t')
+            fields = [np.array([value.strip() for value in parts[i::n]], dtype=object) for i in range(n)]
+            num_rows = len(lines)
+            gmids = fields[columns[RAW_GMID]]
+
+            entities = (gmids, fields[columns[RAW_BIOTYPE]], fields[columns[RAW_DEFINITION]])
+
+            # a column at a time, then a stable sort on the row
+            # to put each row's symbols back together
+            rows, values, sources = [], [], []
+            for source, i in symbol_cols:
+                if source in RAW_NON_DELIMITED_FIELDS:
+                    column_rows, column_values = np.arange(num_rows), fields[i]
+                else:
+                    column_rows, column_values = split_values(fields[i], ';')
+                rows.append(column_rows)
+                values.append(column_values)
+                sources.append(np.repeat(np.array([source], dtype=object), len(column_values)))
+
+            if rows:
+                rows = np.concatenate(rows)
+                order = np.argsort(rows, kind='stable')
+                rows = rows[order]
+                values = np.concatenate(values)[order]
+                sources = np.concatenate(sources)[order]
+            else:
+                rows = np.arange(0)
+                values = sources = np.array([], dtype=object)
+
+            yield entities, (gmids[rows], values, sources)
+
+
 class EntrezToEnsemblGeneEntity:
     
     def __init__(self, d):
@@ -92,21 +213,7 @@ class EntrezToEnsemblGeneEntity:
         return value is a list of the ensembl ids found.
         '''
 
-        xrefs = self.d[REV_XREFS]
-
-        idents = []
-        
-        parts = xrefs.split('|')
-        for part in parts:
-            try:
-                source, ident = part.split(':')
-            except:
-                source, ident = None, None
-                
-            if source == wanted_source:
-                idents.append(ident)
-    
-        return idents       
+        return split_xrefs(self.d[REV_XREFS], wanted_source)
         
     def biotype(self):
         return self.d[REV_BIOTYPE]
@@ -142,6 +249,18 @@ class Col3Parser(BaseParser):
             row = row.strip('\r\n')
             yield Col3GeneEntity(row)
 
+    def chunks(self, size):
+        '''
+        lists of (gmid, symbol, source) tuples, size rows at a time
+        '''
+
+        for lines in chunked(self.file, size):
+            rows = [tuple(line.strip('\r\n').split('\t')) for line in lines]
+            for row in rows:
+                if len(row) != 3:
+                    raise Exception('invalid row len: %s' % (row,))
+            yield rows
+
 
 class EntrezToEnsemblParser(BaseParser):
     
@@ -154,8 +273,30 @@ class EntrezToEnsemblParser(BaseParser):
             row = row.rstrip('\r\n')
             row = row.replace('\r', ' ')
             d = self.dictify(row)
-            yield EntrezToEnsemblGeneEntity(d)        
-    
+            yield EntrezToEnsemblGeneEntity(d)
+
+    def chunks(self, size, wanted_source=REV_ENSEMBL):
+        '''
+        lists of (entrez, name, xref, biotype) tuples for the xrefs of the
+        given source, parsed size lines at a time
+        '''
+
+        columns = dict((name, i) for i, name in enumerate(self.header))
+        entrez_col = columns[REV_ENTREZ_ID]
+        name_col = columns[REV_GENE_NAME]
+        xrefs_col = columns[REV_XREFS]
+        biotype_col = columns[REV_BIOTYPE]
+
+        for lines in chunked(self.file, size):
+            records = []
+            for line in lines:
+                fields = line.rstrip('\r\n').replace('\r', ' ').split('\t')
+                fields = [field.strip() for field in fields]
+                for xref in split_xrefs(fields[xrefs_col], wanted_source):
+                    records.append((fields[entrez_col], fields[name_col], xref, fields[biotype_col]))
+            yield records
+
+
 class TestEntrezToEnsemblParser(unittest.TestCase):
     
     def setUp(self):
@@ -171,4 +312,66 @@ class TestEntrezToEnsemblParser(unittest.TestCase):
             print(entity.entrez())
             print(entity.name())
             print(entity.xrefs('Ensembl'))
-            print(entity.biotype())
\ No newline at end of file
+            print(entity.biotype())
+
+
+class TestRawIdFrameParser(unittest.TestCase):
+
+    def test_batches(self):
+        data = ('GMID\tGene Name\tProtein Coding\tSynonyms\tDefinition\n'
+                '1\thappy\tTrue\tsilly;putty\thappy gene\n'
+                '2\tsad; glum \tprotein_coding\t serious \tsad gene\n'
+                '3\thappy\tTrue\tnaughty\tanother happy gene\n')
+
+        expected = []
+        for entity in RawIdFileParser(StringIO(data)).reader():
+            for symbol, source in entity.symbols():
+                expected.append((entity.gmid(), symbol, source))
+
+        entities, symbols = [], []
+        for batch_entities, batch_symbols in RawIdFrameParser(StringIO(data)).batches(2):
+            entities.extend(zip(*batch_entities))
+            symbols.extend(zip(*batch_symbols))
+
+        self.assertEqual(expected, symbols)
+        self.assertEqual([('1', 'True', 'happy gene'), ('2', 'protein_coding', 'sad gene'),
+                          ('3', 'True', 'another happy gene')], entities)
+
+    def test_short_rows(self):
+        data = ('GMID\tGene Name\tProtein Coding\tSynonyms\tDefinition\n'
+                '1\thappy\tTrue\tsilly;putty\thappy gene\n'
+                '2\tsad\tTrue\n'
+                '3\tglum\n'
+                '4\tgrumpy\tTrue\t\tgrumpy gene\textra\n')
+
+        # the same whatever the batches, even those of only short rows
+        for size in [1, 2, 3, 10]:
+            symbols = []
+            for batch_entities, batch_symbols in RawIdFrameParser(StringIO(data)).batches(size):
+                symbols.extend(zip(*batch_symbols))
+
+            self.assertEqual([('1', 'happy', 'Gene Name'), ('1', 'silly', 'Synonyms'), ('1', 'putty', 'Synonyms'),
+                              ('4', 'grumpy', 'Gene Name'), ('4', '', 'Synonyms')], symbols, 'batch size %d' % size)
+
+
+class TestEntrezToEnsemblChunks(unittest.TestCase):
+
+    def test_chunks(self):
+        data = ('GeneID\tSymbol\tSynonyms\tdbXrefs\tdescription\ttype_of_gene\n'
+                '1\tA1BG\tA1B\tMIM:138670|HGNC:HGNC:5|Ensembl:ENSG01\talpha\r1\tprotein-coding\n'
+                '2\tA2M\t-\tEnsembl:ENSG02|Ensembl:ENSG03|Vega:OTTHUMG1\t \tprotein-coding\n'
+                '3\tNONE\t-\t-\tnothing\tpseudo\n'
+                '4\tA2MP1\t-\tHGNC:HGNC:8|Ensembl:ENSG04:x|Ensembl:ENSG05|Ensembl:|Ensemb\tpseudo\tpseudo\r\n'
+                '5\tßgene\t-\tEnsembl:ENSGß|xEnsembl:ENSG06| Ensembl:ENSG07\tunicode\tother\n')
+
+        expected = []
+        for entity in EntrezToEnsemblParser(StringIO(data)).reader():
+            for ensembl in entity.xrefs(REV_ENSEMBL):
+                expected.append((entity.entrez(), entity.name(), ensembl, entity.biotype()))
+
+        records = []
+        for chunk in EntrezToEnsemblParser(StringIO(data)).chunks(2):
+            records.extend(chunk)
+
+        self.assertEqual(expected, records)
+        self.assertEqual(['ENSG01', 'ENSG02', 'ENSG03', 'ENSG05', '', 'ENSGß'], [record[2] for record in records])
@@ -0,0 +1,206 @@
+'''
+per-step profiling of identifier processing: wall time, symbol and entity
+counts before and after, rows changed, and memory use. for the sqlite
+engine the query plan of each statement run can also be captured.
+
+rows_changed is sqlite's count of rows inserted, updated and deleted by
+the step, so it's only known for the sqlite engine, and is null for the
+columnar engine.
+
+the os only gives the peak memory use of the whole process, not of a
+step. so each step records process_peak_rss_mb, the peak of the process
+so far, and peak_rss_increase_mb, how much the step raised it. a step
+using less memory than an earlier one shows an increase of 0.
+'''
+
+import time, json, sys, os, sqlite3
+import contextlib, unittest, tempfile, shutil
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# statements that have a query plan worth looking at
+EXPLAINABLE = ('select', 'insert', 'update', 'delete', 'with')
+
+# executemany() traces each row as a separate statement, so
+# cap the number of plans kept for a step
+MAX_QUERY_PLANS = 50
+
+
+def peak_rss_mb():
+    '''
+    peak resident set size of this process so far, None
+    where the resource module isn't available
+    '''
+    if resource is None:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on mac, kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return maxrss / (1024.0 * 1024.0)
+    return maxrss / 1024.0
+
+
+class StepProfile(object):
+    '''
+    wrap each step of processing a db (IdentifierDB or
+    ColumnarIdentifierDB) in step(name). the results so far are
+    saved to filename as json after each step, so there is something
+    to look at if processing fails or gets killed part way through
+    '''
+
+    def __init__(self, db, filename, explain=False, **info):
+        self.db = db
+        self.filename = filename
+        self.conn = getattr(db, 'conn', None)
+        self.explain = explain and self.conn is not None
+        self.info = info
+        self.steps = []
+        self.start = time.time()
+
+    @contextlib.contextmanager
+    def step(self, name):
+        record = {'step': name,
+                  'symbols_before': self.db.symbols_size(),
+                  'entities_before': self.db.entities_size()}
+
+        statements = []
+        if self.explain:
+            self.conn.set_trace_callback(statements.append)
+        changes = self.conn.total_changes if self.conn is not None else None
+        peak_before = peak_rss_mb()
+
+        start = time.time()
+        try:
+            yield
+        except Exception as e:
+            record['error'] = repr(e)
+            self.steps.append(record)
+            self.save()
+            raise
+        finally:
+            record['seconds'] = round(time.time() - start, 3)
+            if self.explain:
+                self.conn.set_trace_callback(None)
+
+        record['rows_changed'] = self.conn.total_changes - changes if changes is not None else None
+        record['symbols_after'] = self.db.symbols_size()
+        record['entities_after'] = self.db.entities_size()
+
+        peak = peak_rss_mb()
+        record['process_peak_rss_mb'] = peak
+        record['peak_rss_increase_mb'] = peak - peak_before if peak is not None else None
+
+        if self.explain:
+            record['query_plans'] = self.query_plans(statements)
+
+        self.steps.append(record)
+        self.save()
+
+    def query_plans(self, statements):
+        '''
+        plans of the distinct statements with anything to show. run after
+        the step, so tables a statement used may have gone
+        '''
+
+        plans = []
+        seen = set()
+        for sql in statements:
+            if sql in seen or not sql.lstrip().lower().startswith(EXPLAINABLE):
+                continue
+            seen.add(sql)
+
+            try:
+                rows = self.conn.execute('explain query plan ' + sql).fetchall()
+                plan = {'sql': sql, 'plan': [row[-1] for row in rows]}
+            except sqlite3.Error as e:
+                plan = {'sql': sql, 'error': str(e)}
+
+            if plan.get('plan') != []:
+                plans.append(plan)
+            if len(plans) == MAX_QUERY_PLANS:
+                break
+
+        return plans
+
+    def results(self):
+        results = dict(self.info)
+        results['seconds'] = round(time.time() - self.start, 3)
+        results['process_peak_rss_mb'] = peak_rss_mb()
+        results['steps'] = self.steps
+        return results
+
+    def save(self):
+        with open(self.filename, 'w') as f:
+            json.dump(self.results(), f, indent=1)
+
+
+class NoProfile(object):
+    '''
+    stands in for StepProfile when we aren't profiling
+    '''
+
+    @contextlib.contextmanager
+    def step(self, name):
+        yield
+
+    def save(self):
+        pass
+
+
+class TestStepProfile(unittest.TestCase):
+
+    def test_step(self):
+        from .identifier_merger import IdentifierDB
+        from io import StringIO
+
+        tempdir = tempfile.mkdtemp()
+        db = IdentifierDB(':memory:', StringIO())
+        with contextlib.closing(db):
+            db.addSymbols([('1', 'abc', 'Gene Name'), ('2', 'N/A', 'Gene Name')])
+
+            filename = os.path.join(tempdir, 'symbols.profile.json')
+            profile = StepProfile(db, filename, explain=True, organism='test')
+            with profile.step('cleanup'):
+                db.cleanup()
+
+            with open(filename) as f:
+                results = json.load(f)
+            shutil.rmtree(tempdir)
+
+            self.assertEqual('test', results['organism'])
+
+            step = results['steps'][0]
+            self.assertEqual('cleanup', step['step'])
+            self.assertEqual(2, step['symbols_before'])
+            self.assertEqual(1, step['symbols_after'])
+            self.assertEqual(1, step['rows_changed'])
+            self.assertTrue(step['peak_rss_increase_mb'] is None or step['peak_rss_increase_mb'] >= 0)
+            self.assertTrue(step['query_plans'])
+            self.assertTrue(all('plan' in plan for plan in step['query_plans']))
+
+    def test_columnar(self):
+        from .columnar_merger import ColumnarIdentifierDB
+
+        tempdir = tempfile.mkdtemp()
+        db = ColumnarIdentifierDB()
+        db.addSymbols([('1', 'abc', 'Gene Name'), ('2', 'N/A', 'Gene Name')])
+
+        filename = os.path.join(tempdir, 'symbols.profile.json')
+        profile = StepProfile(db, filename, organism='test')
+        with profile.step('cleanup'):
+            db.cleanup()
+
+        with open(filename) as f:
+            results = json.load(f)
+        shutil.rmtree(tempdir)
+
+        # same keys as for sqlite, without a count of rows changed
+        step = results['steps'][0]
+        self.assertEqual(1, step['symbols_after'])
+        self.assertIsNone(step['rows_changed'])
+        self.assertIn('peak_rss_increase_mb', step)
@@ -0,0 +1,113 @@
+'''
+writing the report of what identifier cleaning did, one section per class
+of change: the biotype filter, entrez ids delinked with the reverse
+mappings, merged gene names, and the three kinds of duplicate removed.
+
+each section has a name, a summary count and a list of records, written
+in one of the REPORT_FORMATS:
+
+ * text: the original log, a line of explanation for each section followed
+   by the records one per line. the delinked and within_entity sections
+   were never reported and are left out, so the log reads as it always has
+ * tsv: a '#section<tab>count<tab>message' line for each section, then a
+   'section<tab>field...' line per record
+ * jsonl: a {"section", "count", "message"} object for each section, then
+   an object per record keyed by the section's column names
+
+records are written a batch at a time, see fetch_batches() for streaming
+them from a sqlite cursor.
+'''
+
+import json, unittest, sqlite3
+from io import StringIO
+from .constants import *
+
+# rows per fetchmany() when streaming records from a query
+REPORT_FETCH_SIZE = 10000
+
+# sections only written in the structured formats
+STRUCTURED_SECTIONS = ['delinked', 'within_entity']
+
+# ensure_ascii=False would otherwise mean a new encoder per json.dumps()
+ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+
+def fetch_batches(cursor, size=REPORT_FETCH_SIZE):
+    '''
+    lists of rows from the cursor, size at a time
+    '''
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+
+def batched(records, size=REPORT_FETCH_SIZE):
+    '''
+    lists of at most size records from a sequence of tuples
+    '''
+    for i in range(0, len(records), size):
+        yield records[i:i + size]
+
+
+def write_section(report, report_format, name, count, message, batches=(), columns=('symbol',)):
+    '''
+    write a section to the report file in the given format. batches is
+    an iterable of lists of record tuples, with a value for each of
+    columns. the batches are only consumed if the section gets written.
+    '''
+
+    if report_format == 'text':
+        if name in STRUCTURED_SECTIONS:
+            return
+        report.write(message + '\n')
+        for batch in batches:
+            report.write('\n'.join(['\t'.join(map(str, record)) for record in batch]) + '\n')
+
+    elif report_format == 'tsv':
+        report.write('#%s\t%d\t%s\n' % (name, count, message))
+        prefix = name + '\t'
+        for batch in batches:
+            report.write('\n'.join([prefix + '\t'.join(map(str, record)) for record in batch]) + '\n')
+
+    elif report_format == 'jsonl':
+        report.write(ENCODER.encode({'section': name, 'count': count, 'message': message}) + '\n')
+
+        # the keys are the same for every record, so only the values need encoding
+        template = '{"section": %s, %s}\n' % (ENCODER.encode(name).replace('%', '%%'),
+                                             ', '.join('%s: %%s' % ENCODER.encode(column).replace('%', '%%')
+                                                       for column in columns))
+        for batch in batches:
+            report.write(''.join([template % tuple(map(ENCODER.encode, record)) for record in batch]))
+
+    else:
+        raise Exception("unexpected report format: '%s'" % report_format)
+
+
+class TestReporting(unittest.TestCase):
+
+    def test_formats(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute("create table dups (node_id integer, symbol text)")
+        conn.executemany("insert into dups values (?, ?)", [(1, 'abc'), (2, 'ßeta')])
+
+        expected = {
+            'text': 'removing 2 symbols\n1\tabc\n2\tßeta\n',
+            'tsv': '#entity_vs_entity\t2\tremoving 2 symbols\nentity_vs_entity\t1\tabc\nentity_vs_entity\t2\tßeta\n',
+            'jsonl': ('{"section": "entity_vs_entity", "count": 2, "message": "removing 2 symbols"}\n'
+                      '{"section": "entity_vs_entity", "node_id": 1, "symbol": "abc"}\n'
+                      '{"section": "entity_vs_entity", "node_id": 2, "symbol": "ßeta"}\n'),
+        }
+
+        for report_format in REPORT_FORMATS:
+            report = StringIO()
+            cursor = conn.execute("select node_id, symbol from dups order by rowid")
+            write_section(report, report_format, 'entity_vs_entity', 2, 'removing 2 symbols',
+                          fetch_batches(cursor, 1), ('node_id', 'symbol'))
+            self.assertEqual(expected[report_format], report.getvalue())
+
+        report = StringIO()
+        write_section(report, 'text', 'delinked', 1, 'removing 1 entrez ids', [[(1, '10')]])
+        self.assertEqual('', report.getvalue())
+        conn.close()
@@ -0,0 +1,271 @@
+'''
+case insensitive lookup of gene symbols in the cleaned identifiers
+file (GMID, symbol, source triplets, as written by clean_identifiers.py).
+
+compile_index() writes the symbols to a single binary file of flat arrays:
+
+ * node ids, source codes, and the symbols themselves, in file order
+ * two 64 bit hashes of each upper cased symbol, sorted on the first hash
+   (then file order), alongside the row each came from
+
+SymbolIndex memory maps the arrays, so the scripts that look up symbols
+share them through the page cache rather than each re-parsing and upper
+casing the identifiers file. lookups are a binary search on the hashes,
+with the second hash to rule out collisions.
+
+the file is a magic string, a json header giving the dtype, shape and offset
+of each array, then the arrays themselves, 8 byte aligned.
+'''
+
+import json, os, shutil, tempfile, unittest
+import numpy as np
+import pandas as pd
+
+MAGIC = b'GMSYMIDX'
+VERSION = 1
+
+# keys for pandas' siphash, must be 16 bytes. two hashes
+# of each symbol are kept to make collisions negligible
+HASH_KEYS = ('0123456789123456', 'GeneMANIA symbol')
+
+# column of the symbol in the identifiers file, 0 based
+SYMBOL_COL = 1
+
+ALIGNMENT = 8
+
+
+def aligned(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def fold(values):
+    '''
+    symbols are compared after upper casing, as the pipeline scripts have
+    always done. values that aren't strings are converted first
+    '''
+    return np.array([str(value).upper() for value in values], dtype=object)
+
+
+def hash_symbols(values):
+    folded = fold(values)
+    return [pd.util.hash_array(folded, hash_key=key, categorize=False) for key in HASH_KEYS]
+
+
+def load_symbols_file(symbols_filename):
+    return pd.read_csv(symbols_filename, sep='\t', header=None, na_filter=False,
+                       dtype=str, names=['GMID', 'SYMBOL', 'SOURCE'])
+
+
+def build_arrays(identifiers):
+    '''
+    identifiers is a frame of GMID, SYMBOL, SOURCE strings. returns
+    (arrays, sources), the arrays making up the index by name and the
+    list of source names the source codes refer to
+    '''
+
+    try:
+        node_ids = identifiers['GMID'].astype(np.int64).to_numpy()
+    except ValueError:
+        raise Exception('identifiers must have integer ids to be indexed')
+
+    source_codes, sources = pd.factorize(identifiers['SOURCE'])
+    symbols = identifiers['SYMBOL'].tolist()
+
+    # symbols are stored newline separated, so they can all be
+    # decoded at once, with offsets to get at individual ones
+    encoded = [symbol.encode('utf8') for symbol in symbols]
+    lengths = np.array([len(symbol) + 1 for symbol in encoded], dtype=np.int64)
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    data = np.frombuffer(b''.join(symbol + b'\n' for symbol in encoded), dtype=np.uint8)
+
+    hash1, hash2 = hash_symbols(symbols)
+    rows = np.arange(len(symbols), dtype=np.int64)
+    order = np.lexsort((rows, hash1))
+
+    arrays = {'node_id': node_ids,
+              'source': source_codes.astype(np.uint16),
+              'symbol_offsets': offsets,
+              'symbol_data': data,
+              'hash1': hash1[order],
+              'hash2': hash2[order],
+              'hash_row': rows[order]}
+
+    return arrays, list(sources)
+
+
+def compile_index(symbols_filename, index_filename):
+    '''
+    write the index for the given identifiers file
+    '''
+
+    arrays, sources = build_arrays(load_symbols_file(symbols_filename))
+
+    # array offsets are relative to the end of the header
+    layout = {}
+    position = 0
+    for name in sorted(arrays):
+        array = arrays[name]
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': position}
+        position += aligned(array.nbytes)
+
+    header = {'version': VERSION, 'sources': sources, 'arrays': layout}
+    header_bytes = json.dumps(header).encode('utf8')
+    start = aligned(len(MAGIC) + 8 + len(header_bytes))
+
+    with open(index_filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.array([len(header_bytes)], dtype='<u8').tobytes())
+        f.write(header_bytes)
+        for name in sorted(arrays):
+            f.seek(start + layout[name]['offset'])
+            f.write(np.ascontiguousarray(arrays[name]).tobytes())
+
+        # pad out the last array
+        f.seek(0, os.SEEK_END)
+        f.write(b'\0' * (start + position - f.tell()))
+
+
+def is_index(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class SymbolIndex(object):
+    '''
+    opens a compiled index, or for convenience a plain identifiers file,
+    which is parsed and indexed in memory. both behave the same.
+    '''
+
+    def __init__(self, filename):
+        if is_index(filename):
+            self.load(filename)
+        else:
+            arrays, self.sources = build_arrays(load_symbols_file(filename))
+            for name, array in arrays.items():
+                setattr(self, name, array)
+
+        self.source_names = np.array(self.sources, dtype=object)
+
+    def load(self, filename):
+        with open(filename, 'rb') as f:
+            f.read(len(MAGIC))
+            header_len = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            header = json.loads(f.read(header_len).decode('utf8'))
+        start = aligned(len(MAGIC) + 8 + header_len)
+
+        if header['version'] != VERSION:
+            raise Exception('unsupported symbol index version %s in %s' % (header['version'], filename))
+
+        self.sources = header['sources']
+        for name, spec in header['arrays'].items():
+            shape = tuple(spec['shape'])
+            if shape[0] == 0:
+                array = np.zeros(shape, dtype=spec['dtype'])
+            else:
+                array = np.memmap(filename, dtype=spec['dtype'], mode='r', offset=start + spec['offset'], shape=shape)
+            setattr(self, name, array)
+
+    def __len__(self):
+        return len(self.node_id)
+
+    def lookup(self, values):
+        '''
+        case insensitive lookup of each of the given values. returns
+        (positions, rows) arrays, for each match the position in values
+        and the row in the identifiers file, ordered by position then row
+        like an inner join
+        '''
+
+        values = list(values)
+        if len(values) == 0 or len(self) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        query1, query2 = hash_symbols(values)
+        lo = np.searchsorted(self.hash1, query1, side='left')
+        hi = np.searchsorted(self.hash1, query1, side='right')
+
+        # expand each [lo, hi) range of matching hashes
+        counts = hi - lo
+        positions = np.repeat(np.arange(len(values), dtype=np.int64), counts)
+        starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+        matches = starts + np.arange(len(positions), dtype=np.int64)
+
+        found = self.hash2[matches] == query2[positions]
+        return positions[found], np.asarray(self.hash_row[matches[found]], dtype=np.int64)
+
+    def contains(self, values):
+        '''
+        boolean array, true for each value that matches a symbol
+        '''
+        values = list(values)
+        result = np.zeros(len(values), dtype=bool)
+        positions, rows = self.lookup(values)
+        result[positions] = True
+        return result
+
+    def node_ids(self, rows=None):
+        if rows is None:
+            return np.asarray(self.node_id)
+        return np.asarray(self.node_id[rows])
+
+    def symbols(self, rows=None):
+        if rows is None:
+            data = bytes(self.symbol_data)
+            if not data:
+                return np.zeros(0, dtype=object)
+            return np.array(data.decode('utf8').split('\n')[:-1], dtype=object)
+
+        offsets = self.symbol_offsets
+        return np.array([bytes(self.symbol_data[offsets[row]:offsets[row + 1] - 1]).decode('utf8')
+                         for row in rows], dtype=object)
+
+    def source_of(self, rows=None):
+        if rows is None:
+            return self.source_names[np.asarray(self.source)]
+        return self.source_names[np.asarray(self.source[rows])]
+
+    def to_frame(self):
+        '''
+        the identifiers as a frame of GMID, SYMBOL, SOURCE strings,
+        in file order, as read from the original file
+        '''
+        return pd.DataFrame({'GMID': self.node_ids().astype(str).astype(object),
+                             'SYMBOL': self.symbols(),
+                             'SOURCE': self.source_of()})
+
+
+class TestSymbolIndex(unittest.TestCase):
+
+    symbols = ('1\tABC1\tGene Name\n'
+               '1\tabc-one\tSynonym\n'
+               '2\tXyz\tGene Name\n'
+               '2\tß-gene\tSynonym\n'
+               '3\tabc1\tEnsembl Gene ID\n')
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.symbols_filename = os.path.join(self.tempdir, 'symbols.txt')
+        self.index_filename = os.path.join(self.tempdir, 'symbols.idx')
+        with open(self.symbols_filename, 'w', encoding='utf8') as f:
+            f.write(self.symbols)
+        compile_index(self.symbols_filename, self.index_filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_lookup(self):
+        for filename in [self.index_filename, self.symbols_filename]:
+            index = SymbolIndex(filename)
+
+            positions, rows = index.lookup(['xyz', 'missing', 'Abc1', 'SS-GENE'])
+            self.assertEqual([0, 2, 2, 3], positions.tolist())
+            self.assertEqual([2, 0, 4, 3], rows.tolist())
+            self.assertEqual([2, 1, 3, 2], index.node_ids(rows).tolist())
+            self.assertEqual(['Xyz', 'ABC1', 'abc1', 'ß-gene'], index.symbols(rows).tolist())
+            self.assertEqual([True, False, True], index.contains(['ABC-ONE', 'abc', 'xyz']).tolist())
+
+    def test_to_frame(self):
+        index = SymbolIndex(self.index_filename)
+        expected = load_symbols_file(self.symbols_filename)
+        pd.testing.assert_frame_equal(expected, index.to_frame(), check_dtype=False)
@@ -0,0 +1,282 @@
+'''
+a packed alternative to the INTERACTIONS folder of generic_db, which
+has a text file of node/node/weight lines per network, named
+{organism id}.{network id}.txt. the archive holds all the networks in a
+single file:
+
+ * a magic string, then the byte offset of the index as 8 bytes
+ * for each network a block of the first node ids (int32), the second
+   node ids (int32), then the weights (float32 by default, or float64),
+   each 8 byte aligned
+ * the index, json giving the version, the weight dtype, and the
+   organism id, network id, offset and interaction count of each network
+
+InteractionsArchive memory maps the file, so getting at a network
+is a seek to its block rather than parsing a text file. float32
+weights are rounded from the text, use float64 to keep them exactly.
+
+  python builder/interactions_archive.py pack result/generic_db/INTERACTIONS interactions.gmarc
+  python builder/interactions_archive.py unpack interactions.gmarc INTERACTIONS
+'''
+
+import argparse, os, glob, json
+import unittest, tempfile, shutil
+import numpy as np
+import pandas as pd
+from normalize_network import format_weight
+
+MAGIC = b'GMNETARC'
+VERSION = 1
+
+ALIGNMENT = 8
+
+WEIGHT_DTYPES = ['float32', 'float64']
+
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def aligned(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def interaction_files(directory):
+    '''
+    (organism id, network id, filename) of each network
+    in an INTERACTIONS folder, ordered by the ids
+    '''
+
+    networks = []
+    for filename in glob.glob(os.path.join(directory, '*.*.txt')):
+        org_id, network_id, ext = os.path.basename(filename).split('.')
+        networks.append((int(org_id), int(network_id), filename))
+
+    return sorted(networks)
+
+
+def load_interactions(filename):
+    '''
+    node_a, node_b, weight arrays of a network text file
+    '''
+
+    if os.path.getsize(filename) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    network = pd.read_csv(filename, sep='\t', header=None, usecols=[0, 1, 2],
+                          dtype={0: np.int64, 1: np.int64, 2: np.float64}, float_precision='round_trip')
+    return network[0].to_numpy(), network[1].to_numpy(), network[2].to_numpy()
+
+
+class ArchiveWriter(object):
+    '''
+    write networks to an archive one at a time, then close()
+    to write the index
+    '''
+
+    def __init__(self, filename, weight_dtype='float32'):
+        if weight_dtype not in WEIGHT_DTYPES:
+            raise Exception("unexpected weight dtype: '%s'" % weight_dtype)
+
+        self.weight_dtype = np.dtype(weight_dtype).newbyteorder('<')
+        self.networks = []
+        self.f = open(filename, 'wb')
+        self.f.write(MAGIC)
+        self.f.write(np.zeros(1, dtype='<u8').tobytes())
+
+    def add(self, org_id, network_id, node_a, node_b, weights):
+        node_a = np.asarray(node_a)
+        node_b = np.asarray(node_b)
+        if len(node_a) and (min(node_a.min(), node_b.min()) < 0 or max(node_a.max(), node_b.max()) > INT32_MAX):
+            raise Exception('node ids of network %s.%s out of int32 range' % (org_id, network_id))
+
+        offset = aligned(self.f.tell())
+        self.networks.append([int(org_id), int(network_id), offset, len(node_a)])
+
+        self.f.seek(offset)
+        for array, dtype in [(node_a, '<i4'), (node_b, '<i4'), (weights, self.weight_dtype)]:
+            data = np.asarray(array).astype(dtype).tobytes()
+            self.f.write(data)
+            self.f.write(b'\0' * (aligned(len(data)) - len(data)))
+
+    def close(self):
+        index = {'version': VERSION, 'weight_dtype': self.weight_dtype.str, 'networks': self.networks}
+
+        offset = aligned(self.f.tell())
+        self.f.seek(offset)
+        self.f.write(json.dumps(index).encode('utf8'))
+
+        self.f.seek(len(MAGIC))
+        self.f.write(np.array([offset], dtype='<u8').tobytes())
+        self.f.close()
+
+
+class InteractionsArchive(object):
+    '''
+    read access to the networks in an archive
+    '''
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise Exception('not an interactions archive: %s' % filename)
+            offset = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            f.seek(offset)
+            index = json.loads(f.read().decode('utf8'))
+
+        if index['version'] != VERSION:
+            raise Exception('unsupported interactions archive version %s in %s' % (index['version'], filename))
+
+        self.weight_dtype = np.dtype(index['weight_dtype'])
+        self.index = {(org_id, network_id): (offset, count)
+                      for org_id, network_id, offset, count in index['networks']}
+        self.data = np.memmap(filename, dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def networks(self):
+        '''
+        (organism id, network id) of each network, in id order
+        '''
+        return sorted(self.index)
+
+    def get(self, org_id, network_id):
+        '''
+        node_a, node_b, weight arrays of the network, mapped
+        from the file rather than read
+        '''
+
+        offset, count = self.index[(org_id, network_id)]
+
+        arrays = []
+        for dtype in [np.dtype('<i4'), np.dtype('<i4'), self.weight_dtype]:
+            size = count * dtype.itemsize
+            arrays.append(self.data[offset:offset + size].view(dtype) if count else np.zeros(0, dtype=dtype))
+            offset += aligned(size)
+
+        return tuple(arrays)
+
+    def frame(self, org_id, network_id):
+        '''
+        the network as a data frame like the one read from its text file
+        '''
+        node_a, node_b, weights = self.get(org_id, network_id)
+        return pd.DataFrame({'node_a': node_a.astype(np.int64), 'node_b': node_b.astype(np.int64),
+                             'weight': weights_as_float64(weights)})
+
+
+def weights_as_float64(weights):
+    '''
+    float32 weights as the float64 of their shortest decimal,
+    e.g. 0.1 rather than 0.10000000149011612
+    '''
+    if weights.dtype.itemsize == 4:
+        return np.array(weights.astype(str), dtype=np.float64)
+    return np.asarray(weights, dtype=np.float64)
+
+
+def pack(directory, archive_file, weight_dtype='float32'):
+    writer = ArchiveWriter(archive_file, weight_dtype)
+    for org_id, network_id, filename in interaction_files(directory):
+        writer.add(org_id, network_id, *load_interactions(filename))
+    writer.close()
+
+
+def write_interactions(filename, node_a, node_b, weights):
+    with open(filename, 'w') as f:
+        f.writelines('%d\t%d\t%s\n' % (a, b, format_weight(w)) for a, b, w in
+                     zip(node_a.tolist(), node_b.tolist(), weights_as_float64(weights).tolist()))
+
+
+def unpack(archive_file, directory):
+    archive = InteractionsArchive(archive_file)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    for org_id, network_id in archive.networks():
+        filename = os.path.join(directory, '%s.%s.txt' % (org_id, network_id))
+        write_interactions(filename, *archive.get(org_id, network_id))
+
+
+def list_networks(archive_file):
+    archive = InteractionsArchive(archive_file)
+    for org_id, network_id in archive.networks():
+        print('%s\t%s\t%s' % (org_id, network_id, archive.index[(org_id, network_id)][1]))
+
+
+class TestInteractionsArchive(unittest.TestCase):
+
+    networks = {(1, 1): '1\t2\t0.5\n2\t3\t1.0E-4\n',
+                (1, 2): '',
+                (1, 10): '5\t6\t0.1\n7\t5\t0.123456789\n'}
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.interactions = os.path.join(self.tempdir, 'INTERACTIONS')
+        os.mkdir(self.interactions)
+        for (org_id, network_id), network in self.networks.items():
+            with open(os.path.join(self.interactions, '%s.%s.txt' % (org_id, network_id)), 'w') as f:
+                f.write(network)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_round_trip(self):
+        archive_file = os.path.join(self.tempdir, 'interactions.gmarc')
+        pack(self.interactions, archive_file, 'float64')
+
+        archive = InteractionsArchive(archive_file)
+        self.assertEqual([(1, 1), (1, 2), (1, 10)], archive.networks())
+
+        node_a, node_b, weights = archive.get(1, 10)
+        self.assertEqual([5, 7], node_a.tolist())
+        self.assertEqual([6, 5], node_b.tolist())
+        self.assertEqual([0.1, 0.123456789], weights.tolist())
+        self.assertEqual(0, len(archive.frame(1, 2)))
+
+        unpacked = os.path.join(self.tempdir, 'unpacked')
+        unpack(archive_file, unpacked)
+        for (org_id, network_id), network in self.networks.items():
+            with open(os.path.join(unpacked, '%s.%s.txt' % (org_id, network_id))) as f:
+                self.assertEqual(network, f.read())
+
+    def test_float32(self):
+        archive_file = os.path.join(self.tempdir, 'interactions.gmarc')
+        pack(self.interactions, archive_file)
+
+        archive = InteractionsArchive(archive_file)
+        self.assertEqual(np.float32, archive.get(1, 1)[2].dtype)
+        self.assertEqual([0.1, 0.12345679], archive.frame(1, 10)['weight'].tolist())
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='pack generic_db interaction files into a single archive, and back')
+    subparsers = parser.add_subparsers(dest='subparser_name')
+
+    parser_pack = subparsers.add_parser('pack', help='pack an INTERACTIONS folder into an archive')
+    parser_pack.add_argument('directory', help='INTERACTIONS folder of {org}.{network}.txt files')
+    parser_pack.add_argument('archive', help='archive file to write')
+    parser_pack.add_argument('--weight_dtype', choices=WEIGHT_DTYPES, default='float32',
+                             help='type to store weights as, default float32')
+
+    parser_unpack = subparsers.add_parser('unpack', help='write the networks in an archive back out as text files')
+    parser_unpack.add_argument('archive', help='archive file to read')
+    parser_unpack.add_argument('directory', help='folder to write {org}.{network}.txt files to')
+
+    parser_list = subparsers.add_parser('list', help='list the networks in an archive')
+    parser_list.add_argument('archive', help='archive file to read')
+
+    args = parser.parse_args()
+
+    if args.subparser_name == 'pack':
+        pack(args.directory, args.archive, args.weight_dtype)
+    elif args.subparser_name == 'unpack':
+        unpack(args.archive, args.directory)
+    elif args.subparser_name == 'list':
+        list_networks(args.archive)
+    else:
+        raise Exception('unexpected command: "%s"' % args.subparser_name)
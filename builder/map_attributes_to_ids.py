@@ -6,6 +6,7 @@ gene ids and attribute ids
 
 import argparse
 import pandas as pd
+from identifiers import symbol_index
 
 def main(filename, lin_attr_id, mapping, output):
 
@@ -13,16 +14,15 @@ def main(filename, lin_attr_id, mapping, output):
         na_filter=False)
     lin_attr_id['ATTRIBUTE_SYMBOL'] = lin_attr_id['EXTERNAL_ID'].str.upper()
 
-    symbols = pd.read_csv(mapping, sep='\t', header=None, na_filter=False, names=['NODE_ID', 'GENE_SYMBOL', 'SOURCE'])
-    symbols['GENE_SYMBOL'] = symbols['GENE_SYMBOL'].str.upper()
-
     data = pd.read_csv(filename, sep='\t', header=None, na_filter=False, names=['GENE_SYMBOL', 'ATTRIBUTE_SYMBOL'])
-    data['GENE_SYMBOL'] = data['GENE_SYMBOL'].str.upper()
     data['ATTRIBUTE_SYMBOL'] = data['ATTRIBUTE_SYMBOL'].astype(str).str.upper()
 
-    # apply cleaning by joining on the tables of clean symbols
-    # TODO: maybe can make this faster by putting the join column as the index?
-    clean = pd.merge(data, symbols, on='GENE_SYMBOL', how='inner')
+    # apply cleaning by looking up the clean symbols, then
+    # joining on the attribute ids
+    symbols = symbol_index.SymbolIndex(mapping)
+    positions, rows = symbols.lookup(data['GENE_SYMBOL'])
+    clean = data.iloc[positions].reset_index(drop=True)
+    clean['NODE_ID'] = symbols.node_ids(rows)
     clean = pd.merge(clean, lin_attr_id, on='ATTRIBUTE_SYMBOL', how='inner')
 
     # dedup
@@ -39,7 +39,7 @@ if __name__ == '__main__':
 
     parser.add_argument('filename', help='attribute file')
     parser.add_argument('lin_attr_id', help='linearized attribute id file')
-    parser.add_argument('mapping', help='cleaned gene symbols')
+    parser.add_argument('mapping', help='cleaned gene symbols, or symbol index compiled from them')
     parser.add_argument('output', help='output file')
 
     args = parser.parse_args()
@@ -1,44 +1,105 @@
-
 """the so-called 'raw' identifiers file is the output of a process that
 runs against the Ensembl database to produce identifiers in a particular
 format
 
-note there is an old parser for these in identifiers/parsers.py. we're now
-mostly in the habit of using pandas for data-munging, but we'll reuse the
-previous parser and cleaning logic for now
+split into id/symbol/source triplets and id/description pairs in a single
+pass over the file, a batch of rows at a time, applying the same cleanup
+rules as identifier_merger.IdentifierDB:
+
+ * symbols that are N/A (in any case), empty, or contain a space are dropped
+ * symbols from RAW_DEFAULT_SOURCES_TO_REMOVE are dropped
+ * the Synonyms source is renamed to Synonym
+ * optionally, only symbols of records having one of the given biotypes are kept
+
+the triplets for each record are sorted by source and symbol as the database
+export did, but records come out in input order rather than sorted by id.
 """
 
 
-import argparse, contextlib
+import argparse, contextlib, csv, re, sqlite3
+import numpy as np
 import pandas as pd
-from identifiers import identifier_merger
-from identifiers import constants
+from identifiers import parsers
+from identifiers.constants import *
+
+
+BATCH_SIZE = 50000
+
+# ids that are already in the form sqlite's integer affinity would
+# give them, anything else we let sqlite convert
+CANONICAL_INT = re.compile(r'^(0|[1-9][0-9]{0,17})$')
+
+
+def to_node_ids(conn, gmids):
+    '''
+    apply the conversion an integer affinity column would, so
+    ids come out the way they did from the identifier database
+    '''
+
+    node_ids = [int(gmid) if CANONICAL_INT.match(gmid) else None for gmid in gmids]
+
+    others = [gmid for gmid, node_id in zip(gmids, node_ids) if node_id is None]
+    if others:
+        conn.execute("delete from node_ids;")
+        conn.executemany("insert into node_ids (node_id) values (?);", ((gmid,) for gmid in others))
+        converted = iter([row[0] for row in conn.execute("select node_id from node_ids order by rowid;")])
+        node_ids = [next(converted) if node_id is None else node_id for node_id in node_ids]
+
+    return node_ids
+
+
+def clean_symbols(gmids, symbols, sources, keep_gmids=None):
+    '''
+    apply the cleanup rules to a batch of symbols, returning a data
+    frame of gmid, symbol, source in output order
+    '''
+
+    symbols = pd.DataFrame({COL3_GMID: gmids, COL3_SYMBOL: symbols, COL3_SOURCE: sources})
+    symbols['fold'] = symbols[COL3_SYMBOL].str.translate(NOCASE_TABLE)
+
+    keep = ((symbols['fold'] != 'n/a') & (symbols[COL3_SYMBOL] != '')
+            & ~symbols[COL3_SYMBOL].str.contains(' ', regex=False)
+            & ~symbols[COL3_SOURCE].isin(RAW_DEFAULT_SOURCES_TO_REMOVE))
+    if keep_gmids is not None:
+        keep &= symbols[COL3_GMID].isin(keep_gmids)
+
+    symbols = symbols[keep].copy()
+    symbols[COL3_SOURCE] = symbols[COL3_SOURCE].replace(RAW_SYNONYM_ORIG, RAW_SYNONYM)
+
+    # each record's symbols stay together, in input order
+    symbols['record'] = pd.factorize(symbols[COL3_GMID])[0]
+    symbols = symbols.sort_values(['record', COL3_SOURCE, 'fold'], kind='mergesort')
+
+    return symbols[[COL3_GMID, COL3_SYMBOL, COL3_SOURCE]]
 
 
 def main(inputfile, symbols_outputfile, descriptions_outputfile, biotypes=None):
 
-    # symbols as id/symbol/source triplets
-    db = identifier_merger.IdentifierDB(":memory:")
-    with contextlib.closing(db):
-        db.load_raw(open(inputfile, encoding='UTF8'))
-        db.cleanup()
-        db.remove_unwanted_sources(constants.RAW_DEFAULT_SOURCES_TO_REMOVE)
-        db.standardize_source_names()
+    conn = sqlite3.connect(":memory:")
+    conn.execute("create table node_ids (node_id integer);")
+
+    with contextlib.closing(conn), open(inputfile, encoding='UTF8') as infile, \
+            open(symbols_outputfile, 'w', encoding='UTF8') as symbols_file, \
+            open(descriptions_outputfile, 'w', encoding='UTF8', newline='') as descriptions_file:
+
+        descriptions = csv.writer(descriptions_file, delimiter='\t', lineterminator='\n')
 
-        if biotypes:
-            db.biotype_filter(biotypes)
+        parser = parsers.RawIdFrameParser(infile)
+        for (gmids, entity_biotypes, descs), (symbol_gmids, symbols, sources) in parser.batches(BATCH_SIZE):
+            node_ids = to_node_ids(conn, gmids)
 
-        db.export_processed(open(symbols_outputfile, 'w', encoding='UTF8'))
+            descs = ['' if desc == 'N/A' else desc for desc in descs]
+            descriptions.writerows(zip(node_ids, descs))
 
+            keep_gmids = None
+            if biotypes:
+                keep_gmids = gmids[np.isin(entity_biotypes, biotypes)]
 
-    # descriptions
-    data = pd.read_csv(inputfile, sep='\t', header=0,
-                       encoding='UTF8', na_filter=False)
+            symbols = clean_symbols(symbol_gmids, symbols, sources, keep_gmids)
+            symbols[COL3_GMID] = symbols[COL3_GMID].map(dict(zip(gmids, node_ids)))
 
-    data['Definition'].replace('N/A', '', inplace=True)
+            symbols_file.writelines('%s\t%s\t%s\n' % row for row in symbols.itertuples(index=False, name=None))
 
-    data.to_csv(descriptions_outputfile, sep='\t', header=False, index=False,
-                columns=['GMID', 'Definition'], encoding='UTF8')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='split raw identifiers file into triplets' )
@@ -55,4 +116,4 @@ if __name__ == '__main__':
     else:
         biotypes = None
 
-    main(args.inputfile, args.symbols_outputfile, args.descriptions_outputfile, biotypes)
\ No newline at end of file
+    main(args.inputfile, args.symbols_outputfile, args.descriptions_outputfile, biotypes)
@@ -4,12 +4,160 @@ this script exists because we made a design mistake in the
 organism data structures [TODO explain!]
 """
 
-import os, shutil, glob, datetime
-import argparse
+import os, shutil, glob, datetime, multiprocessing
+import argparse, unittest, tempfile
+import numpy as np
 import pandas as pd
 
 # TODO: sort outputs, so easy to diff and reproducible
 
+NEWLINE, TAB, ZERO = 10, 9, 48
+
+# longest id we parse, so the value fits in an int64
+MAX_DIGITS = 18
+
+# bytes of a data file to shift at a time
+BLOCK_SIZE = 1 << 25
+
+
+def parse_ints(buf, starts, ends):
+    '''
+    the unsigned integers in buf[starts[i]:ends[i]] for each i
+    '''
+
+    lengths = ends - starts
+    if len(lengths) and (lengths.min() < 1 or lengths.max() > MAX_DIGITS):
+        raise Exception('expected integer ids')
+
+    values = np.zeros(len(starts), dtype=np.int64)
+    for c in range(int(lengths.max()) if len(lengths) else 0):
+        inside = c < lengths
+        digits = buf[np.where(inside, starts + c, 0)].astype(np.int64) - ZERO
+        if (((digits < 0) | (digits > 9)) & inside).any():
+            raise Exception('expected integer ids')
+        values = np.where(inside, values * 10 + digits, values)
+
+    return values
+
+
+def format_ints(values):
+    '''
+    (digits, width, lengths), the decimal digits of each value right
+    aligned in a row of width bytes, and the number of digits of each
+    '''
+
+    width = len(str(int(values.max()))) if len(values) else 1
+    lengths = np.ones(len(values), dtype=np.int64)
+    for power in range(1, width):
+        lengths += values >= 10 ** power
+
+    digits = np.empty((len(values), width), dtype=np.uint8)
+    rest = values.copy()
+    for c in range(width - 1, -1, -1):
+        digits[:, c] = rest % 10 + ZERO
+        rest //= 10
+
+    return digits.ravel(), width, lengths
+
+
+def shift_columns(data, increments):
+    '''
+    add increments[j] to the integer in column j of each tab delimited
+    line of data, for the leading columns. the rest of each line is
+    copied as is. blank lines are dropped
+    '''
+
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if len(buf) and buf[-1] != NEWLINE:
+        buf = np.append(buf, np.uint8(NEWLINE))
+
+    ends = np.flatnonzero(buf == NEWLINE)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    nonblank = ends > starts
+    starts, ends = starts[nonblank], ends[nonblank]
+    n = len(starts)
+
+    tabs = np.append(np.flatnonzero(buf == TAB), len(buf))
+    first_tab = np.searchsorted(tabs, starts)
+
+    # the output is pieced together from segments of the input and of
+    # the new ids' digits, a run of segments for each line
+    sources, offset = [buf], len(buf)
+    segment_starts, segment_lengths = [], []
+    field_start = starts
+    for j, increment in enumerate(increments):
+        tab = tabs[np.minimum(first_tab + j, len(tabs) - 1)]
+        last = j == len(increments) - 1
+        if not last and (tab >= ends).any():
+            raise Exception('expected at least %d columns' % len(increments))
+        field_end = np.minimum(tab, ends)
+
+        digits, width, lengths = format_ints(parse_ints(buf, field_start, field_end) + increment)
+        sources.append(digits)
+        segment_starts.append(offset + np.arange(n) * width + width - lengths)
+        segment_lengths.append(lengths)
+        offset += len(digits)
+
+        # then the tab after the id, or for the last id, the rest of the line
+        segment_starts.append(field_end)
+        if last:
+            segment_lengths.append(ends - field_end + 1)
+        else:
+            segment_lengths.append(np.ones(n, dtype=np.int64))
+            field_start = field_end + 1
+
+    source = np.concatenate(sources)
+    segment_starts = np.stack(segment_starts, axis=1).ravel()
+    segment_lengths = np.stack(segment_lengths, axis=1).ravel()
+
+    out_starts = np.cumsum(segment_lengths) - segment_lengths
+    index = np.repeat(segment_starts - out_starts, segment_lengths) + np.arange(int(segment_lengths.sum()))
+    return source[index].tobytes()
+
+
+def shift_file(task):
+    '''
+    copy a data file, shifting the ids in its leading columns. task is
+    (filename, new_filename, increments), see shift_columns()
+    '''
+
+    filename, new_filename, increments = task
+    with open(filename, 'rb') as f, open(new_filename, 'wb') as out:
+        remainder = b''
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+
+            # up to the last full line, the rest goes with the next block
+            block = remainder + block
+            cut = block.rfind(b'\n') + 1
+            block, remainder = block[:cut], block[cut:]
+            out.write(shift_columns(block, increments))
+
+        out.write(shift_columns(remainder, increments))
+
+
+def shift_files(copies, processes=1):
+    '''
+    shift_file() each of the copies, in a pool of processes if more than 1
+    '''
+
+    # biggest first, so the pool isn't left waiting on one at the end
+    copies = sorted(copies, key=lambda copy: os.path.getsize(copy[0]), reverse=True)
+
+    if processes > 1 and len(copies) > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            for result in pool.imap_unordered(shift_file, copies, chunksize=16):
+                pass
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for copy in copies:
+            shift_file(copy)
+
 
 class GenericDbIO(object):
     def __init__(self, schema_file):
@@ -84,8 +232,12 @@ def schema2dict(schema_file):
 
 class Merger(object):
 
-    def __init__(self, schema_file):
+    def __init__(self, schema_file, processes=1):
         self.gio = GenericDbIO(schema_file)
+        self.processes = processes
+
+        # data files to copy once the metadata is merged
+        self.copies = []
 
         # initialize empty table dataframes
         self.merged = {}
@@ -104,8 +256,9 @@ class Merger(object):
         into in-memory tables.
 
         If merged_location given, the bulk interaction data for the given
-        location is copied.  The merged tables are not written out here however,
-        since they require all dbs to be processed. see write_db() instead.
+        location is queued for copying by copy_data().  The merged tables are
+        not written out here however, since they require all dbs to be
+        processed. see write_db() instead.
         """
         org_id = self.merge_organisms(location)
 
@@ -142,8 +295,17 @@ class Merger(object):
             print("processing %s" % location)
             self.merge_db(location, merged_location)
 
+        self.copy_data()
         self.write_db(merged_location)
 
+    def copy_data(self):
+        """copy the queued interaction and attribute data files,
+        in a pool of processes if configured
+        """
+
+        shift_files(self.copies, self.processes)
+        self.copies = []
+
     def write_db(self, location):
 
         # write out the merged db tabls we've built up
@@ -391,11 +553,8 @@ class Merger(object):
             network_id = int(network_id) + network_id_inc
             new_filename = os.path.join(to_dir, '%s.%s.%s' % (org_id, network_id, ext))
 
-            network_data = pd.read_csv(filename, sep='\t', header=None, names=['node_a', 'node_b', 'weight'])
-            network_data['node_a'] += node_id_inc
-            network_data['node_b'] += node_id_inc
-
-            network_data.to_csv(new_filename, sep='\t', header=False, index=False)
+            # node_a, node_b, weight
+            self.copies.append((filename, new_filename, [node_id_inc, node_id_inc]))
 
     def copy_attribute_data(self, location, merged_location, attribute_group_id_inc, attribute_id_inc, node_id_inc):
 
@@ -412,11 +571,8 @@ class Merger(object):
 
             new_filename = os.path.join(to_dir, '%s.%s' % (attribute_group_id, ext))
 
-            attribute_data = pd.read_csv(filename, sep='\t', header=None, names=['node', 'attribute'])
-            attribute_data['node'] += node_id_inc
-            attribute_data['attribute'] += attribute_id_inc
-
-            attribute_data.to_csv(new_filename, sep='\t', header=False, index=False)
+            # node, attribute
+            self.copies.append((filename, new_filename, [node_id_inc, attribute_id_inc]))
 
     def copy_function_data(self, location, merged_location):
         # TODO: this just copies over the file, review naming conventions and content format
@@ -433,7 +589,7 @@ class Merger(object):
             new_filename = os.path.join(to_dir, os.path.basename(filename))
             shutil.copyfile(filename, new_filename)
 
-def main(input_dbs, merged_db):
+def main(input_dbs, merged_db, processes=1):
 
     assert len(input_dbs) > 1, "need more than 1 db to merge"
 
@@ -443,19 +599,53 @@ def main(input_dbs, merged_db):
     schema_file = os.path.join(input_dbs[0], "SCHEMA.txt")
 
     #
-    merger = Merger(schema_file)
+    merger = Merger(schema_file, processes)
 
     merger.merge(input_dbs, merged_db)
 
 
+class TestShiftColumns(unittest.TestCase):
+
+    def test_shift_columns(self):
+        self.assertEqual(b'11\t102\t0.5\n19\t100\t1.0E-4\n',
+                         shift_columns(b'1\t2\t0.5\n9\t0\t1.0E-4\n', [10, 100]))
+        self.assertEqual(b'6\t9\n15\t27\n', shift_columns(b'1\t2\n\n10\t20', [5, 7]))
+        self.assertEqual(b'', shift_columns(b'', [1, 1]))
+        self.assertRaises(Exception, shift_columns, b'a\t2\n', [1, 1])
+        self.assertRaises(Exception, shift_columns, b'1\n', [1, 1])
+
+    def test_shift_file(self):
+        global BLOCK_SIZE
+        tempdir = tempfile.mkdtemp()
+        block_size = BLOCK_SIZE
+        try:
+            filename = os.path.join(tempdir, '1.1.txt')
+            with open(filename, 'w') as f:
+                f.writelines('%d\t%d\t0.%d\n' % (i, i * 7, i) for i in range(1000))
+
+            expected = pd.read_csv(filename, sep='\t', header=None, dtype={2: str})
+            expected[[0, 1]] += 100
+
+            # blocks ending part way through lines
+            BLOCK_SIZE = 100
+            shift_file((filename, filename + '.shifted', [100, 100]))
+            actual = pd.read_csv(filename + '.shifted', sep='\t', header=None, dtype={2: str})
+            pd.testing.assert_frame_equal(expected, actual)
+        finally:
+            BLOCK_SIZE = block_size
+            shutil.rmtree(tempdir)
+
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='combine multiple single organism generic_dbs')
 
     parser.add_argument('input_dbs', help='list of input db folders to include', nargs='+')
     parser.add_argument('merged_db', help='output merged db folder')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of processes copying interaction and attribute data, default 1')
 
     args = parser.parse_args()
-    main(args.input_dbs, args.merged_db)
+    main(args.input_dbs, args.merged_db, args.processes)
 
 
@@ -1,5 +1,3 @@
-
-
 '''
 compute basic network stats
 
@@ -12,7 +10,9 @@ file must be processed/clean:
    weights for the pair node1/node2 are present
 
 with these assumptions (which is what our tools produce) we don't have to do
-much here.
+much here. the file is read a chunk at a time, counting the interactions
+each integer node id takes part in, so memory use depends on the number
+of nodes rather than the size of the network.
 
 output is in text file with
 
@@ -22,37 +22,175 @@ pairs, for the following measures:
 
  * num_interactions
  * num_genes
+ * num_self_interactions
+ * weight_min, weight_max
+ * dynamic_range, as 'min - max'
+ * weight_distribution, the count of weights in each power of ten,
+   e.g. '1e-3:20,1e-2:150' for 20 weights in [0.001, 0.01) and 150 in [0.01, 0.1)
+ * degree_max, degree_mean, degree_median
+ * degree_distribution, the count of genes with degree in each power
+   of two, e.g. '1:10,2:4' for 10 genes of degree 1 and 4 of degree 2 or 3
 
 '''
 
-import argparse
+import argparse, os
+import unittest, tempfile, shutil
+import numpy as np
 import pandas as pd
 from configobj import ConfigObj
 
+CHUNKSIZE = 1000000
 
-def main(input_file, output_file):
 
-    network = pd.read_csv(input_file, sep='\t', header=None, names=['gene1', 'gene2', 'weight'])
+class NetworkStats(object):
+    '''
+    stats accumulated over the chunks of a network
+    '''
 
-    # num interactions is just the line count
-    num_interactions = len(network)
+    def __init__(self):
+        self.num_interactions = 0
+        self.num_self_interactions = 0
+        self.degrees = np.zeros(0, dtype=np.int64)
+        self.weight_min = np.inf
+        self.weight_max = -np.inf
+        self.weight_decades = {}
 
-    # count genes
-    all_genes = pd.concat([network[['gene1']], network[['gene2']]],sort=True)
-    all_genes.drop_duplicates(inplace=True)
-    num_genes = len(all_genes)
+    def add(self, node1, node2, weights):
+        if len(node1) == 0:
+            return
 
+        if min(node1.min(), node2.min()) < 0:
+            raise Exception('negative node id in network')
 
-    # output
+        self.num_interactions += len(node1)
+        self.num_self_interactions += int(np.count_nonzero(node1 == node2))
+
+        size = max(int(node1.max()), int(node2.max())) + 1
+        if size > len(self.degrees):
+            self.degrees = np.concatenate([self.degrees, np.zeros(size - len(self.degrees), dtype=np.int64)])
+        self.degrees += np.bincount(node1, minlength=len(self.degrees))
+        self.degrees += np.bincount(node2, minlength=len(self.degrees))
+
+        self.weight_min = min(self.weight_min, weights.min())
+        self.weight_max = max(self.weight_max, weights.max())
+
+        positive = weights[weights > 0]
+        decades, counts = np.unique(np.floor(np.log10(positive)).astype(np.int64), return_counts=True)
+        for decade, count in zip(decades.tolist(), counts.tolist()):
+            self.weight_decades[decade] = self.weight_decades.get(decade, 0) + count
+
+    def results(self):
+        degrees = self.degrees[self.degrees > 0]
+
+        results = {'num_interactions': self.num_interactions,
+                   'num_genes': len(degrees),
+                   'num_self_interactions': self.num_self_interactions}
+
+        if self.num_interactions == 0:
+            for key in ['weight_min', 'weight_max', 'dynamic_range', 'weight_distribution',
+                        'degree_max', 'degree_mean', 'degree_median', 'degree_distribution']:
+                results[key] = ''
+            return results
+
+        results['weight_min'] = repr(float(self.weight_min))
+        results['weight_max'] = repr(float(self.weight_max))
+        results['dynamic_range'] = '%g - %g' % (self.weight_min, self.weight_max)
+        results['weight_distribution'] = ','.join('1e%d:%d' % (decade, self.weight_decades[decade])
+                                                  for decade in sorted(self.weight_decades))
+
+        results['degree_max'] = int(degrees.max())
+        results['degree_mean'] = round(float(degrees.mean()), 3)
+        results['degree_median'] = float(np.median(degrees))
+
+        bins, counts = np.unique(np.floor(np.log2(degrees)).astype(np.int64), return_counts=True)
+        results['degree_distribution'] = ','.join('%d:%d' % (2 ** b, count)
+                                                  for b, count in zip(bins.tolist(), counts.tolist()))
+
+        return results
+
+
+def compute_stats(input_file, chunksize=CHUNKSIZE):
+    stats = NetworkStats()
+
+    if os.path.getsize(input_file) == 0:
+        return stats.results()
+
+    # the default float parser can be a bit off in the last digit
+    chunks = pd.read_csv(input_file, sep='\t', header=None, usecols=[0, 1, 2],
+                         dtype={0: np.int64, 1: np.int64, 2: np.float64}, float_precision='round_trip',
+                         chunksize=chunksize)
+    with chunks:
+        for chunk in chunks:
+            stats.add(chunk[0].to_numpy(), chunk[1].to_numpy(), chunk[2].to_numpy())
+
+    return stats.results()
+
+
+def write_stats(results, output_file):
     cfg = ConfigObj(encoding='utf8')
 
-    cfg['num_interactions'] = num_interactions
-    cfg['num_genes'] = num_genes
+    for key, value in results.items():
+        cfg[key] = value
 
     cfg.filename = output_file
     cfg.write()
 
 
+def main(input_file, output_file):
+
+    results = compute_stats(input_file)
+
+    # output
+    write_stats(results, output_file)
+
+
+class TestNetworkStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_stats(self):
+        network_file = os.path.join(self.tempdir, 'network.txt.nn')
+        output_file = network_file + '.stats'
+        with open(network_file, 'w') as f:
+            f.write('1\t2\t0.5\n2\t3\t0.05\n3\t3\t1.0E-4\n5\t1\t0.25\n')
+
+        main(network_file, output_file)
+
+        stats = ConfigObj(output_file, encoding='utf8')
+        self.assertEqual('4', stats['num_interactions'])
+        self.assertEqual('4', stats['num_genes'])
+        self.assertEqual('1', stats['num_self_interactions'])
+        self.assertEqual('0.0001', stats['weight_min'])
+        self.assertEqual('0.5', stats['weight_max'])
+        self.assertEqual('0.0001 - 0.5', stats['dynamic_range'])
+        self.assertEqual('1e-4:1,1e-2:1,1e-1:2', stats['weight_distribution'])
+
+        # degrees 2, 2, 3, 1, the self interaction counting twice
+        self.assertEqual('3', stats['degree_max'])
+        self.assertEqual('2.0', stats['degree_median'])
+        self.assertEqual('1:1,2:3', stats['degree_distribution'])
+
+        # the same in chunks
+        for chunksize in [1, 3]:
+            self.assertEqual(compute_stats(network_file), compute_stats(network_file, chunksize))
+
+    def test_empty(self):
+        network_file = os.path.join(self.tempdir, 'network.txt.nn')
+        output_file = network_file + '.stats'
+        open(network_file, 'w').close()
+
+        main(network_file, output_file)
+
+        stats = ConfigObj(output_file, encoding='utf8')
+        self.assertEqual('0', stats['num_interactions'])
+        self.assertEqual('0', stats['num_genes'])
+        self.assertEqual('', stats['weight_distribution'])
+
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='count interactions etc')
@@ -65,4 +203,3 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
     main(args.input, args.output)
-
@@ -0,0 +1,343 @@
+'''
+in-process alternative to the java NetworkNormalizer, run as
+
+  NetworkNormalizer -outtype uid -norm true -in network -out nn -syn symbols
+
+without starting a jvm for each network:
+
+ * gene symbols in the first two columns are mapped to node ids,
+   case insensitively, using the clean identifiers (symbols.txt or the
+   compiled symbols.idx). interactions with an unrecognized gene are dropped
+ * self interactions are dropped
+ * the network is made symmetric, a pair of genes listed more than once
+   in either order keeps the largest weight
+ * weights are normalized by the degrees of the genes at either end,
+   w / sqrt(d1 * d2), the symmetric normalization D^-1/2 W D^-1/2
+
+output is node id/node id/weight, each interaction once with the lower
+node id first, ordered by node ids. weights are formatted as java's
+Double.toString() does.
+
+the compare command is a harness for checking the output against .nn
+files previously written by the java normalizer, e.g.
+
+  python builder/normalize_network.py compare work/identifiers/symbols.txt work/networks/direct/*/*.nn
+
+normalizes the .cleaned or .p2n input next to each .nn file and reports
+whether the results are identical, or agree to within a tolerance.
+'''
+
+import argparse, os, sys, decimal
+import unittest, tempfile, shutil
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from identifiers import symbol_index
+
+
+def load_network(filename):
+    '''
+    gene1, gene2, weight columns of a network file, as
+    (gene1, gene2, weights) arrays
+    '''
+    try:
+        network = pd.read_csv(filename, sep='\t', header=None, usecols=[0, 1, 2],
+                              names=['gene1', 'gene2', 'weight'], dtype={'gene1': str, 'gene2': str},
+                              na_filter=False, float_precision='round_trip')
+    except pd.errors.EmptyDataError:
+        network = pd.DataFrame({'gene1': [], 'gene2': [], 'weight': []})
+
+    weights = pd.to_numeric(network['weight'], errors='raise').to_numpy(dtype=np.float64)
+    return network['gene1'].to_numpy(dtype=object), network['gene2'].to_numpy(dtype=object), weights
+
+
+def resolve_symbols(index, symbols):
+    '''
+    node id of each symbol, -1 where there is no match. where a symbol
+    matches more than one identifier the first is used
+    '''
+    uniques, inverse = np.unique(np.asarray(symbols, dtype=object).astype(str), return_inverse=True)
+    positions, rows = index.lookup(uniques)
+
+    node_ids = np.full(len(uniques), -1, dtype=np.int64)
+    first = np.unique(positions, return_index=True)[1]
+    node_ids[positions[first]] = index.node_ids(rows[first])
+    return node_ids[inverse.ravel()]
+
+
+def normalize(node1, node2, weights):
+    '''
+    normalize a network of (node1, node2, weight) arrays. returns
+    (node1, node2, weights) with each interaction once, node1 < node2,
+    along with a dict of counts of what was dropped
+    '''
+
+    counts = {'interactions_read': len(weights)}
+
+    mapped = (node1 >= 0) & (node2 >= 0)
+    counts['unmapped_dropped'] = int((~mapped).sum())
+
+    looped = mapped & (node1 == node2)
+    counts['self_interactions_dropped'] = int(looped.sum())
+
+    keep = mapped & ~looped
+    m = int(keep.sum())
+    nodes, codes = np.unique(np.concatenate([node1[keep], node2[keep]]), return_inverse=True)
+    codes = codes.ravel()
+    n = len(nodes)
+    lo, hi = np.minimum(codes[:m], codes[m:]), np.maximum(codes[:m], codes[m:])
+    weights = weights[keep]
+
+    # collapse duplicates in either orientation to the largest weight,
+    # leaving the upper triangle of the symmetric matrix
+    counts['duplicates_collapsed'] = 0
+    if m > 0:
+        order = np.lexsort((hi, lo))
+        lo, hi, weights = lo[order], hi[order], weights[order]
+        starts = np.flatnonzero(np.concatenate(([True], (lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1]))))
+        counts['duplicates_collapsed'] = m - len(starts)
+        weights = np.maximum.reduceat(weights, starts)
+        lo, hi = lo[starts], hi[starts]
+
+    upper = sparse.csr_matrix((weights, (lo, hi)), shape=(n, n))
+
+    # degrees of the full symmetric matrix
+    degree = np.asarray(upper.sum(axis=0)).ravel() + np.asarray(upper.sum(axis=1)).ravel()
+    scale = np.zeros(n)
+    np.divide(1.0, np.sqrt(degree), out=scale, where=degree > 0)
+    scale = sparse.diags(scale)
+
+    normalized = (scale @ upper @ scale).tocsr()
+    normalized.sort_indices()
+    normalized = normalized.tocoo()
+
+    counts['interactions_written'] = normalized.nnz
+    counts['genes'] = n
+
+    return nodes[normalized.row], nodes[normalized.col], normalized.data, counts
+
+
+def format_weight(value):
+    '''
+    java's Double.toString(): plain decimals from 10^-3 up to 10^7,
+    else computerized scientific notation like 1.0E-4
+    '''
+
+    if value == 0 or 1e-3 <= abs(value) < 1e7:
+        return repr(value)
+
+    sign, digits, exponent = decimal.Decimal(repr(value)).as_tuple()
+    digits = ''.join(str(digit) for digit in digits)
+    exponent += len(digits) - 1
+    digits = digits.rstrip('0')
+    return '%s%s.%sE%d' % ('-' if sign else '', digits[0], digits[1:] or '0', exponent)
+
+
+def write_network(filename, node1, node2, weights):
+    with open(filename, 'w') as f:
+        f.writelines('%d\t%d\t%s\n' % (a, b, format_weight(w))
+                     for a, b, w in zip(node1.tolist(), node2.tolist(), weights.tolist()))
+
+
+def write_log(filename, counts):
+    with open(filename, 'w') as f:
+        f.writelines('%s = %s\n' % item for item in counts.items())
+
+
+def normalize_file(input_file, index, output_file, log_file=None):
+    '''
+    normalize a network file, index is a SymbolIndex of the clean
+    identifiers. returns the counts written to the log
+    '''
+    gene1, gene2, weights = load_network(input_file)
+    node1, node2, weights, counts = normalize(resolve_symbols(index, gene1), resolve_symbols(index, gene2), weights)
+
+    write_network(output_file, node1, node2, weights)
+    if log_file:
+        write_log(log_file, counts)
+
+    return counts
+
+
+def load_normalized(filename):
+    '''
+    a normalized network as a series of weights, indexed by
+    node id pairs with the lower id first
+    '''
+    try:
+        network = pd.read_csv(filename, sep='\t', header=None, names=['node1', 'node2', 'weight'])
+    except pd.errors.EmptyDataError:
+        network = pd.DataFrame({'node1': [], 'node2': [], 'weight': []})
+
+    lo = np.minimum(network['node1'], network['node2'])
+    hi = np.maximum(network['node1'], network['node2'])
+    return pd.Series(network['weight'].to_numpy(), index=pd.MultiIndex.from_arrays([lo, hi]))
+
+
+def compare_files(expected_file, actual_file, tolerance=1e-6):
+    '''
+    compare a normalized network with one from the java normalizer.
+    returns (status, detail), status is 'identical', 'equivalent' where
+    the same interactions have weights within the relative tolerance,
+    else 'different'
+    '''
+
+    with open(expected_file, 'rb') as f1, open(actual_file, 'rb') as f2:
+        if f1.read() == f2.read():
+            return 'identical', ''
+
+    expected = load_normalized(expected_file)
+    actual = load_normalized(actual_file)
+
+    if expected.index.duplicated().any():
+        return 'different', 'duplicate interactions in %s' % expected_file
+
+    missing = expected.index.difference(actual.index)
+    extra = actual.index.difference(expected.index)
+    if len(missing) or len(extra):
+        return 'different', '%d interactions missing, %d extra' % (len(missing), len(extra))
+
+    actual = actual.reindex(expected.index)
+    error = np.abs(actual.to_numpy() - expected.to_numpy()) / np.abs(expected.to_numpy())
+    worst = error.max() if len(error) else 0.0
+    if worst > tolerance:
+        return 'different', 'largest relative weight difference %g' % worst
+
+    return 'equivalent', 'largest relative weight difference %g' % worst
+
+
+def network_input(nn_file):
+    '''
+    the file a .nn file was normalized from, foo.txt.cleaned
+    or foo.txt.p2n for foo.txt.nn
+    '''
+    base = nn_file[:-len('.nn')]
+    for suffix in ['.cleaned', '.p2n']:
+        if os.path.exists(base + suffix):
+            return base + suffix
+    raise Exception('no .cleaned or .p2n input found for %s' % nn_file)
+
+
+def compare(mapping_file, nn_files, tolerance):
+    index = symbol_index.SymbolIndex(mapping_file)
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        actual_file = os.path.join(tempdir, 'network.nn')
+        failures = 0
+        for nn_file in nn_files:
+            normalize_file(network_input(nn_file), index, actual_file)
+            status, detail = compare_files(nn_file, actual_file, tolerance)
+            print('%s\t%s\t%s' % (status, nn_file, detail))
+            failures += status == 'different'
+    finally:
+        shutil.rmtree(tempdir)
+
+    print('%d of %d networks differ' % (failures, len(nn_files)))
+    return failures
+
+
+def main(input_file, mapping_file, output_file, log_file=None):
+    index = symbol_index.SymbolIndex(mapping_file)
+    normalize_file(input_file, index, output_file, log_file)
+
+
+class TestNormalizeNetwork(unittest.TestCase):
+
+    symbols = ('1\tAAA\tGene Name\n'
+               '2\tBBB\tGene Name\n'
+               '3\tCCC\tGene Name\n'
+               '4\tDDD\tGene Name\n')
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.symbols_file = os.path.join(self.tempdir, 'symbols.txt')
+        with open(self.symbols_file, 'w') as f:
+            f.write(self.symbols)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_normalize(self):
+        network_file = os.path.join(self.tempdir, 'network.txt.cleaned')
+        nn_file = os.path.join(self.tempdir, 'network.txt.nn')
+        log_file = os.path.join(self.tempdir, 'network.txt.nn.log')
+
+        # aaa-bbb twice with the larger weight 2 kept, a self
+        # interaction and an unknown gene
+        with open(network_file, 'w') as f:
+            f.write('aaa\tBBB\t1\nBBB\tAAA\t2\nCCC\tbbb\t2\nCCC\tCCC\t5\nAAA\tEEE\t1\n')
+
+        main(network_file, self.symbols_file, nn_file, log_file)
+
+        # degrees are 2, 4, 2
+        with open(nn_file) as f:
+            self.assertEqual('1\t2\t0.7071067811865475\n2\t3\t0.7071067811865475\n', f.read())
+
+        with open(log_file) as f:
+            log = f.read()
+        self.assertIn('duplicates_collapsed = 1\n', log)
+        self.assertIn('unmapped_dropped = 1\n', log)
+        self.assertIn('self_interactions_dropped = 1\n', log)
+
+    def test_empty(self):
+        network_file = os.path.join(self.tempdir, 'network.txt.cleaned')
+        nn_file = os.path.join(self.tempdir, 'network.txt.nn')
+        open(network_file, 'w').close()
+
+        main(network_file, self.symbols_file, nn_file)
+        self.assertEqual(0, os.path.getsize(nn_file))
+
+    def test_format_weight(self):
+        self.assertEqual('0.5', format_weight(0.5))
+        self.assertEqual('1.0', format_weight(1.0))
+        self.assertEqual('0.00123', format_weight(0.00123))
+        self.assertEqual('1.0E-4', format_weight(1e-4))
+        self.assertEqual('1.2345E-5', format_weight(1.2345e-5))
+        self.assertEqual('1.2345678E7', format_weight(12345678.0))
+
+    def test_compare(self):
+        expected = os.path.join(self.tempdir, 'expected.nn')
+        actual = os.path.join(self.tempdir, 'actual.nn')
+
+        with open(expected, 'w') as f:
+            f.write('1\t2\t0.5\n3\t2\t1.0E-4\n')
+
+        with open(actual, 'w') as f:
+            f.write('1\t2\t0.5\n3\t2\t1.0E-4\n')
+        self.assertEqual('identical', compare_files(expected, actual)[0])
+
+        with open(actual, 'w') as f:
+            f.write('2\t3\t0.00010000000001\n1\t2\t0.5\n')
+        self.assertEqual('equivalent', compare_files(expected, actual)[0])
+
+        with open(actual, 'w') as f:
+            f.write('1\t2\t0.5\n2\t4\t1.0E-4\n')
+        self.assertEqual('different', compare_files(expected, actual)[0])
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='normalize interaction networks, in place of the java NetworkNormalizer')
+    subparsers = parser.add_subparsers(dest='subparser_name')
+
+    parser_normalize = subparsers.add_parser('normalize', help='normalize a network')
+    parser_normalize.add_argument('input', help='network file of gene symbol pairs and weights')
+    parser_normalize.add_argument('mapping', help='clean identifiers file, or symbol index compiled from it')
+    parser_normalize.add_argument('output', help='normalized network of node id pairs')
+    parser_normalize.add_argument('--log', help='file to write counts of interactions dropped or collapsed')
+
+    parser_compare = subparsers.add_parser('compare', help='check against .nn files from the java normalizer')
+    parser_compare.add_argument('mapping', help='clean identifiers file, or symbol index compiled from it')
+    parser_compare.add_argument('nn_files', nargs='+', help='normalized networks written by the java normalizer')
+    parser_compare.add_argument('--tolerance', type=float, default=1e-6,
+                                help='largest relative difference in weights to accept, default 1e-6')
+
+    args = parser.parse_args()
+
+    if args.subparser_name == 'normalize':
+        main(args.input, args.mapping, args.output, args.log)
+    elif args.subparser_name == 'compare':
+        sys.exit(1 if compare(args.mapping, args.nn_files, args.tolerance) else 0)
+    else:
+        raise Exception('unexpected command: "%s"' % args.subparser_name)
@@ -0,0 +1,159 @@
+'''
+normalize many networks in one process, as normalize_network.py does
+for a single network. the identifiers are opened once and shared by
+all the networks, rather than re-read for each as the java
+NetworkNormalizer does.
+
+the manifest is a tab delimited file with a line per network:
+
+  input<tab>output[<tab>log]
+
+with --processes the networks are spread across a pool of worker
+processes, largest first. each worker opens the identifiers itself, for
+a compiled symbols.idx that just maps the same file, so the pages are
+shared between them.
+'''
+
+import argparse, os, csv, multiprocessing
+import unittest, tempfile, shutil
+from identifiers import symbol_index
+from normalize_network import normalize_file
+
+# symbol index of each worker process
+worker_index = None
+
+
+def read_manifest(filename):
+    '''
+    list of (input, output, log) tuples, log is None where not given
+    '''
+
+    networks = []
+    with open(filename, encoding='UTF8', newline='') as f:
+        for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if not row:
+                continue
+            if len(row) not in (2, 3):
+                raise Exception('expected input, output, and optional log on manifest line: %s' % row)
+            networks.append((row[0], row[1], row[2] if len(row) == 3 else None))
+
+    return networks
+
+
+def write_manifest(filename, inputs, outputs, logs=None):
+    if logs is None:
+        logs = [None] * len(inputs)
+
+    with open(filename, 'w', encoding='UTF8') as f:
+        for row in zip(inputs, outputs, logs):
+            f.write('\t'.join(value for value in row if value is not None) + '\n')
+
+
+def init_worker(mapping_file):
+    global worker_index
+    worker_index = symbol_index.SymbolIndex(mapping_file)
+
+
+def normalize_worker(network):
+    input_file, output_file, log_file = network
+    return input_file, normalize_file(input_file, worker_index, output_file, log_file)
+
+
+def normalize_batch(networks, mapping_file, processes=1):
+    '''
+    normalize each (input, output, log) network. returns a dict of
+    the counts logged for each input
+    '''
+
+    results = {}
+    if processes <= 1 or len(networks) <= 1:
+        index = symbol_index.SymbolIndex(mapping_file)
+        for input_file, output_file, log_file in networks:
+            results[input_file] = normalize_file(input_file, index, output_file, log_file)
+        return results
+
+    # big networks first, so one isn't left running on its own at the end
+    networks = sorted(networks, key=lambda network: os.path.getsize(network[0]), reverse=True)
+
+    pool = multiprocessing.Pool(min(processes, len(networks)), init_worker, (mapping_file,))
+    try:
+        for input_file, counts in pool.imap_unordered(normalize_worker, networks):
+            results[input_file] = counts
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return results
+
+
+def main(manifest_file, mapping_file, processes=1):
+    networks = read_manifest(manifest_file)
+    results = normalize_batch(networks, mapping_file, processes)
+    print('normalized %d networks' % len(results))
+
+
+class TestNormalizeNetworks(unittest.TestCase):
+
+    symbols = ('1\tAAA\tGene Name\n'
+               '2\tBBB\tGene Name\n'
+               '3\tCCC\tGene Name\n')
+
+    networks = ['aaa\tBBB\t1\nBBB\tAAA\t2\nCCC\tbbb\t2\n',
+                'AAA\tCCC\t0.5\n',
+                '']
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.symbols_file = os.path.join(self.tempdir, 'symbols.txt')
+        with open(self.symbols_file, 'w') as f:
+            f.write(self.symbols)
+
+        self.inputs = []
+        for i, network in enumerate(self.networks):
+            self.inputs.append(os.path.join(self.tempdir, 'network%d.txt.cleaned' % i))
+            with open(self.inputs[-1], 'w') as f:
+                f.write(network)
+
+        # each network normalized on its own
+        index = symbol_index.SymbolIndex(self.symbols_file)
+        self.expected = []
+        for input_file in self.inputs:
+            normalize_file(input_file, index, input_file + '.expected')
+            with open(input_file + '.expected') as f:
+                self.expected.append(f.read())
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def check_batch(self, processes):
+        outputs = [input_file + '.nn' for input_file in self.inputs]
+        logs = [output + '.log' for output in outputs]
+        manifest = os.path.join(self.tempdir, 'manifest.txt')
+        write_manifest(manifest, self.inputs, outputs, logs)
+
+        self.assertEqual(list(zip(self.inputs, outputs, logs)), read_manifest(manifest))
+
+        results = normalize_batch(read_manifest(manifest), self.symbols_file, processes)
+        self.assertEqual(set(self.inputs), set(results))
+
+        for output, log, expected in zip(outputs, logs, self.expected):
+            with open(output) as f:
+                self.assertEqual(expected, f.read())
+            self.assertTrue(os.path.exists(log))
+
+    def test_batch(self):
+        self.check_batch(1)
+
+    def test_pool(self):
+        self.check_batch(2)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='normalize a batch of interaction networks in one process')
+    parser.add_argument('manifest', help='tab delimited file of input, output, and optional log file per network')
+    parser.add_argument('mapping', help='clean identifiers file, or symbol index compiled from it')
+    parser.add_argument('--processes', type=int, default=1, help='number of worker processes, default 1')
+
+    args = parser.parse_args()
+    main(args.manifest, args.mapping, args.processes)
@@ -0,0 +1,111 @@
+'''
+clean, normalize, and compute the stats of a direct network in one
+process, in place of fix_weights.py, normalize_network.py and
+network_stats.py run one after the other, each reading the file the
+last one wrote. the network is read once and kept in memory between
+the steps, only the .nn and .stats files are written, with the same
+contents the separate steps give.
+
+the cleaned network can also be written with --cleaned, for debugging.
+'''
+
+import argparse, os
+import unittest, tempfile, shutil
+import numpy as np
+import pandas as pd
+import fix_weights, normalize_network, network_stats
+from identifiers import symbol_index
+
+
+def process(input_file, index, nn_file, stats_file, log_file=None, cleaned_file=None):
+    '''
+    index is a SymbolIndex of the clean identifiers. returns
+    the normalization counts and the network stats
+    '''
+
+    data = fix_weights.load_fixed(input_file)
+    if cleaned_file:
+        data.to_csv(cleaned_file, sep=fix_weights.SEP, header=False, index=False)
+
+    # genes as strings and weights as floats, as they'd be
+    # read back from the cleaned file
+    gene1 = data.iloc[:, 0].astype(str).to_numpy(dtype=object)
+    gene2 = data.iloc[:, 1].astype(str).to_numpy(dtype=object)
+    weights = pd.to_numeric(data.iloc[:, 2], errors='raise').to_numpy(dtype=np.float64)
+    del data
+
+    node1, node2, weights, counts = normalize_network.normalize(normalize_network.resolve_symbols(index, gene1),
+                                                                normalize_network.resolve_symbols(index, gene2),
+                                                                weights)
+
+    normalize_network.write_network(nn_file, node1, node2, weights)
+    if log_file:
+        normalize_network.write_log(log_file, counts)
+
+    stats = network_stats.NetworkStats()
+    stats.add(node1, node2, weights)
+    results = stats.results()
+    network_stats.write_stats(results, stats_file)
+
+    return counts, results
+
+
+def main(input_file, mapping_file, nn_file, stats_file, log_file=None, cleaned_file=None):
+    index = symbol_index.SymbolIndex(mapping_file)
+    process(input_file, index, nn_file, stats_file, log_file, cleaned_file)
+
+
+class TestProcessNetwork(unittest.TestCase):
+
+    symbols = ('1\tAAA\tGene Name\n'
+               '2\tBBB\tGene Name\n'
+               '3\t100\tEntrez Gene ID\n')
+
+    networks = {'two_columns': 'aaa\tBBB\nBBB\t100\n',
+                'weighted': 'aaa\tBBB\t1\nBBB\tAAA\t2.5\n100\tbbb\t1.0E-4\nAAA\tEEE\t1\n',
+                'empty': ''}
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.symbols_file = os.path.join(self.tempdir, 'symbols.txt')
+        with open(self.symbols_file, 'w') as f:
+            f.write(self.symbols)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self, filename):
+        with open(filename) as f:
+            return f.read()
+
+    def test_same_as_steps(self):
+        for name, network in self.networks.items():
+            base = os.path.join(self.tempdir, name + '.txt')
+            with open(base, 'w') as f:
+                f.write(network)
+
+            # each step on its own, through the intermediate files
+            fix_weights.main(base, base + '.cleaned', None)
+            normalize_network.main(base + '.cleaned', self.symbols_file, base + '.nn', base + '.nn.log')
+            network_stats.main(base + '.nn', base + '.nn.stats')
+
+            main(base, self.symbols_file, base + '.fused.nn', base + '.fused.nn.stats',
+                 base + '.fused.nn.log', base + '.fused.cleaned')
+
+            for suffix in ['.cleaned', '.nn', '.nn.log', '.nn.stats']:
+                self.assertEqual(self.read(base + suffix), self.read(base + '.fused' + suffix),
+                                 '%s%s' % (name, suffix))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='clean and normalize a network and compute its stats, in one process')
+    parser.add_argument('input', help='network file of gene symbol pairs, and weights if any')
+    parser.add_argument('mapping', help='clean identifiers file, or symbol index compiled from it')
+    parser.add_argument('nn', help='normalized network of node id pairs')
+    parser.add_argument('stats', help='network stats file')
+    parser.add_argument('--log', help='file to write counts of interactions dropped or collapsed')
+    parser.add_argument('--cleaned', help='also write the cleaned network, for debugging')
+
+    args = parser.parse_args()
+    main(args.input, args.mapping, args.nn, args.stats, args.log, args.cleaned)
@@ -0,0 +1,341 @@
+'''
+in-process alternative to the java ProfileToNetworkDriver, run as
+
+  ProfileToNetworkDriver -proftype continuous -cor pearson -threshold auto
+      -keepAllTies -limitTies -in profile -out p2n -syn symbols
+
+the profile has a header line of sample names, then a gene symbol and
+its values on each line. values that aren't numbers are missing.
+
+ * genes not in the clean identifiers are dropped, as are genes after
+   the first naming the same node, and genes with no variation
+ * missing values are taken as the gene's mean, so they add nothing
+   to its correlations
+ * each gene keeps its top partners by pearson correlation, 50 by
+   default, ignoring correlations <= 0. partners tied with the last
+   of them are all kept, unless that would take the gene past twice
+   the number of partners, in which case ties are broken by gene order
+ * the network is the union of the partners of each gene, each
+   interaction once, ordered by the gene's position in the profile
+
+output is gene symbol/gene symbol/correlation, like the java driver,
+to be normalized next.
+
+the correlations are computed a block of genes at a time as a matrix
+product with all the others, the standardized profile times its
+transpose, keeping only the top partners of the block. memory use is
+the profile plus a block, given by --memory, rather than the whole
+gene by gene matrix. blocks are processed by --threads threads, on
+top of any threading of the matrix multiplies by numpy's blas.
+'''
+
+import argparse, os
+import unittest, tempfile, shutil
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import pandas as pd
+from identifiers import symbol_index
+from normalize_network import resolve_symbols, format_weight, write_log
+from buildutils import str2bool
+
+TOP = 50
+
+# mb for the blocks of correlations being worked on
+MEMORY = 512
+
+
+def load_profile(filename):
+    '''
+    (symbols, values) of a profile file, values a genes by samples
+    float array with nan where missing
+    '''
+
+    # the header may or may not name the gene column, skip it and go by position
+    try:
+        profile = pd.read_csv(filename, sep='\t', header=None, skiprows=1, index_col=0, dtype={0: str},
+                              keep_default_na=False, na_values=['', 'NA', 'NaN', 'null'])
+    except pd.errors.EmptyDataError:
+        return np.zeros(0, dtype=object), np.zeros((0, 0))
+
+    # columns with anything else that isn't a number come back as strings
+    values = profile.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    return profile.index.to_numpy(dtype=object).astype(str), values
+
+
+def standardize(values, dtype=np.float64):
+    '''
+    each row centered, with missing values at the mean, and scaled to unit
+    length, so the dot product of two rows is their pearson correlation.
+    returns the rows with some variation, and a mask of which they are
+    '''
+
+    missing = np.isnan(values)
+    counts = (~missing).sum(axis=1)
+    sums = np.where(missing, 0, values).sum(axis=1)
+    means = np.divide(sums, counts, out=np.zeros(len(values)), where=counts > 0)
+
+    centered = np.where(missing, 0, values - means[:, None])
+    norms = np.sqrt((centered * centered).sum(axis=1))
+
+    # floating point leaves a constant row with a tiny norm rather than 0
+    varies = norms > 1e-12 * np.maximum(np.abs(means), 1) * np.sqrt(np.maximum(counts, 1))
+
+    return (centered[varies] / norms[varies, None]).astype(dtype), varies
+
+
+def top_partners(scores, top, keep_ties=True, limit_ties=True):
+    '''
+    (rows, columns) of the top positive scores of each row. ties with the
+    last of the top are kept if keep_ties, up to another top of them
+    with limit_ties, and otherwise broken by column order
+    '''
+
+    n = scores.shape[1]
+    top = min(top, n)
+    if top == 0 or len(scores) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    kth = np.partition(scores, n - top, axis=1)[:, n - top]
+    positive = kth > 0
+    threshold = np.where(positive, kth, 0)[:, None]
+
+    keep = scores > threshold
+    tied = (scores == threshold) & positive[:, None]
+
+    num_above = keep.sum(axis=1)
+    num_tied = tied.sum(axis=1)
+    wanted = top - num_above
+
+    if keep_ties:
+        limit = 2 * top if limit_ties else n
+        truncate = (num_tied > wanted) & (num_above + num_tied > limit)
+    else:
+        truncate = num_tied > wanted
+
+    keep |= tied & ~truncate[:, None]
+
+    rows = np.flatnonzero(truncate)
+    if len(rows):
+        first = tied[rows] & (np.cumsum(tied[rows], axis=1) <= wanted[rows, None])
+        keep[rows] |= first
+
+    return np.nonzero(keep)
+
+
+def block_rows(num_genes, dtype, memory=MEMORY, threads=1):
+    '''
+    genes per block for the blocks being worked on at once to fit in
+    memory mb. a block needs its correlations, a partitioned copy of
+    them, and a few masks
+    '''
+    per_row = num_genes * (2 * np.dtype(dtype).itemsize + 4)
+    return max(1, int(memory * 1024 * 1024 / threads // max(per_row, 1)))
+
+
+def correlation_network(z, top=TOP, keep_ties=True, limit_ties=True, block_size=None, threads=1):
+    '''
+    (gene1, gene2, correlation) arrays of the union of each gene's top
+    partners, gene1 < gene2, given z from standardize()
+    '''
+
+    n = len(z)
+    if block_size is None:
+        block_size = block_rows(n, z.dtype, threads=threads)
+
+    def process_block(start):
+        scores = z[start:start + block_size] @ z.T
+        rows = np.arange(len(scores))
+        scores[rows, rows + start] = -np.inf
+
+        rows, cols = top_partners(scores, top, keep_ties, limit_ties)
+        return rows + start, cols, scores[rows, cols].astype(np.float64)
+
+    starts = range(0, n, block_size)
+    if threads > 1:
+        with ThreadPool(threads) as pool:
+            blocks = pool.map(process_block, starts)
+    else:
+        blocks = [process_block(start) for start in starts]
+
+    if not blocks:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    return union_pairs(np.concatenate([block[0] for block in blocks]),
+                       np.concatenate([block[1] for block in blocks]),
+                       np.concatenate([block[2] for block in blocks]))
+
+
+def union_pairs(gene1, gene2, weights):
+    '''
+    each pair once, gene1 < gene2, ordered by genes. a pair chosen by
+    both genes can have correlations differing in the last bit, coming
+    from different blocks, the larger is kept
+    '''
+
+    lo, hi = np.minimum(gene1, gene2), np.maximum(gene1, gene2)
+    order = np.lexsort((-weights, hi, lo))
+    lo, hi, weights = lo[order], hi[order], weights[order]
+    first = np.concatenate(([True], (lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1]))) if len(lo) else np.zeros(0, dtype=bool)
+
+    return lo[first], hi[first], weights[first]
+
+
+def write_network(filename, gene1, gene2, weights):
+    with open(filename, 'w') as f:
+        f.writelines('%s\t%s\t%s\n' % (a, b, format_weight(w))
+                     for a, b, w in zip(gene1.tolist(), gene2.tolist(), weights.tolist()))
+
+
+def profile_to_network(input_file, index, output_file, log_file=None, top=TOP, keep_ties=True, limit_ties=True,
+                       dtype=np.float64, memory=MEMORY, threads=1):
+    '''
+    index is a SymbolIndex of the clean identifiers. returns
+    the counts written to the log
+    '''
+
+    symbols, values = load_profile(input_file)
+    counts = {'genes_read': len(symbols), 'samples': values.shape[1]}
+
+    node_ids = resolve_symbols(index, symbols)
+    mapped = node_ids >= 0
+    counts['unmapped_dropped'] = int((~mapped).sum())
+
+    # the first gene naming each node
+    first = np.zeros(len(symbols), dtype=bool)
+    first[np.flatnonzero(mapped)[np.unique(node_ids[mapped], return_index=True)[1]]] = True
+    counts['duplicates_dropped'] = int(mapped.sum() - first.sum())
+
+    symbols, values = symbols[first], values[first]
+    z, varies = standardize(values, dtype)
+    symbols = symbols[varies]
+    counts['constant_dropped'] = int((~varies).sum())
+    del values
+
+    gene1, gene2, weights = correlation_network(z, top, keep_ties, limit_ties,
+                                                block_rows(len(z), dtype, memory, threads), threads)
+    counts['interactions_written'] = len(weights)
+
+    write_network(output_file, symbols[gene1], symbols[gene2], weights)
+    if log_file:
+        write_log(log_file, counts)
+
+    return counts
+
+
+def main(input_file, mapping_file, output_file, log_file=None, top=TOP, keep_ties=True, limit_ties=True,
+         float32=False, memory=MEMORY, threads=1):
+    index = symbol_index.SymbolIndex(mapping_file)
+    profile_to_network(input_file, index, output_file, log_file, top, keep_ties, limit_ties,
+                       np.float32 if float32 else np.float64, memory, threads)
+
+
+class TestProfileToNetwork(unittest.TestCase):
+
+    symbols = ('1\tAAA\tGene Name\n'
+               '2\tBBB\tGene Name\n'
+               '3\tCCC\tGene Name\n'
+               '4\tDDD\tGene Name\n'
+               '4\tD2\tSynonym\n'
+               '5\tEEE\tGene Name\n')
+
+    profile = ('\ts1\ts2\ts3\ts4\n'
+               'aaa\t1\t2\t3\t4.5\n'
+               'BBB\t2\t4\tNA\t8\n'
+               'CCC\t4\t3\t2\t1\n'
+               'XXX\t1\t2\t3\t4\n'
+               'D2\t1\t1\t2\t2\n'
+               'DDD\t4\t3\t2\t2\n'
+               'EEE\t0.1\t0.1\t0.1\t?\n')
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_profile(self):
+        symbols_file = os.path.join(self.tempdir, 'symbols.txt')
+        with open(symbols_file, 'w') as f:
+            f.write(self.symbols)
+        profile_file = os.path.join(self.tempdir, 'profile.txt')
+        with open(profile_file, 'w') as f:
+            f.write(self.profile)
+
+        output_file = profile_file + '.p2n'
+        main(profile_file, symbols_file, output_file, output_file + '.log', top=1)
+
+        network = pd.read_csv(output_file, sep='\t', header=None)
+        self.assertEqual([('aaa', 'BBB'), ('aaa', 'D2')], list(zip(network[0], network[1])))
+        self.assertAlmostEqual(np.corrcoef([1, 2, 3, 4.5], [2, 4, 14 / 3.0, 8])[0, 1], network[2][0])
+
+        with open(output_file + '.log') as f:
+            self.assertEqual('genes_read = 7\nsamples = 4\nunmapped_dropped = 1\nduplicates_dropped = 1\n'
+                             'constant_dropped = 1\ninteractions_written = 2\n', f.read())
+
+    def test_top_partners(self):
+        scores = np.array([[-np.inf, 0.9, 0.5, 0.5, 0.5, 0.1],
+                           [0.9, -np.inf, 0.5, 0.5, 0.5, 0.5],
+                           [0.3, 0.2, -np.inf, -0.1, 0, -0.2]])
+
+        def partners(top, keep_ties, limit_ties):
+            rows, cols = top_partners(scores, top, keep_ties, limit_ties)
+            return [cols[rows == row].tolist() for row in range(len(scores))]
+
+        self.assertEqual([[1, 2], [0, 2], [0, 1]], partners(2, False, False))
+        self.assertEqual([[1, 2, 3, 4], [0, 2, 3, 4, 5], [0, 1]], partners(2, True, False))
+
+        # the second row would have 5, more than twice 2
+        self.assertEqual([[1, 2, 3, 4], [0, 2], [0, 1]], partners(2, True, True))
+
+        # only positive correlations
+        self.assertEqual([[1, 2, 3, 4, 5], [0, 2, 3, 4, 5], [0, 1]], partners(5, True, True))
+
+    def test_blocks(self):
+        rng = np.random.RandomState(0)
+        values = rng.rand(60, 12)
+        values[rng.rand(60, 12) < 0.05] = np.nan
+        z, varies = standardize(values)
+
+        # against the full correlation matrix, with missing values at the mean
+        filled = np.where(np.isnan(values), np.nanmean(values, axis=1)[:, None], values)
+        correlations = np.corrcoef(filled)
+        np.fill_diagonal(correlations, -np.inf)
+        pairs = set()
+        for gene, row in enumerate(correlations):
+            for partner in np.argsort(-row)[:5]:
+                if row[partner] > 0:
+                    pairs.add((min(gene, partner), max(gene, partner)))
+
+        gene1, gene2, weights = correlation_network(z, top=5)
+        self.assertEqual(sorted(pairs), list(zip(gene1.tolist(), gene2.tolist())))
+        self.assertTrue(np.allclose(correlations[gene1, gene2], weights))
+
+        for block_size, threads in [(1, 1), (7, 1), (7, 3), (100, 2)]:
+            blocked = correlation_network(z, top=5, block_size=block_size, threads=threads)
+            for expected, actual in zip((gene1, gene2, weights), blocked):
+                self.assertTrue(np.allclose(expected, actual, rtol=1e-12, atol=0))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='build a network from a profile, the top correlated partners of each gene')
+    parser.add_argument('input', help='profile file, a header of sample names then a gene and its values per line')
+    parser.add_argument('mapping', help='clean identifiers file, or symbol index compiled from it')
+    parser.add_argument('output', help='network of gene symbol pairs and correlations')
+    parser.add_argument('--log', help='file to write counts of genes dropped and interactions written')
+    parser.add_argument('--top', type=int, default=TOP,
+                        help='number of partners to keep per gene, default %d' % TOP)
+    parser.add_argument('--keep_ties', type=str2bool, default=True,
+                        help='keep partners tied with the last of the top, default true')
+    parser.add_argument('--limit_ties', type=str2bool, default=True,
+                        help='break ties that would take a gene past twice the top partners, default true')
+    parser.add_argument('--float32', action='store_true',
+                        help='compute correlations in single precision, half the memory and faster')
+    parser.add_argument('--memory', type=int, default=MEMORY,
+                        help='mb for the blocks of correlations being computed, default %d' % MEMORY)
+    parser.add_argument('--threads', type=int, default=1,
+                        help='number of blocks to compute at once, default 1')
+
+    args = parser.parse_args()
+    main(args.input, args.mapping, args.output, args.log, args.top, args.keep_ties, args.limit_ties,
+         args.float32, args.memory, args.threads)
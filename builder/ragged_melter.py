@@ -1,43 +1,145 @@
+'''
+melt a ragged file, with a variable number of values after the leading
+columns on each line, into a tall thin table of a line per value:
 
-import argparse
+  gene<tab>attr1<tab>attr2  ->  gene<tab>attr1
+                                gene<tab>attr2
+
+the input is read a line at a time and the output written through a
+buffer, so memory use doesn't depend on the size of the file.
+
+with --transpose each value is written before the leading columns,
+e.g. for attribute<tab>gene pairs from an attrib-gene-list file.
+
+many files can be melted in one go with --manifest, a tab delimited
+file with a line per file:
+
+  input<tab>output[<tab>transpose]
+
+where transpose is true or false, default false. --col and --keep
+apply to all the files.
+'''
+
+import argparse, csv
+import unittest, tempfile, shutil, os
+from buildutils import str2bool
 
 SEP = '\t'
 
+BUFFER_SIZE = 1024 * 1024
 
-def main(inputfile, outputfile, col, keep, logfile):
 
-    data = open(inputfile).read().splitlines()
+def melt(lines, col=1, keep=None, transpose=False):
+    '''
+    generator of the melted output lines of the given input lines
+    '''
 
-    with open(outputfile, 'w') as out:
+    for text in lines:
 
-        for line in data:
+        # split on the same line boundaries as str.splitlines()
+        for line in text.splitlines():
             parts = line.split(SEP)
 
             # skip lines with no ragged parts, including those that are too short
             if len(parts) < col:
                 continue
 
+            if keep is not None:
+                leading = [parts[j] for j in keep]
+            else:
+                leading = parts[:col]
+
             # write out
-            for i in range(col, len(parts)):
-                if keep is not None:
-                    newline_parts = [parts[j] for j in keep]
-                else:
-                    newline_parts = parts[:col]
+            if not leading:
+                prefix, suffix = '', '\n'
+            elif transpose:
+                prefix, suffix = '', SEP + SEP.join(leading) + '\n'
+            else:
+                prefix, suffix = SEP.join(leading) + SEP, '\n'
+
+            for value in parts[col:]:
+                yield prefix + value + suffix
+
+
+def melt_file(inputfile, outputfile, col=1, keep=None, transpose=False):
+    with open(inputfile) as f, open(outputfile, 'w', buffering=BUFFER_SIZE) as out:
+        out.writelines(melt(f, col, keep, transpose))
+
+
+def read_manifest(filename):
+    '''
+    list of (input, output, transpose) tuples
+    '''
+
+    files = []
+    with open(filename, encoding='UTF8', newline='') as f:
+        for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if not row:
+                continue
+            if len(row) not in (2, 3):
+                raise Exception('expected input, output, and optional transpose on manifest line: %s' % row)
+            files.append((row[0], row[1], str2bool(row[2]) if len(row) == 3 else False))
+
+    return files
+
 
-                newline_parts.append(parts[i])
-                out.write(SEP.join(newline_parts) + '\n')
+def main(inputfile, outputfile, col, keep, logfile, transpose=False):
+    melt_file(inputfile, outputfile, col, keep, transpose)
 
     # write summary log TODO
 
 
+def main_batch(manifest, col, keep):
+    files = read_manifest(manifest)
+    for inputfile, outputfile, transpose in files:
+        melt_file(inputfile, outputfile, col, keep, transpose)
+    print('melted %d files' % len(files))
+
+
+class TestRaggedMelter(unittest.TestCase):
+
+    data = 'AAA\tx\ty\n\nBBB\nCCC\tz\r\nDDD\tw\tv\n'
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.inputfile = os.path.join(self.tempdir, 'data.txt')
+        with open(self.inputfile, 'w', newline='') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self, filename):
+        with open(filename) as f:
+            return f.read()
+
+    def test_melt(self):
+        outputfile = self.inputfile + '.melted'
+        main(self.inputfile, outputfile, 1, None, None)
+        self.assertEqual('AAA\tx\nAAA\ty\nCCC\tz\nDDD\tw\nDDD\tv\n', self.read(outputfile))
+
+        self.assertEqual(['a\tb\tc\n', 'a\tb\td\n'], list(melt(['a\tb\tc\td'], col=2)))
+        self.assertEqual(['b\tc\n', 'b\td\n'], list(melt(['a\tb\tc\td'], col=2, keep=[1])))
+
+    def test_batch(self):
+        manifest = os.path.join(self.tempdir, 'manifest.txt')
+        with open(manifest, 'w') as f:
+            f.write('%s\t%s.melted\n' % (self.inputfile, self.inputfile))
+            f.write('%s\t%s.transposed\ttrue\n' % (self.inputfile, self.inputfile))
+
+        main_batch(manifest, 1, None)
+        self.assertEqual('AAA\tx\nAAA\ty\nCCC\tz\nDDD\tw\nDDD\tv\n', self.read(self.inputfile + '.melted'))
+        self.assertEqual('x\tAAA\ny\tAAA\nz\tCCC\nw\tDDD\nv\tDDD\n', self.read(self.inputfile + '.transposed'))
+
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='create a regular tabular data file from ragged input file')
 
-    parser.add_argument('inputfile', type=str,
+    parser.add_argument('inputfile', type=str, nargs='?',
                         help='input attribute file')
 
-    parser.add_argument('outputfile', type=str,
+    parser.add_argument('outputfile', type=str, nargs='?',
                         help='name of clean output file')
 
     parser.add_argument('--col', type=int, default=1,
@@ -46,8 +148,20 @@ if __name__ == '__main__':
     parser.add_argument('--keep', type=int, nargs='+', default=None,
                         help='for columns before --col, list of those to preserve in output, defaults to all if not given')
 
+    parser.add_argument('--transpose', type=str2bool, default=False,
+                        help='write each ragged value before the leading columns, default false')
+
+    parser.add_argument('--manifest', type=str,
+                        help='tab delimited file of input, output, and optional transpose flag per file to melt, in place of inputfile and outputfile')
+
     parser.add_argument('--log', type=str,
                         help='name of report log file')
 
     args = parser.parse_args()
-    main(args.inputfile, args.outputfile, args.col, args.keep, args.log)
+
+    if args.manifest:
+        main_batch(args.manifest, args.col, args.keep)
+    elif args.inputfile and args.outputfile:
+        main(args.inputfile, args.outputfile, args.col, args.keep, args.log, args.transpose)
+    else:
+        parser.error('inputfile and outputfile, or --manifest, are required')
@@ -3,15 +3,135 @@
 with IDs in the various metadata tables. Copy from processed data files to
 the corresponding final ID-named file.
 
-TODO: hardlink for performance/disk usage??
+the files can be published by copying (the default), hardlinking, or
+reflinking them on filesystems that support it (btrfs, xfs). links save
+the time and disk space of a second copy of every network. if a file
+can't be linked, e.g. the work and result folders are on different
+devices, it is copied instead. a hardlinked file is the same file as
+the one in work, so anything rewriting the work file in place changes
+the published file too.
+
+with --manifest, the size and md5 of each published file is written
+to a manifest, which the verify command checks the folder against.
 """
 
-import argparse, os, shutil
+import argparse, os, shutil, hashlib
+import unittest, tempfile
 import pandas as pd
 from buildutils import strip_key
 
+PUBLISH_MODES = ['copy', 'hardlink', 'reflink']
 
-def copy_interactions(mapfile, newdir, org_id, filenames, key_lstrip=None, key_rstrip=None):
+# linux ioctl to share the blocks of one file with another, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+BLOCK_SIZE = 1 << 20
+
+
+def reflink(filename, new_filename):
+    import fcntl
+
+    try:
+        with open(filename, 'rb') as src, open(new_filename, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        os.remove(new_filename)
+        raise
+
+    shutil.copymode(filename, new_filename)
+
+
+def publish(filename, new_filename, mode='copy'):
+    '''
+    copy or link filename to new_filename, returns the way it
+    was done, which is 'copy' when linking wasn't possible
+    '''
+
+    if mode not in PUBLISH_MODES:
+        raise Exception("unexpected publish mode: '%s'" % mode)
+
+    # not supported across devices or by some filesystems
+    if mode == 'hardlink':
+        try:
+            os.link(filename, new_filename)
+            return mode
+        except OSError:
+            pass
+    elif mode == 'reflink':
+        try:
+            reflink(filename, new_filename)
+            return mode
+        except (OSError, ImportError):
+            pass
+
+    shutil.copy(filename, new_filename)
+    return 'copy'
+
+
+def checksum(filename):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def write_manifest(manifest_file, newdir):
+    '''
+    name, size and md5 of each file in newdir
+    '''
+
+    with open(manifest_file, 'w', encoding='UTF8') as f:
+        f.write('filename\tsize\tmd5\n')
+        for name in sorted(os.listdir(newdir)):
+            filename = os.path.join(newdir, name)
+            f.write('%s\t%s\t%s\n' % (name, os.path.getsize(filename), checksum(filename)))
+
+
+def verify_manifest(manifest_file, newdir, checksums=True):
+    '''
+    list of problems with the files in newdir compared to the manifest,
+    empty if they all match. without checksums only the sizes are
+    checked, which doesn't need the files to be read
+    '''
+
+    manifest = pd.read_csv(manifest_file, sep='\t', dtype={'filename': str, 'md5': str}, na_filter=False)
+
+    problems = []
+    for name, size, md5 in manifest.itertuples(index=False):
+        filename = os.path.join(newdir, name)
+        if not os.path.exists(filename):
+            problems.append('missing: %s' % name)
+        elif os.path.getsize(filename) != size:
+            problems.append('size differs: %s' % name)
+        elif checksums and checksum(filename) != md5:
+            problems.append('checksum differs: %s' % name)
+
+    for name in sorted(set(os.listdir(newdir)) - set(manifest['filename'])):
+        problems.append('not in manifest: %s' % name)
+
+    return problems
+
+
+def publish_files(files, newdir, mode='copy', manifest_file=None):
+    '''
+    files is a list of (filename, new name) pairs
+    '''
+
+    modes = {}
+    for filename, name in files:
+        used = publish(filename, os.path.join(newdir, name), mode)
+        modes[used] = modes.get(used, 0) + 1
+
+    if mode != 'copy' and modes.get('copy'):
+        print('could not %s %d of %d files to %s, copied them instead' % (mode, modes['copy'], len(files), newdir))
+
+    if manifest_file:
+        write_manifest(manifest_file, newdir)
+
+
+def copy_interactions(mapfile, newdir, org_id, filenames, key_lstrip=None, key_rstrip=None,
+                      mode='copy', manifest_file=None):
 
     if os.path.exists(newdir):
         shutil.rmtree(newdir)
@@ -25,17 +145,13 @@ def copy_interactions(mapfile, newdir, org_id, filenames, key_lstrip=None, key_r
 
     assert len(joined) == len(metadata) == len(filenames)
 
-    for index, row in joined.iterrows():
-        network_id = row['id']
-        filename = row['filename']
-
-        link_name = os.path.join(newdir, '%s.%s.txt' % (org_id, network_id))
-        #os.symlink(filename, link_name)
-        shutil.copy(filename, link_name)
+    files = [(row['filename'], '%s.%s.txt' % (org_id, row['id'])) for index, row in joined.iterrows()]
+    publish_files(files, newdir, mode, manifest_file)
 
 
 # attributes
-def copy_attributes(mapfile, newdir, filenames, key_lstrip=None, key_rstrip=None):
+def copy_attributes(mapfile, newdir, filenames, key_lstrip=None, key_rstrip=None,
+                    mode='copy', manifest_file=None):
 
     if os.path.exists(newdir):
         shutil.rmtree(newdir)
@@ -49,13 +165,53 @@ def copy_attributes(mapfile, newdir, filenames, key_lstrip=None, key_rstrip=None
 
     assert len(joined) == len(metadata) == len(filenames)
 
-    for index, row in joined.iterrows():
-        id = row['id']
-        filename = row['filename']
+    files = [(row['filename'], '%s.txt' % (row['id'])) for index, row in joined.iterrows()]
+    publish_files(files, newdir, mode, manifest_file)
+
+
+class TestPublish(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.work = os.path.join(self.tempdir, 'work', 'networks')
+        os.makedirs(self.work)
+        self.filenames = []
+        for key, network in [('a', '1\t2\t0.5\n'), ('b', '3\t4\t1.0\n5\t6\t0.25\n')]:
+            filename = os.path.join(self.work, key + '.txt.nn')
+            with open(filename, 'w') as f:
+                f.write(network)
+            self.filenames.append(filename)
+
+        self.mapfile = os.path.join(self.tempdir, 'network_metadata.txt')
+        with open(self.mapfile, 'w') as f:
+            f.write('id\tdataset_key\n1\tnetworks/a\n2\tnetworks/b\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_modes(self):
+        for mode in PUBLISH_MODES:
+            newdir = os.path.join(self.tempdir, 'INTERACTIONS')
+            manifest_file = newdir + '.manifest.txt'
+            copy_interactions(self.mapfile, newdir, 4, self.filenames,
+                              os.path.join(self.tempdir, 'work') + '/', '.txt.nn', mode, manifest_file)
+
+            self.assertEqual(['4.1.txt', '4.2.txt'], sorted(os.listdir(newdir)))
+            with open(os.path.join(newdir, '4.2.txt')) as f:
+                self.assertEqual('3\t4\t1.0\n5\t6\t0.25\n', f.read())
 
-        link_name = os.path.join(newdir, '%s.txt' % (id))
-        #os.symlink(filename, link_name)
-        shutil.copy(filename, link_name)
+            linked = os.path.samefile(self.filenames[0], os.path.join(newdir, '4.1.txt'))
+            self.assertEqual(mode == 'hardlink', linked, mode)
+
+            self.assertEqual([], verify_manifest(manifest_file, newdir))
+
+        # same size, different contents
+        with open(os.path.join(newdir, '4.1.txt'), 'w') as f:
+            f.write('1\t2\t0.6\n')
+        os.remove(os.path.join(newdir, '4.2.txt'))
+
+        self.assertEqual(['missing: 4.2.txt'], verify_manifest(manifest_file, newdir, checksums=False))
+        self.assertEqual(['checksum differs: 4.1.txt', 'missing: 4.2.txt'], verify_manifest(manifest_file, newdir))
 
 
 if __name__ == '__main__':
@@ -83,6 +239,12 @@ if __name__ == '__main__':
     parser_interactions.add_argument('--key_rstrip', type=str,
                                 help='remove given string from right of filename to compute dataset key')
 
+    parser_interactions.add_argument('--mode', choices=PUBLISH_MODES, default='copy',
+                        help='copy files, or link them where possible, default copy')
+
+    parser_interactions.add_argument('--manifest', type=str,
+                        help='write the size and checksum of each published file to this file')
+
     # attribs
     parser_attribs = subparsers.add_parser('attribs')
     parser_attribs.add_argument('mapfile', type=str,
@@ -100,12 +262,37 @@ if __name__ == '__main__':
     parser_attribs.add_argument('--key_rstrip', type=str,
                         help='remove given string from right of filename to compute dataset key')
 
+    parser_attribs.add_argument('--mode', choices=PUBLISH_MODES, default='copy',
+                        help='copy files, or link them where possible, default copy')
+
+    parser_attribs.add_argument('--manifest', type=str,
+                        help='write the size and checksum of each published file to this file')
+
+    # check published files
+    parser_verify = subparsers.add_parser('verify')
+    parser_verify.add_argument('manifest', type=str,
+                        help='manifest written when the files were published')
+
+    parser_verify.add_argument('newdir', type=str,
+                        help='location of copied/linked files')
+
+    parser_verify.add_argument('--sizes_only', action='store_true',
+                        help='check file sizes but not checksums, without reading the files')
+
     args = parser.parse_args()
 
     if args.subparser_name == 'interactions':
-        copy_interactions(args.mapfile, args.newdir, args.orgid, args.filenames, args.key_lstrip, args.key_rstrip)
+        copy_interactions(args.mapfile, args.newdir, args.orgid, args.filenames, args.key_lstrip, args.key_rstrip,
+                          args.mode, args.manifest)
     elif args.subparser_name == 'attribs':
-        copy_attributes(args.mapfile, args.newdir, args.filenames, args.key_lstrip, args.key_rstrip)
+        copy_attributes(args.mapfile, args.newdir, args.filenames, args.key_lstrip, args.key_rstrip,
+                        args.mode, args.manifest)
+    elif args.subparser_name == 'verify':
+        problems = verify_manifest(args.manifest, args.newdir, not args.sizes_only)
+        for problem in problems:
+            print(problem)
+        if problems:
+            raise Exception('%d published files do not match %s' % (len(problems), args.manifest))
     else:
         raise Exception('unexpected command')
 
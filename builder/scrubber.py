@@ -9,26 +9,29 @@ of valid identifiers
 
 import argparse
 import pandas as pd
+from identifiers import symbol_index
 
 SEP = '\t'
 
 
 def main(inputfile, identsfile, outputfile, col, symbolcol, logfile):
 
-    idents = pd.read_csv(identsfile, sep=SEP, header=None, na_filter=False, dtype=str)
     indata = pd.read_csv(inputfile, sep=SEP, header=None, na_filter=False, dtype=str)
 
-    # upper case the columns we are filtering by, since we
-    # want case insensitive compare
-    idents['_upper'] = idents[symbolcol].str.upper()
-    indata['_upper'] = indata[col].str.upper()
-
-    # remove unknowns
-    clean_data = indata[indata['_upper'].isin(idents['_upper'])]
-    clean_data = clean_data.copy() # not a view so can change without causing pandas to complain
-
-    # drop the _upper column, write output
-    clean_data.drop('_upper', axis=1, inplace=True)
+    # case insensitive compare. the symbol index gives us that for the
+    # symbols column, otherwise upper case the column we filter by
+    if symbolcol == symbol_index.SYMBOL_COL:
+        index = symbol_index.SymbolIndex(identsfile)
+        known = index.contains(indata[col])
+    else:
+        if symbol_index.is_index(identsfile):
+            raise Exception('symbol column %d given, the symbol index %s only has column %d, pass the identifiers file instead' %
+                            (symbolcol + 1, identsfile, symbol_index.SYMBOL_COL + 1))
+        idents = pd.read_csv(identsfile, sep=SEP, header=None, na_filter=False, dtype=str)
+        known = indata[col].str.upper().isin(idents[symbolcol].str.upper())
+
+    # remove unknowns, write output
+    clean_data = indata[known]
     clean_data.to_csv(outputfile, sep=SEP, header=False, index=False)
 
     # write summary log TODO
@@ -42,7 +45,7 @@ if __name__ == '__main__':
                         help='input attribute file')
 
     parser.add_argument('identsfile', type=str,
-                        help='name of identifiers file')
+                        help='name of identifiers file, or symbol index compiled from it')
 
     parser.add_argument('outputfile', type=str,
                         help='name of clean output file')
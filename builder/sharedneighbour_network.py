@@ -0,0 +1,315 @@
+'''
+in-process alternative to the java ProfileToNetworkDriver for shared
+neighbour networks, run as
+
+  ProfileToNetworkDriver -proftype binary -cor pearson_bin_log_no_norm
+      -threshold auto -keepAllTies -limitTies -in profile -out p2n -syn symbols
+
+the profile lists gene/feature pairs, e.g. a gene and one of its protein
+domains, one per line. genes sharing features are linked:
+
+ * genes not in the clean identifiers are dropped. genes naming the
+   same node are merged, taking the first symbol and all the features
+ * each gene is a binary vector over the features, each feature weighted
+   by log(genes / genes with the feature), so rare features count more
+ * genes are scored by the pearson correlation of their weighted vectors,
+   and the top partners of each gene kept as for continuous profiles,
+   see profile_to_network.py
+
+two genes without a feature in common have a negative correlation, so
+only pairs with a shared feature can be linked. those come from the
+sparse product of the gene by feature matrix with its transpose, which
+is computed a block of genes at a time, by --processes processes.
+
+output is gene symbol/gene symbol/correlation, to be normalized next.
+'''
+
+import argparse, os, multiprocessing
+import unittest, tempfile, shutil
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from identifiers import symbol_index
+from normalize_network import resolve_symbols, write_log
+from profile_to_network import TOP, top_partners, union_pairs, write_network
+from buildutils import str2bool
+
+BLOCK_SIZE = 2000
+
+
+def load_incidence(filename):
+    '''
+    (symbols, incidence) of a gene/feature pairs file, symbols in order
+    of first appearance, incidence a binary genes by features csr matrix
+    '''
+
+    try:
+        pairs = pd.read_csv(filename, sep='\t', header=None, usecols=[0, 1], dtype=str, na_filter=False)
+    except pd.errors.EmptyDataError:
+        return np.zeros(0, dtype=object), sparse.csr_matrix((0, 0))
+
+    genes, symbols = pd.factorize(pairs[0])
+    features, feature_names = pd.factorize(pairs[1])
+
+    incidence = sparse.csr_matrix((np.ones(len(genes)), (genes, features)), shape=(len(symbols), len(feature_names)))
+    incidence.data[:] = 1
+    return np.asarray(symbols, dtype=object).astype(str), incidence
+
+
+def merge_genes(node_ids, incidence):
+    '''
+    the genes with a node id, the first of those naming each node taking
+    the features of the rest. returns the positions of the genes kept
+    and their incidence
+    '''
+
+    mapped = np.flatnonzero(node_ids >= 0)
+    nodes, first, inverse = np.unique(node_ids[mapped], return_index=True, return_inverse=True)
+
+    # keep the genes in profile order
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+
+    merge = sparse.csr_matrix((np.ones(len(mapped)), (rank[inverse.ravel()], mapped)),
+                              shape=(len(nodes), incidence.shape[0]))
+    merged = (merge @ incidence).tocsr()
+    merged.data[:] = 1
+
+    return mapped[first[order]], merged
+
+
+def weigh_features(incidence):
+    '''
+    incidence with each feature weighted by log(genes / genes with the feature)
+    '''
+
+    counts = np.asarray(incidence.sum(axis=0)).ravel()
+    weights = np.zeros(len(counts))
+    np.log(np.divide(incidence.shape[0], counts, out=np.ones(len(counts)), where=counts > 0), out=weights)
+    return (incidence @ sparse.diags(weights)).tocsr()
+
+
+def init_worker(profiles, block_size, top, keep_ties, limit_ties):
+    global worker_profiles, worker_options
+    worker_profiles = profiles
+    worker_options = (block_size, top, keep_ties, limit_ties)
+
+
+def block_worker(start):
+    '''
+    the top partners of a block of genes
+    '''
+
+    profiles, transposed, means, deviations, num_features = worker_profiles
+    block_size, top, keep_ties, limit_ties = worker_options
+
+    shared = (profiles[start:start + block_size] @ transposed).tocoo()
+    rows, cols = shared.row, shared.col
+    correlations = ((shared.data - num_features * means[rows + start] * means[cols]) /
+                    (deviations[rows + start] * deviations[cols]))
+
+    keep = (correlations > 0) & (rows + start != cols)
+    rows, cols, correlations = top_entries(rows[keep], cols[keep], correlations[keep], shared.shape[0],
+                                           top, keep_ties, limit_ties)
+    return rows + start, cols, correlations
+
+
+def top_entries(rows, cols, values, num_rows, top, keep_ties=True, limit_ties=True):
+    '''
+    the sparse equivalent of top_partners(), the (rows, columns, values)
+    of the top values in each row, ties treated the same
+    '''
+
+    order = np.lexsort((cols, -values, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+
+    counts = np.bincount(rows, minlength=num_rows)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    has = counts > 0
+
+    kth = np.full(num_rows, np.inf)
+    kth[has] = values[starts[has] + np.minimum(counts[has], top) - 1]
+
+    above = values > kth[rows]
+    tied = values == kth[rows]
+    num_above = np.bincount(rows[above], minlength=num_rows)
+    num_tied = np.bincount(rows[tied], minlength=num_rows)
+    wanted = top - num_above
+
+    if keep_ties:
+        limit = 2 * top if limit_ties else np.inf
+        truncate = (num_tied > wanted) & (num_above + num_tied > limit)
+    else:
+        truncate = num_tied > wanted
+
+    # ties come after the values above, in column order
+    tie_rank = np.arange(len(rows)) - starts[rows] - num_above[rows]
+    keep = above | (tied & (~truncate[rows] | (tie_rank < wanted[rows])))
+
+    return rows[keep], cols[keep], values[keep]
+
+
+def shared_neighbour_network(incidence, top=TOP, keep_ties=True, limit_ties=True, processes=1,
+                             block_size=BLOCK_SIZE):
+    '''
+    (gene1, gene2, correlation) arrays of the union of each gene's top
+    partners, gene1 < gene2, and a mask of the genes that vary
+    '''
+
+    profiles = weigh_features(incidence)
+    num_features = profiles.shape[1]
+
+    sums = np.asarray(profiles.sum(axis=1)).ravel()
+    squares = np.asarray(profiles.multiply(profiles).sum(axis=1)).ravel()
+    means = sums / max(num_features, 1)
+    variances = squares - num_features * means * means
+
+    # a gene with every feature, or only features every gene has
+    varies = variances > 1e-12 * squares
+    deviations = np.where(varies, np.sqrt(np.maximum(variances, 0)), np.inf)
+
+    profiles = (sparse.diags(varies.astype(np.float64)) @ profiles).tocsr()
+    worker_profiles = (profiles, profiles.T.tocsr(), means, deviations, num_features)
+    starts = range(0, profiles.shape[0], block_size)
+
+    if processes <= 1 or len(starts) <= 1:
+        init_worker(worker_profiles, block_size, top, keep_ties, limit_ties)
+        blocks = [block_worker(start) for start in starts]
+    else:
+        pool = multiprocessing.Pool(min(processes, len(starts)), init_worker,
+                                    (worker_profiles, block_size, top, keep_ties, limit_ties))
+        try:
+            blocks = pool.map(block_worker, starts)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    if not blocks:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), varies
+
+    gene1, gene2, weights = union_pairs(np.concatenate([block[0] for block in blocks]),
+                                        np.concatenate([block[1] for block in blocks]),
+                                        np.concatenate([block[2] for block in blocks]))
+    return gene1, gene2, weights, varies
+
+
+def sharedneighbour_to_network(input_file, index, output_file, log_file=None, top=TOP, keep_ties=True,
+                               limit_ties=True, processes=1):
+    '''
+    index is a SymbolIndex of the clean identifiers. returns
+    the counts written to the log
+    '''
+
+    symbols, incidence = load_incidence(input_file)
+    counts = {'genes_read': len(symbols), 'features': incidence.shape[1]}
+
+    node_ids = resolve_symbols(index, symbols)
+    counts['unmapped_dropped'] = int((node_ids < 0).sum())
+
+    kept, incidence = merge_genes(node_ids, incidence)
+    counts['duplicates_merged'] = int((node_ids >= 0).sum() - len(kept))
+    symbols = symbols[kept]
+
+    gene1, gene2, weights, varies = shared_neighbour_network(incidence, top, keep_ties, limit_ties, processes)
+    counts['constant_dropped'] = int((~varies).sum())
+    counts['interactions_written'] = len(weights)
+
+    write_network(output_file, symbols[gene1], symbols[gene2], weights)
+    if log_file:
+        write_log(log_file, counts)
+
+    return counts
+
+
+def main(input_file, mapping_file, output_file, log_file=None, top=TOP, keep_ties=True, limit_ties=True,
+         processes=1):
+    index = symbol_index.SymbolIndex(mapping_file)
+    sharedneighbour_to_network(input_file, index, output_file, log_file, top, keep_ties, limit_ties, processes)
+
+
+class TestSharedNeighbourNetwork(unittest.TestCase):
+
+    symbols = ('1\tAAA\tGene Name\n'
+               '2\tBBB\tGene Name\n'
+               '3\tCCC\tGene Name\n'
+               '3\tC2\tSynonym\n'
+               '4\tDDD\tGene Name\n')
+
+    # every gene has PF0, which adds nothing. DDD has only that,
+    # and only XXX, which is dropped, has PF4
+    profile = ('aaa\tPF0\naaa\tPF1\naaa\tPF2\n'
+               'BBB\tPF0\nBBB\tPF1\nBBB\tPF2\nBBB\tPF3\n'
+               'CCC\tPF0\nXXX\tPF0\nXXX\tPF4\nC2\tPF3\n'
+               'DDD\tPF0\n')
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_profile(self):
+        symbols_file = os.path.join(self.tempdir, 'symbols.txt')
+        with open(symbols_file, 'w') as f:
+            f.write(self.symbols)
+        profile_file = os.path.join(self.tempdir, 'profile.txt')
+        with open(profile_file, 'w') as f:
+            f.write(self.profile)
+
+        output_file = profile_file + '.p2n'
+        main(profile_file, symbols_file, output_file, output_file + '.log')
+
+        # CCC and C2 merged, sharing only PF3 with BBB
+        network = pd.read_csv(output_file, sep='\t', header=None)
+        self.assertEqual([('aaa', 'BBB'), ('BBB', 'CCC')], list(zip(network[0], network[1])))
+
+        with open(output_file + '.log') as f:
+            self.assertEqual('genes_read = 6\nfeatures = 5\nunmapped_dropped = 1\nduplicates_merged = 1\n'
+                             'constant_dropped = 1\ninteractions_written = 2\n', f.read())
+
+    def test_parity(self):
+        # against the dense correlations of the weighted profiles, with
+        # some genes having the same features for ties
+        rng = np.random.RandomState(0)
+        incidence = (rng.rand(90, 40) < 0.08).astype(np.float64)
+        incidence[60:75] = incidence[:15]
+        incidence[:, 0] = 1
+        incidence = sparse.csr_matrix(incidence)
+
+        profiles = weigh_features(incidence).toarray()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            correlations = np.corrcoef(profiles)
+        correlations[np.isnan(correlations)] = -np.inf
+        np.fill_diagonal(correlations, -np.inf)
+
+        for top, keep_ties, limit_ties in [(3, True, True), (3, True, False), (3, False, False), (10, True, True)]:
+            rows, cols = top_partners(correlations, top, keep_ties, limit_ties)
+            expected = union_pairs(rows, cols, correlations[rows, cols])
+
+            for processes, block_size in [(1, BLOCK_SIZE), (1, 7), (3, 20)]:
+                actual = shared_neighbour_network(incidence, top, keep_ties, limit_ties, processes, block_size)
+                self.assertEqual(list(zip(expected[0].tolist(), expected[1].tolist())),
+                                 list(zip(actual[0].tolist(), actual[1].tolist())))
+                self.assertTrue(np.allclose(expected[2], actual[2], rtol=1e-12, atol=0))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='build a network from gene/feature pairs, linking genes with shared features')
+    parser.add_argument('input', help='profile file of gene/feature pairs')
+    parser.add_argument('mapping', help='clean identifiers file, or symbol index compiled from it')
+    parser.add_argument('output', help='network of gene symbol pairs and correlations')
+    parser.add_argument('--log', help='file to write counts of genes dropped and interactions written')
+    parser.add_argument('--top', type=int, default=TOP,
+                        help='number of partners to keep per gene, default %d' % TOP)
+    parser.add_argument('--keep_ties', type=str2bool, default=True,
+                        help='keep partners tied with the last of the top, default true')
+    parser.add_argument('--limit_ties', type=str2bool, default=True,
+                        help='break ties that would take a gene past twice the top partners, default true')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of processes computing blocks of genes, default 1')
+
+    args = parser.parse_args()
+    main(args.input, args.mapping, args.output, args.log, args.top, args.keep_ties, args.limit_ties,
+         args.processes)
@@ -4,16 +4,25 @@ create a clean description file, containing only descriptions
 for those attributes present after cleaning, and with empty descriptions
 for any attributes lacking descriptions at all. Add an internal ID column
 enumerating the attributes.
+
+given --mapping, the attribute file is scrubbed of unknown genes
+as it's read, so a melted file can be used in place of the
+.scrubbed file when that isn't written.
 '''
 
 import argparse
 import pandas as pd
+from identifiers import symbol_index
 
 
-def main(attribute_file, description_file, output_file):
+def main(attribute_file, description_file, output_file, mapping_file=None):
 
     attribs = pd.read_csv(attribute_file, sep='\t', header=None, na_filter=False,
-                          names=['GENE', 'ATTRIBUTE'])
+                          names=['GENE', 'ATTRIBUTE'], dtype={'GENE': str})
+
+    if mapping_file:
+        index = symbol_index.SymbolIndex(mapping_file)
+        attribs = attribs[index.contains(attribs['GENE'])]
 
     descs = pd.read_csv(description_file, sep='\t', header=None, na_filter=False,
                         names=['ATTRIBUTE', 'NAME', 'DESCRIPTION'])
@@ -54,5 +63,8 @@ if __name__ == '__main__':
     parser.add_argument('output', type=str,
                         help='clean description file')
 
+    parser.add_argument('--mapping', type=str,
+                        help='identifiers file or symbol index to scrub the attribute file against')
+
     args = parser.parse_args()
-    main(args.attrib, args.desc, args.output)
+    main(args.attrib, args.desc, args.output, args.mapping)